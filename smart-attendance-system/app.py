@@ -1,22 +1,127 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
-import cv2
-import numpy as np
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
+import atexit
 import base64
-from PIL import Image
+import csv
 import io
-import pickle
+import json
+import threading
+import zipfile
 import os
-import re
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from config.database import DatabaseConfig
 from utils.face_utils import FaceRecognitionUtils
+from utils.gallery import FaceGallery
+from utils.presence import PresenceSet
+from utils.attendance_writer import AttendanceWriter
+from utils import attendance_rollups, gallery_changes
+from utils.pagination import Page, decode_cursor, page_size
+from utils.validation import registration_error
+from utils.bulk_enrollment import BulkEnrollment, PhotoSource, read_roster
+from utils.encoding_codec import encode_face_encoding
+from utils.frame_buffer import LatestFrameBuffer
+from utils.face_tracker import FaceTracker
+from utils.face_quality import QUALITY_MESSAGES
+from utils.face_crop import FACE_CROP_MIMETYPE, parse_face_crop
+from utils.recognition_pool import RecognitionPool
+from utils.camera import CameraGrabber
+from utils.result_cache import RecognitionCache, fingerprint
+from utils.metrics import REGISTRY, REQUEST_SECONDS, STAGE_SECONDS
+from utils.warmup import Warmup
 
 app = Flask(__name__, template_folder='app/templates', static_folder='app/static')
 app.secret_key = 'your-secret-key-here'
+sock = Sock(app)
 
 # Initialize database
 db_config = DatabaseConfig()
 face_utils = FaceRecognitionUtils()
+face_gallery = FaceGallery(db_config)
+# ATTENDANCE_WRITE_BEHIND=1 queues attendance rows for a background writer
+# that commits them in batches, instead of committing inside each check-in
+attendance_writer = None
+if os.getenv('ATTENDANCE_WRITE_BEHIND', '0') == '1':
+    attendance_writer = AttendanceWriter(
+        db_config,
+        journal_dir=os.getenv('ATTENDANCE_JOURNAL_DIR', 'attendance_journal'),
+        flush_interval=int(os.getenv('ATTENDANCE_FLUSH_MS', '50')) / 1000,
+        batch_size=int(os.getenv('ATTENDANCE_FLUSH_ROWS', '200')),
+        fsync=os.getenv('ATTENDANCE_JOURNAL_FSYNC', '0') == '1'
+    )
+# Users marked present today, so repeat check-ins don't query the database
+presence = PresenceSet(db_config, attendance_writer)
+# RECOGNITION_WORKERS > 0 moves detection/encoding/matching into worker processes
+recognition = RecognitionPool(face_gallery, face_utils, workers=int(os.getenv('RECOGNITION_WORKERS', '0')))
+# Recent check-in results, reused for a near-identical photo sent again
+# within RESULT_CACHE_TTL seconds (double clicks, retries); 0 entries disables
+result_cache = None
+if int(os.getenv('RESULT_CACHE_SIZE', '256')) > 0:
+    result_cache = RecognitionCache(max_entries=int(os.getenv('RESULT_CACHE_SIZE', '256')),
+                                    ttl=float(os.getenv('RESULT_CACHE_TTL', '3')))
+# Camera on the server for /mark_attendance: opened on first use and kept
+# open, released after CAMERA_IDLE_TIMEOUT seconds unused. CAMERA_SOURCE is
+# a device index, a video file or 'synthetic' (default: first device found)
+camera = CameraGrabber(os.getenv('CAMERA_SOURCE') or None,
+                       idle_timeout=float(os.getenv('CAMERA_IDLE_TIMEOUT', '300')))
+atexit.register(camera.stop)
+
+# Gauges read at scrape time, so they cost nothing between scrapes
+REGISTRY.gauge('attendance_gallery_faces', 'Enrolled faces in the recognition index',
+               callback=lambda: len(face_gallery))
+REGISTRY.gauge('attendance_result_cache_entries', 'Check-in results held for repeated photos',
+               callback=lambda: len(result_cache) if result_cache is not None else None)
+REGISTRY.gauge('attendance_db_pool', 'Database connection pool statistics', ['stat'],
+               callback=lambda: {(stat,): value for stat, value in (db_config.pool_stats() or {}).items()} or None)
+
+# Saved copy of the gallery, memory-mapped at startup while it still
+# matches the users table (empty disables it)
+GALLERY_SNAPSHOT_DIR = os.getenv('GALLERY_SNAPSHOT_DIR', 'gallery_snapshot')
+
+def check_schema():
+    # DB_SCHEMA_CHECK=0 skips this once the tables are known to exist
+    if os.getenv('DB_SCHEMA_CHECK', '1') == '1':
+        db_config.create_database()
+        db_config.create_tables()
+
+def load_gallery():
+    if GALLERY_SNAPSHOT_DIR and face_gallery.load_snapshot(GALLERY_SNAPSHOT_DIR):
+        print(f"Loaded {len(face_gallery)} face(s) from gallery snapshot")
+    else:
+        face_gallery.refresh()
+    if GALLERY_SNAPSHOT_DIR:
+        face_gallery.save_snapshot(GALLERY_SNAPSHOT_DIR)
+        atexit.register(face_gallery.save_snapshot, GALLERY_SNAPSHOT_DIR)
+
+def start_attendance_writer():
+    if attendance_writer is not None:
+        # Replays rows journaled but not written before the last shutdown
+        attendance_writer.start()
+
+# Startup work done in the background rather than on the first requests
+warmup = Warmup([
+    ('schema', check_schema),
+    ('attendance_writer', start_attendance_writer),
+    ('presence', presence.warm),
+    ('gallery', load_gallery),
+    ('recognition', recognition.warm),
+])
+
+# Rows fetched per round trip when streaming a CSV export
+EXPORT_CHUNK_ROWS = 1000
+
+# Photo encoding processes for bulk enrollment (default: one per core)
+BULK_ENROLL_WORKERS = int(os.getenv('BULK_ENROLL_WORKERS', str(os.cpu_count() or 1)))
+
+@app.before_request
+def start_warmup():
+    # For servers that import the app without running __main__ (e.g. gunicorn)
+    warmup.start()
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once startup work is done, 503 before"""
+    return jsonify(warmup.status()), 200 if warmup.ready else 503
 
 @app.route('/')
 def index():
@@ -31,18 +136,16 @@ def admin_dashboard():
     if 'admin_logged_in' not in session:
         return redirect(url_for('admin_login'))
     
-    connection = db_config.get_connection()
-    cursor = connection.cursor()
-    
-    # Get statistics
-    cursor.execute("SELECT COUNT(*) FROM users")
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM attendance WHERE date = %s", (date.today(),))
-    today_attendance = cursor.fetchone()[0]
-    
-    cursor.close()
-    connection.close()
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        
+        # Get statistics
+        cursor.execute("SELECT COUNT(*) FROM users")
+        total_users = cursor.fetchone()[0]
+        
+        today_attendance = attendance_rollups.daily_total(cursor, date.today())
+        
+        cursor.close()
     
     return render_template('admin_dashboard.html', 
                          total_users=total_users, 
@@ -53,63 +156,179 @@ def admin_users():
     if 'admin_logged_in' not in session:
         return redirect(url_for('admin_login'))
     
-    connection = db_config.get_connection()
-    cursor = connection.cursor()
-    cursor.execute("SELECT id, name, email, roll_number, created_at FROM users ORDER BY created_at DESC")
-    users = cursor.fetchall()
-    cursor.close()
-    connection.close()
+    size = page_size(request.args.get('per_page'))
+    key, shown = decode_cursor(request.args.get('cursor'))
+    
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        # Newest first; ids follow registration order and are the page key
+        after, params = '', ()
+        if key is not None:
+            after, params = 'WHERE id < %s', (key[0],)
+        cursor.execute(f"""
+            SELECT id, name, email, roll_number, created_at FROM users
+            {after}
+            ORDER BY id DESC 
+            LIMIT %s
+        """, (*params, size + 1))
+        page = Page(cursor.fetchall(), size, shown, lambda user: (user[0],))
+        
+        cursor.execute("SELECT COUNT(*) FROM users")
+        total_users = cursor.fetchone()[0]
+        cursor.close()
     
-    return render_template('admin_users.html', users=users)
+    return render_template('admin_users.html', users=page.rows, page=page, total_users=total_users)
 
 @app.route('/admin/today_report')
 def admin_today_report():
     if 'admin_logged_in' not in session:
         return redirect(url_for('admin_login'))
     
-    connection = db_config.get_connection()
-    cursor = connection.cursor()
-    cursor.execute("""
-        SELECT u.name, u.roll_number, a.time 
-        FROM attendance a 
-        JOIN users u ON a.user_id = u.id 
-        WHERE a.date = %s 
-        ORDER BY a.time DESC
-    """, (date.today(),))
-    attendance_records = cursor.fetchall()
-    cursor.close()
-    connection.close()
+    today = date.today()
+    size = page_size(request.args.get('per_page'))
+    key, shown = decode_cursor(request.args.get('cursor'))
+    
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        # Latest check-ins first; ids follow check-in order and are the page key
+        after, params = '', ()
+        if key is not None:
+            after, params = 'AND a.id < %s', (key[0],)
+        cursor.execute(f"""
+            SELECT u.name, u.roll_number, a.time, a.id 
+            FROM attendance a 
+            JOIN users u ON a.user_id = u.id 
+            WHERE a.date = %s {after}
+            ORDER BY a.id DESC 
+            LIMIT %s
+        """, (today, *params, size + 1))
+        page = Page(cursor.fetchall(), size, shown, lambda record: (record[3],))
+        
+        total_present = attendance_rollups.daily_total(cursor, today)
+        cursor.close()
     
     return render_template('admin_today_report.html', 
-                         attendance_records=attendance_records,
-                         report_date=date.today())
+                         attendance_records=page.rows,
+                         page=page,
+                         total_present=total_present,
+                         report_date=today)
 
 @app.route('/admin/monthly_report')
 def admin_monthly_report():
     if 'admin_logged_in' not in session:
         return redirect(url_for('admin_login'))
     
-    connection = db_config.get_connection()
-    cursor = connection.cursor()
-    
-    # Get current month's attendance
-    cursor.execute("""
-        SELECT u.name, u.roll_number, COUNT(a.id) as days_present
-        FROM users u
-        LEFT JOIN attendance a ON u.id = a.user_id 
-            AND MONTH(a.date) = MONTH(CURDATE()) 
-            AND YEAR(a.date) = YEAR(CURDATE())
-        GROUP BY u.id, u.name, u.roll_number
-        ORDER BY u.name
-    """)
-    monthly_records = cursor.fetchall()
-    cursor.close()
-    connection.close()
+    today = date.today()
+    size = page_size(request.args.get('per_page'))
+    key, shown = decode_cursor(request.args.get('cursor'), key_length=2)
+    
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        
+        # Get current month's attendance from the per-user monthly summary,
+        # one page of users at a time in (name, id) order
+        after, params = '', ()
+        if key is not None:
+            after, params = 'WHERE u.name > %s OR (u.name = %s AND u.id > %s)', (key[0], key[0], key[1])
+        cursor.execute(f"""
+            SELECT u.name, u.roll_number, COALESCE(m.days_present, 0) as days_present, u.id
+            FROM users u
+            LEFT JOIN attendance_monthly_user m ON u.id = m.user_id 
+                AND m.year = %s 
+                AND m.month = %s
+            {after}
+            ORDER BY u.name, u.id
+            LIMIT %s
+        """, (today.year, today.month, *params, size + 1))
+        page = Page(cursor.fetchall(), size, shown, lambda record: (record[0], record[3]))
+        
+        cursor.execute("SELECT COUNT(*) FROM users")
+        total_users = cursor.fetchone()[0]
+        cursor.close()
     
+    month_start = today.replace(day=1)
     return render_template('admin_monthly_report.html', 
-                         monthly_records=monthly_records,
+                         monthly_records=page.rows,
+                         page=page,
+                         total_users=total_users,
+                         month_start=month_start,
+                         report_date=today,
                          current_month=datetime.now().strftime('%B %Y'))
 
+def format_time_value(value):
+    """HH:MM:SS for a TIME column (MySQL returns a timedelta, SQLite a string)"""
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+    if hasattr(value, 'strftime'):
+        return value.strftime('%H:%M:%S')
+    return str(value)[:8] if value is not None else ''
+
+def stream_attendance_csv(connection, start, end):
+    """Yield the attendance between two dates as CSV text, a chunk at a time.
+    
+    Rows are read from an unbuffered (server-side) cursor with fetchmany(),
+    so only one chunk is ever held in memory. The connection is given back
+    when the export finishes, or closed if the client goes away mid-way.
+    """
+    finished = False
+    try:
+        cursor = connection.cursor(buffered=False)
+        cursor.execute("""
+            SELECT a.date, a.time, u.name, u.roll_number, u.email, a.status
+            FROM attendance a
+            LEFT JOIN users u ON a.user_id = u.id
+            WHERE a.date BETWEEN %s AND %s
+            ORDER BY a.date, a.id
+        """, (start, end))
+        
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # Byte order mark so Excel opens the file as UTF-8
+        buffer.write('\ufeff')
+        writer.writerow(['Date', 'Time', 'Name', 'Roll Number', 'Email', 'Status'])
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            for day, check_in_time, name, roll_number, email, status in rows:
+                writer.writerow([day, format_time_value(check_in_time), name, roll_number, email, status])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        cursor.close()
+        finished = True
+    finally:
+        if finished:
+            connection.close()
+        else:
+            # Unread rows are still pending on the connection
+            db_config.discard_connection(connection)
+
+@app.route('/admin/export_attendance')
+def export_attendance():
+    if 'admin_logged_in' not in session:
+        return redirect(url_for('admin_login'))
+    
+    today = date.today().isoformat()
+    try:
+        start = date.fromisoformat(request.args.get('start') or today)
+        end = date.fromisoformat(request.args.get('end') or today)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be in YYYY-MM-DD format'}), 400
+    if end < start:
+        return jsonify({'success': False, 'message': 'End date is before start date'}), 400
+    
+    connection = db_config.get_connection()
+    if connection is None:
+        return jsonify({'success': False, 'message': 'Database unavailable'}), 503
+    
+    return Response(stream_attendance_csv(connection, start, end), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename=attendance_{start}_{end}.csv'
+    })
+
 @app.route('/admin/settings')
 def admin_settings():
     if 'admin_logged_in' not in session:
@@ -133,27 +352,30 @@ def clear_attendance():
     date_value = data.get('date', None)
     
     try:
-        connection = db_config.get_connection()
-        cursor = connection.cursor()
-        
-        if clear_type == 'date' and date_value:
-            cursor.execute("DELETE FROM attendance WHERE date = %s", (date_value,))
-            affected = cursor.rowcount
-            connection.commit()
-            cursor.close()
-            connection.close()
-            return jsonify({'success': True, 'message': f'Cleared {affected} attendance record(s) for {date_value}'})
-        elif clear_type == 'all':
-            cursor.execute("DELETE FROM attendance")
-            affected = cursor.rowcount
-            connection.commit()
-            cursor.close()
-            connection.close()
-            return jsonify({'success': True, 'message': f'Cleared all {affected} attendance records'})
-        else:
-            cursor.close()
-            connection.close()
-            return jsonify({'success': False, 'message': 'Invalid request'})
+        # Queued check-ins must land before rows are deleted, not after
+        presence.flush()
+        with db_config.connection() as connection:
+            cursor = connection.cursor()
+            
+            if clear_type == 'date' and date_value:
+                cursor.execute("DELETE FROM attendance WHERE date = %s", (date_value,))
+                affected = cursor.rowcount
+                attendance_rollups.rebuild(cursor, since=date.fromisoformat(date_value))
+                connection.commit()
+                cursor.close()
+                presence.invalidate()
+                return jsonify({'success': True, 'message': f'Cleared {affected} attendance record(s) for {date_value}'})
+            elif clear_type == 'all':
+                cursor.execute("DELETE FROM attendance")
+                affected = cursor.rowcount
+                attendance_rollups.rebuild(cursor)
+                connection.commit()
+                cursor.close()
+                presence.invalidate()
+                return jsonify({'success': True, 'message': f'Cleared all {affected} attendance records'})
+            else:
+                cursor.close()
+                return jsonify({'success': False, 'message': 'Invalid request'})
             
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
@@ -168,32 +390,40 @@ def delete_user():
     user_id = data.get('user_id', None)
     
     try:
-        connection = db_config.get_connection()
-        cursor = connection.cursor()
-        
-        if delete_type == 'single' and user_id:
-            # Delete user's attendance first
-            cursor.execute("DELETE FROM attendance WHERE user_id = %s", (user_id,))
-            # Delete user
-            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-            connection.commit()
-            cursor.close()
-            connection.close()
-            return jsonify({'success': True, 'message': 'User deleted successfully'})
-        elif delete_type == 'all':
-            # Delete all attendance first
-            cursor.execute("DELETE FROM attendance")
-            # Delete all users
-            cursor.execute("DELETE FROM users")
-            affected = cursor.rowcount
-            connection.commit()
-            cursor.close()
-            connection.close()
-            return jsonify({'success': True, 'message': f'Deleted all {affected} users'})
-        else:
-            cursor.close()
-            connection.close()
-            return jsonify({'success': False, 'message': 'Invalid request'})
+        # Queued check-ins must land before rows are deleted, not after
+        presence.flush()
+        with db_config.connection() as connection:
+            cursor = connection.cursor()
+            
+            if delete_type == 'single' and user_id:
+                # Delete user's attendance first
+                attendance_rollups.forget_user(cursor, user_id)
+                cursor.execute("DELETE FROM attendance WHERE user_id = %s", (user_id,))
+                # Delete user
+                cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+                gallery_changes.record(cursor, 'remove', [user_id])
+                connection.commit()
+                cursor.close()
+                face_gallery.remove(user_id)
+                presence.discard(user_id)
+                return jsonify({'success': True, 'message': 'User deleted successfully'})
+            elif delete_type == 'all':
+                # Delete all attendance first
+                cursor.execute("DELETE FROM attendance_daily_totals")
+                cursor.execute("DELETE FROM attendance_monthly_user")
+                cursor.execute("DELETE FROM attendance")
+                # Delete all users
+                cursor.execute("DELETE FROM users")
+                affected = cursor.rowcount
+                gallery_changes.record(cursor, 'clear')
+                connection.commit()
+                cursor.close()
+                face_gallery.clear()
+                presence.invalidate()
+                return jsonify({'success': True, 'message': f'Deleted all {affected} users'})
+            else:
+                cursor.close()
+                return jsonify({'success': False, 'message': 'Invalid request'})
             
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
@@ -204,18 +434,60 @@ def get_users_list():
         return jsonify({'success': False, 'message': 'Unauthorized'})
     
     try:
-        connection = db_config.get_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT id, name, roll_number FROM users ORDER BY name")
-        users = cursor.fetchall()
-        cursor.close()
-        connection.close()
+        with db_config.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT id, name, roll_number FROM users ORDER BY name")
+            users = cursor.fetchall()
+            cursor.close()
         
         users_list = [{'id': user[0], 'name': user[1], 'roll_number': user[2]} for user in users]
         return jsonify({'success': True, 'users': users_list})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
+@app.route('/admin/db_pool_stats')
+def db_pool_stats():
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'})
+    
+    return jsonify({'success': True, 'pool': db_config.pool_stats()})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/bulk_enroll', methods=['POST'])
+def bulk_enroll():
+    """Enroll a CSV roster with a ZIP of photos; returns a per-row report"""
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'})
+    
+    roster_file = request.files.get('roster')
+    photos_file = request.files.get('photos')
+    if roster_file is None or photos_file is None:
+        return jsonify({'success': False, 'message': 'Upload a CSV roster and a ZIP of photos'})
+    
+    try:
+        rows = read_roster(roster_file.stream)
+        photos = PhotoSource(photos_file.stream)
+    except (ValueError, zipfile.BadZipFile, UnicodeDecodeError) as e:
+        return jsonify({'success': False, 'message': f'Invalid upload: {str(e)}'})
+    
+    try:
+        enrollment = BulkEnrollment(db_config, face_gallery, workers=BULK_ENROLL_WORKERS)
+        report = enrollment.run(rows, photos, dry_run=request.form.get('dry_run') == 'true')
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error enrolling users: {str(e)}'})
+    finally:
+        photos.close()
+    
+    return jsonify({
+        'success': report['failed'] < report['total'],
+        'message': f"Enrolled {report['enrolled']} of {report['total']} user(s), {report['failed']} failed",
+        **report
+    })
+
 @app.route('/register')
 def register():
     return render_template('register.html')
@@ -224,60 +496,107 @@ def register():
 def attendance():
     return render_template('mark_attendance_camera.html')
 
+@app.route('/kiosk')
+def kiosk():
+    return render_template('kiosk.html')
+
+def decode_photo(photo_data):
+    """Return the raw JPEG bytes of a base64 data URL from the camera page"""
+    with STAGE_SECONDS.time(stage='decode_base64'):
+        image_data = photo_data.split(',')[1]  # Remove data:image/jpeg;base64, prefix
+        return base64.b64decode(image_data)
+
+def uploaded_photo(data):
+    """Return (image, error) for the photo of a check-in or registration.
+    
+    The photo is either a base64 data URL in data['photo'] (image is then
+    the JPEG bytes) or a binary face crop (utils/face_crop.py): the whole
+    body of a check-in, or the 'crop' file of a registration form.
+    """
+    if request.mimetype == FACE_CROP_MIMETYPE:
+        body = request.get_data()
+    elif 'crop' in request.files:
+        body = request.files['crop'].read()
+    else:
+        return decode_photo(data['photo']), None
+    with STAGE_SECONDS.time(stage='decode_crop'):
+        return parse_face_crop(body)
+
+def recognize_checkin(image):
+    """recognition.recognize() for a check-in photo, reusing the result for a
+    near-identical photo checked a moment ago (see utils/result_cache.py)"""
+    if result_cache is None:
+        return recognition.recognize(image)
+    if recognition.workers == 0 and isinstance(image, bytes):
+        # Decode once, for both the fingerprint and recognition
+        with STAGE_SECONDS.time(stage='decode_image'):
+            image = face_utils.decode_frame(image)
+        if image is None:
+            return None
+    with STAGE_SECONDS.time(stage='fingerprint'):
+        image_fingerprint = fingerprint(image)
+    if image_fingerprint is None:
+        return recognition.recognize(image)
+    
+    # Read before recognizing: a result computed while the gallery changes
+    # is stored under the old version, so it is never reused
+    face_gallery.ensure_loaded()
+    version = face_gallery.version
+    faces = result_cache.get(image_fingerprint, version)
+    if faces is None:
+        faces = recognition.recognize(image)
+        # A thumbnail can't tell a blurred photo from the sharp retake that
+        # follows it, so quality rejections are not kept
+        if faces is not None and not any(face['rejected'] for face in faces):
+            result_cache.put(image_fingerprint, version, faces)
+    return faces
+
+def mark_user_present(user_id):
+    """Insert today's attendance row for a user.
+    
+    Returns False if the user was already marked today.
+    """
+    return presence.mark(user_id)
+
+def record_attendance(user_id, user_name):
+    """Mark a recognized user present and build the JSON response"""
+    if mark_user_present(user_id):
+        return jsonify({'success': True, 'message': f'Attendance marked for {user_name}'})
+    return jsonify({'success': False, 'message': 'Attendance already marked today'})
+
+def quality_rejection(reason):
+    """Response for a face that failed the quality checks, with its reason code"""
+    return jsonify({'success': False, 'reason': reason, 'message': QUALITY_MESSAGES[reason]})
+
+def record_attendance_batch(user_ids):
+    """Mark attendance for several users at once.
+    
+    Returns the set of user ids that were newly marked; users who already
+    have a row for today are left untouched.
+    """
+    return presence.mark_many(user_ids)
+
 @app.route('/mark_attendance_with_photo', methods=['POST'])
+@REQUEST_SECONDS.time(endpoint='mark_attendance_with_photo')
 def mark_attendance_with_photo():
-    data = request.get_json()
-    photo_data = data['photo']
+    data = request.get_json() if request.is_json else None
     
     try:
-        # Process the base64 image
-        image_data = photo_data.split(',')[1]  # Remove data:image/jpeg;base64, prefix
-        image_bytes = base64.b64decode(image_data)
-        
-        # Convert to OpenCV format for face detection
-        image = Image.open(io.BytesIO(image_bytes))
-        image_array = np.array(image)
+        # A base64 photo, or a grayscale crop around the face
+        image, error = uploaded_photo(data)
+        if error:
+            return jsonify({'success': False, 'message': error})
         
-        # Generate face encoding from captured image
-        face_encoding = face_utils.process_image_for_encoding(image_array)
+        # Detect, encode and match the face (in a worker process if enabled)
+        faces = recognize_checkin(image)
         
-        if face_encoding is not None:
-            # Compare with stored encodings
-            connection = db_config.get_connection()
-            cursor = connection.cursor()
-            cursor.execute("SELECT id, name, face_encoding FROM users")
-            users = cursor.fetchall()
-            
-            for user in users:
-                stored_encoding = pickle.loads(bytes.fromhex(user[2]))
-                # Use our simplified face comparison
-                best_match_index, distance = face_utils.compare_faces([stored_encoding], face_encoding)
-                
-                if best_match_index is not None:
-                    # Check if already marked today
-                    cursor.execute("""
-                        SELECT * FROM attendance 
-                        WHERE user_id = %s AND date = %s
-                    """, (user[0], date.today()))
-                    
-                    if cursor.fetchone() is None:
-                        # Mark attendance
-                        cursor.execute("""
-                            INSERT INTO attendance (user_id, date, time) 
-                            VALUES (%s, %s, %s)
-                        """, (user[0], date.today(), datetime.now().time()))
-                        connection.commit()
-                        
-                        cursor.close()
-                        connection.close()
-                        return jsonify({'success': True, 'message': f'Attendance marked for {user[1]}'})
-                    else:
-                        cursor.close()
-                        connection.close()
-                        return jsonify({'success': False, 'message': 'Attendance already marked today'})
+        if faces:
+            if faces[0]['rejected'] is not None:
+                # Too small, blurred or badly lit to match reliably
+                return quality_rejection(faces[0]['rejected'])
+            if faces[0]['user_id'] is not None:
+                return record_attendance(faces[0]['user_id'], faces[0]['name'])
             
-            cursor.close()
-            connection.close()
             return jsonify({'success': False, 'message': 'Face not recognized. Please register first.'})
         else:
             return jsonify({'success': False, 'message': 'No face detected in the image'})
@@ -285,17 +604,150 @@ def mark_attendance_with_photo():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error processing attendance: {str(e)}'})
 
+@app.route('/mark_attendance_batch', methods=['POST'])
+@REQUEST_SECONDS.time(endpoint='mark_attendance_batch')
+def mark_attendance_batch():
+    data = request.get_json()
+    photo_data = data['photo']
+    
+    try:
+        image_bytes = decode_photo(photo_data)
+        
+        # Encode every face in the group photo and match them all against
+        # the gallery in one batched operation
+        detected = recognition.recognize(image_bytes, all_faces=True, profile='classroom')
+        if not detected:
+            return jsonify({'success': False, 'message': 'No face detected in the image', 'faces': []})
+        
+        # The same person can only be counted once per photo
+        matched_ids = []
+        for face in detected:
+            if face['user_id'] is not None and face['user_id'] not in matched_ids:
+                matched_ids.append(face['user_id'])
+        
+        newly_marked = record_attendance_batch(matched_ids)
+        
+        faces = []
+        seen = set()
+        for face in detected:
+            user_id = face['user_id']
+            if user_id is None:
+                status = 'unrecognized'
+            elif user_id in seen:
+                status = 'duplicate'
+            elif user_id in newly_marked:
+                status = 'marked'
+            else:
+                status = 'already_marked'
+            if user_id is not None:
+                seen.add(user_id)
+            faces.append({
+                'box': list(face['box']),
+                'status': status,
+                'user_id': user_id,
+                'name': face['name'],
+                'distance': face['distance']
+            })
+        
+        return jsonify({
+            'success': len(newly_marked) > 0,
+            'message': f'Attendance marked for {len(newly_marked)} of {len(detected)} face(s)',
+            'marked': len(newly_marked),
+            'faces': faces
+        })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error processing attendance: {str(e)}'})
+
+def identify_faces(gray, boxes):
+    """Check, encode and match the given face boxes against the gallery.
+    
+    Faces that fail the quality checks are not encoded; they come back
+    unidentified with their reason code.
+    """
+    with STAGE_SECONDS.time(stage='track_identify'):
+        gate = face_utils.quality_gate
+        reasons = [gate.check(gray, box)[0] if gate is not None else None for box in boxes]
+        passed = [box for box, reason in zip(boxes, reasons) if reason is None]
+        matches = iter(face_gallery.match_batch(face_utils.encode_face_regions(gray, passed), tolerance=0.3)
+                       if passed else [])
+        return [(*next(matches), None) if reason is None else (None, None, None, reason) for reason in reasons]
+
+@sock.route('/ws/attendance')
+def attendance_stream(ws):
+    """Continuous check-in over one WebSocket.
+    
+    The kiosk sends raw binary JPEG frames; each processed frame is answered
+    with a JSON status message. A reader thread keeps only the newest frame,
+    so when recognition lags behind the camera, stale frames are dropped
+    instead of queueing up. Faces are tracked across frames, so a person is
+    encoded and matched once rather than on every frame.
+    """
+    frames = LatestFrameBuffer()
+    
+    def receive_frames():
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                if isinstance(message, (bytes, bytearray)):
+                    frames.put(message)
+        except ConnectionClosed:
+            pass
+        finally:
+            frames.close()
+    
+    threading.Thread(target=receive_frames, daemon=True).start()
+    
+    tracker = FaceTracker(face_utils, identify_faces)
+    
+    while True:
+        frame_bytes = frames.get()
+        if frame_bytes is None:
+            break
+        
+        result = {'dropped': frames.dropped}
+        with REQUEST_SECONDS.time(endpoint='ws_frame'):
+            gray = face_utils.decode_frame(frame_bytes)
+            tracks = tracker.update(gray) if gray is not None else None
+        if tracks is None:
+            result.update(status='invalid_frame', message='Could not decode frame')
+        elif not tracks:
+            result.update(status='no_face', message='No face detected')
+        else:
+            # The closest face that passed the quality checks, if any
+            track = next((track for track in tracks if track.rejected is None), tracks[0])
+            if track.rejected is not None:
+                result.update(status='rejected', reason=track.rejected, message=QUALITY_MESSAGES[track.rejected],
+                              track_id=track.track_id)
+            elif track.user_id is None:
+                result.update(status='unrecognized', message='Face not recognized. Please register first.',
+                              track_id=track.track_id)
+            else:
+                # Only the first frame of an identified track touches the database
+                if track.attendance is None:
+                    track.attendance = 'marked' if mark_user_present(track.user_id) else 'already_marked'
+                message = f'Attendance marked for {track.name}' if track.attendance == 'marked' \
+                    else f'{track.name}: attendance already marked today'
+                result.update(status=track.attendance, message=message, user_id=track.user_id,
+                              name=track.name, distance=track.distance, track_id=track.track_id)
+        
+        try:
+            ws.send(json.dumps(result))
+        except ConnectionClosed:
+            break
+
 @app.route('/login_admin', methods=['POST'])
 def login_admin():
     username = request.form['username']
     password = request.form['password']
     
-    connection = db_config.get_connection()
-    cursor = connection.cursor()
-    cursor.execute("SELECT * FROM admin WHERE username = %s AND password = %s", (username, password))
-    admin = cursor.fetchone()
-    cursor.close()
-    connection.close()
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT * FROM admin WHERE username = %s AND password = %s", (username, password))
+        admin = cursor.fetchone()
+        cursor.close()
     
     if admin:
         session['admin_logged_in'] = True
@@ -311,41 +763,32 @@ def register_user():
     roll_number = request.form['roll_number']
     
     # Server-side validation
-    # Validate name (alphabets and spaces only, max 60 chars)
-    if not name or len(name) > 60 or not all(c.isalpha() or c.isspace() for c in name):
-        flash('Invalid name. Use alphabets only (maximum 60 characters).', 'danger')
-        return redirect(url_for('register'))
-    
-    # Validate email format
-    email_regex = r'^[a-zA-Z0-9._-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    if not re.match(email_regex, email):
-        flash('Invalid email format. Please use format like user@gmail.com', 'danger')
+    error = registration_error(name, email)
+    if error:
+        flash(error, 'danger')
         return redirect(url_for('register'))
     
     # Check for duplicates
-    connection = db_config.get_connection()
-    cursor = connection.cursor()
-    
-    # Check for duplicate roll number
-    cursor.execute("SELECT name FROM users WHERE roll_number = %s", (roll_number,))
-    existing_roll = cursor.fetchone()
-    if existing_roll:
-        cursor.close()
-        connection.close()
-        flash(f'Roll number already registered with user: {existing_roll[0]}', 'danger')
-        return redirect(url_for('register'))
-    
-    # Check for duplicate email
-    cursor.execute("SELECT name FROM users WHERE email = %s", (email,))
-    existing_email = cursor.fetchone()
-    if existing_email:
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        
+        # Check for duplicate roll number
+        cursor.execute("SELECT name FROM users WHERE roll_number = %s", (roll_number,))
+        existing_roll = cursor.fetchone()
+        if existing_roll:
+            cursor.close()
+            flash(f'Roll number already registered with user: {existing_roll[0]}', 'danger')
+            return redirect(url_for('register'))
+        
+        # Check for duplicate email
+        cursor.execute("SELECT name FROM users WHERE email = %s", (email,))
+        existing_email = cursor.fetchone()
+        if existing_email:
+            cursor.close()
+            flash(f'Email already registered with user: {existing_email[0]}', 'danger')
+            return redirect(url_for('register'))
+        
         cursor.close()
-        connection.close()
-        flash(f'Email already registered with user: {existing_email[0]}', 'danger')
-        return redirect(url_for('register'))
-    
-    cursor.close()
-    connection.close()
     
     # All validations passed, redirect to camera capture page
     return render_template('capture_photo.html', 
@@ -354,62 +797,51 @@ def register_user():
                          roll_number=roll_number)
 
 @app.route('/register_user_with_photo', methods=['POST'])
+@REQUEST_SECONDS.time(endpoint='register_user_with_photo')
 def register_user_with_photo():
-    data = request.get_json()
+    # JSON with a base64 photo, or a form with a binary face crop
+    data = request.get_json() if request.is_json else request.form
     name = data['name']
     email = data['email']
     roll_number = data['roll_number']
-    photo_data = data['photo']
     
     try:
-        # Process the base64 image
-        image_data = photo_data.split(',')[1]  # Remove data:image/jpeg;base64, prefix
-        image_bytes = base64.b64decode(image_data)
+        image, error = uploaded_photo(data)
+        if error:
+            return jsonify({'success': False, 'message': error})
         
-        # Convert to OpenCV format for face detection
-        image = Image.open(io.BytesIO(image_bytes))
-        image_array = np.array(image)
+        # Generate face encoding and check for a duplicate face against the
+        # gallery (tolerance of 0.3 for stricter matching)
+        faces = recognition.recognize(image, tolerance=0.3)
         
-        # Generate face encoding
-        face_encoding = face_utils.process_image_for_encoding(image_array)
-        
-        if face_encoding is not None:
-            connection = db_config.get_connection()
-            cursor = connection.cursor()
+        if faces:
+            if faces[0]['rejected'] is not None:
+                return quality_rejection(faces[0]['rejected'])
+            face_encoding = faces[0]['encoding']
             
-            # Check for duplicate face
-            cursor.execute("SELECT id, name, face_encoding FROM users")
-            existing_users = cursor.fetchall()
-            
-            if existing_users:
-                # Compare with all existing faces
-                for user in existing_users:
-                    user_id, user_name, stored_encoding_hex = user
-                    stored_encoding = pickle.loads(bytes.fromhex(stored_encoding_hex))
-                    
-                    # Compare faces with tolerance of 0.3 (stricter matching)
-                    match_index, distance = face_utils.compare_faces([stored_encoding], face_encoding, tolerance=0.3)
-                    
-                    if match_index is not None:
-                        cursor.close()
-                        connection.close()
-                        return jsonify({
-                            'success': False, 
-                            'message': f'This face is already registered with user: {user_name}. Please use a different photo or contact admin.'
-                        })
+            if faces[0]['user_id'] is not None:
+                return jsonify({
+                    'success': False, 
+                    'message': f'This face is already registered with user: {faces[0]["name"]}. Please use a different photo or contact admin.'
+                })
             
             # No duplicate found, proceed with registration
-            # Convert face encoding to string for storage
-            encoding_str = pickle.dumps(face_encoding).hex()
+            # Store the encoding as compact float32 binary
+            encoding_blob = encode_face_encoding(face_encoding)
             
-            cursor.execute("""
-                INSERT INTO users (name, email, roll_number, face_encoding) 
-                VALUES (%s, %s, %s, %s)
-            """, (name, email, roll_number, encoding_str))
+            with STAGE_SECONDS.time(stage='db_write'), db_config.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                    INSERT INTO users (name, email, roll_number, face_encoding) 
+                    VALUES (%s, %s, %s, %s)
+                """, (name, email, roll_number, encoding_blob))
+                new_user_id = cursor.lastrowid
+                gallery_changes.record(cursor, 'add', [new_user_id])
+                
+                connection.commit()
+                cursor.close()
             
-            connection.commit()
-            cursor.close()
-            connection.close()
+            face_gallery.add(new_user_id, name, face_encoding)
             
             return jsonify({'success': True, 'message': f'User {name} registered successfully!'})
         else:
@@ -420,52 +852,23 @@ def register_user_with_photo():
 
 @app.route('/mark_attendance')
 def mark_attendance():
-    # Get face encoding from camera
-    face_encoding = face_utils.capture_face_encoding()
+    # Encode a face from the newest frames of the already-open camera
+    with STAGE_SECONDS.time(stage='camera_capture'):
+        face_encoding = face_utils.capture_face_encoding(camera)
     
     if face_encoding is not None:
-        # Compare with stored encodings
-        connection = db_config.get_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT id, name, face_encoding FROM users")
-        users = cursor.fetchall()
+        # Find the closest enrolled face with one matrix-vector product
+        user_id, user_name, distance = face_gallery.match(face_encoding)
         
-        for user in users:
-            stored_encoding = pickle.loads(bytes.fromhex(user[2]))
-            # Use our simplified face comparison
-            best_match_index, distance = face_utils.compare_faces([stored_encoding], face_encoding)
-            
-            if best_match_index is not None:
-                # Check if already marked today
-                cursor.execute("""
-                    SELECT * FROM attendance 
-                    WHERE user_id = %s AND date = %s
-                """, (user[0], date.today()))
-                
-                if cursor.fetchone() is None:
-                    # Mark attendance
-                    cursor.execute("""
-                        INSERT INTO attendance (user_id, date, time) 
-                        VALUES (%s, %s, %s)
-                    """, (user[0], date.today(), datetime.now().time()))
-                    connection.commit()
-                    
-                    cursor.close()
-                    connection.close()
-                    return jsonify({'success': True, 'message': f'Attendance marked for {user[1]}'})
-                else:
-                    cursor.close()
-                    connection.close()
-                    return jsonify({'success': False, 'message': 'Attendance already marked today'})
+        if user_id is not None:
+            return record_attendance(user_id, user_name)
         
-        cursor.close()
-        connection.close()
         return jsonify({'success': False, 'message': 'Face not recognized'})
     else:
         return jsonify({'success': False, 'message': 'No face detected'})
 
 if __name__ == '__main__':
-    # Initialize database
-    db_config.create_database()
-    db_config.create_tables()
+    # Schema check, gallery load etc. continue in the background while the
+    # server starts; /ready reports when they are done
+    warmup.start()
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
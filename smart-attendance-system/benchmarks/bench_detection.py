@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Face Detection Benchmark
+Reports detection latency and hit rate for each detection profile on
+synthetic kiosk (one close face) and classroom (many small faces) frames.
+
+Usage: python -m benchmarks.bench_detection [--frames 10] [--json out.json]
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+from benchmarks.synthetic import face_scene
+from utils.face_utils import DETECTION_PROFILES, FaceRecognitionUtils
+
+# name: (width, height, faces per frame, face size within its grid cell)
+SCENES = {
+    'kiosk-720p': (1280, 720, 1, 0.5),
+    'kiosk-480p': (640, 480, 1, 0.5),
+    'classroom-1080p': (1920, 1080, 30, 0.6),
+}
+
+
+def count_hits(truth_boxes, detected_boxes):
+    """Number of drawn faces with a detected box centred on them"""
+    hits = 0
+    for x, y, w, h in truth_boxes:
+        for dx, dy, dw, dh in detected_boxes:
+            cx, cy = dx + dw / 2, dy + dh / 2
+            if x <= cx <= x + w and y <= cy <= y + h:
+                hits += 1
+                break
+    return hits
+
+
+def run(scenes, profiles, frame_count):
+    face_utils = FaceRecognitionUtils()
+    results = []
+    for scene in scenes:
+        width, height, faces, face_size = SCENES[scene]
+        frames = [face_scene(width, height, faces, face_size, seed=seed) for seed in range(frame_count)]
+        for profile in profiles:
+            face_utils.detect_faces(frames[0][0], profile)  # warm up
+            timings, hits, total, false_positives = [], 0, 0, 0
+            for image, truth_boxes in frames:
+                started = time.perf_counter()
+                detected = face_utils.detect_faces(image, profile)
+                timings.append((time.perf_counter() - started) * 1000)
+                frame_hits = count_hits(truth_boxes, detected)
+                hits += frame_hits
+                total += len(truth_boxes)
+                false_positives += max(0, len(detected) - frame_hits)
+            results.append({'scene': scene, 'profile': profile,
+                            'ms_mean': float(np.mean(timings)), 'ms_p95': float(np.percentile(timings, 95)),
+                            'hit_rate': hits / total, 'false_positives': false_positives})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenes', nargs='+', choices=list(SCENES), default=list(SCENES))
+    parser.add_argument('--profiles', nargs='+', choices=list(DETECTION_PROFILES), default=list(DETECTION_PROFILES))
+    parser.add_argument('--frames', type=int, default=10, help='frames per scene')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    results = run(args.scenes, args.profiles, args.frames)
+
+    print(f"{'scene':>16} {'profile':>10} {'ms mean':>8} {'ms p95':>8} {'hit rate':>9} {'false +':>8}")
+    for row in results:
+        print(f"{row['scene']:>16} {row['profile']:>10} {row['ms_mean']:>8.1f} {row['ms_p95']:>8.1f} "
+              f"{row['hit_rate']:>9.3f} {row['false_positives']:>8}")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
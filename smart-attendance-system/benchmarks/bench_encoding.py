@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Face Encoding Benchmark
+Compares the per-face cost of the one-pass encoder (utils/face_encoder.py),
+one face at a time and in batches, against the previous per-statistic
+encoder, and checks that both give the same encodings.
+
+Usage: python -m benchmarks.bench_encoding [--faces 30] [--repeat 200] [--json out.json]
+"""
+
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+from benchmarks.synthetic import face_scene
+from utils.face_encoder import FaceEncoder
+from utils.face_index import normalize_rows
+
+
+def legacy_encode(gray, face_box):
+    """The encoder this replaced: a resize, calcHist, then five separate passes"""
+    x, y, w, h = face_box
+    face_resized = cv2.resize(gray[y:y + h, x:x + w], (100, 100))
+    hist = cv2.calcHist([face_resized], [0], None, [32], [0, 256])
+    hist = hist.flatten() / hist.sum()
+    stats = np.array([np.mean(face_resized), np.std(face_resized), np.median(face_resized),
+                      np.min(face_resized), np.max(face_resized)])
+    return np.concatenate([hist, stats])
+
+
+def per_face_us(encode_all, face_count, repeat):
+    encode_all()  # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        encode_all()
+    return (time.perf_counter() - started) * 1e6 / (repeat * face_count)
+
+
+def run(face_count, repeat):
+    image, boxes = face_scene(1920, 1080, face_count, 0.6, seed=3)
+    encoder = FaceEncoder()
+
+    legacy = np.array([legacy_encode(image, box) for box in boxes])
+    batched = encoder.encode_many(image, boxes)
+    # Cosine matching only sees the direction of an encoding
+    largest_difference = float(np.abs(normalize_rows(legacy) - batched).max())
+
+    results = [
+        {'encoder': 'legacy', 'us_per_face': per_face_us(
+            lambda: [legacy_encode(image, box) for box in boxes], face_count, repeat)},
+        {'encoder': 'one-pass', 'us_per_face': per_face_us(
+            lambda: [encoder.encode(image, box) for box in boxes], face_count, repeat)},
+        {'encoder': f'one-pass batch of {face_count}', 'us_per_face': per_face_us(
+            lambda: encoder.encode_many(image, boxes), face_count, repeat)},
+    ]
+    for row in results:
+        row['speedup'] = results[0]['us_per_face'] / row['us_per_face']
+        row['max_difference'] = 0.0 if row['encoder'] == 'legacy' else largest_difference
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--faces', type=int, default=30, help='faces in the test image')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    results = run(args.faces, args.repeat)
+
+    print(f"{'encoder':>24} {'us/face':>9} {'speedup':>8} {'max diff':>9}")
+    for row in results:
+        print(f"{row['encoder']:>24} {row['us_per_face']:>9.1f} {row['speedup']:>7.1f}x "
+              f"{row['max_difference']:>9.2e}")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
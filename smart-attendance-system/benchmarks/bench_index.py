@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Face Index Benchmark
+Compares recall and query latency of the approximate IVF index against exact
+brute-force search over synthetic rosters.
+
+Usage: python -m benchmarks.bench_index [--sizes 1000 10000 50000] [--json out.json]
+"""
+
+import argparse
+import json
+import time
+import numpy as np
+from benchmarks.synthetic import clustered_encodings, noisy_queries
+from utils.face_index import ExactIndex, IVFIndex, normalize_rows
+
+
+def time_queries(index, queries):
+    """Search one query at a time, like individual check-ins. Returns (ids, ms per query)"""
+    found = np.empty(len(queries), dtype=np.int64)
+    started = time.perf_counter()
+    for position, query in enumerate(queries):
+        found[position] = index.search(query[np.newaxis, :])[0][0]
+    elapsed = time.perf_counter() - started
+    return found, elapsed * 1000 / len(queries)
+
+
+def run(sizes, nprobes, query_count, nlist=0):
+    results = []
+    for size in sizes:
+        encodings = clustered_encodings(size)
+        ids = np.arange(1, size + 1)
+        queries, _ = noisy_queries(encodings, query_count)
+        queries = normalize_rows(queries)
+
+        exact = ExactIndex()
+        exact.build(ids, encodings)
+        exact_ids, exact_ms = time_queries(exact, queries)
+        results.append({'size': size, 'index': 'exact', 'nprobe': None,
+                        'recall': 1.0, 'ms_per_query': exact_ms, 'build_s': 0.0})
+
+        started = time.perf_counter()
+        ivf = IVFIndex(nlist=nlist, min_train_size=min(1000, size))
+        ivf.build(ids, encodings)
+        build_seconds = time.perf_counter() - started
+
+        for nprobe in nprobes:
+            ivf.nprobe = nprobe
+            ivf_ids, ivf_ms = time_queries(ivf, queries)
+            results.append({'size': size, 'index': 'ivf', 'nprobe': nprobe,
+                            'recall': float(np.mean(ivf_ids == exact_ids)),
+                            'ms_per_query': ivf_ms, 'build_s': build_seconds})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--nlist', type=int, default=0, help='IVF clusters (0 = sqrt(N))')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.nprobe, args.queries, args.nlist)
+
+    print(f"{'users':>8} {'index':>6} {'nprobe':>6} {'recall@1':>9} {'ms/query':>9} {'build s':>8}")
+    for row in results:
+        nprobe = row['nprobe'] if row['nprobe'] is not None else '-'
+        print(f"{row['size']:>8} {row['index']:>6} {nprobe:>6} {row['recall']:>9.3f} "
+              f"{row['ms_per_query']:>9.3f} {row['build_s']:>8.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
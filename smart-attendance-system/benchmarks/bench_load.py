@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Kiosk Fleet Load Test
+Replays synthetic face photos against the photo check-in and registration
+endpoints from a fleet of simulated kiosks, for each fleet size in turn, and
+reports latency percentiles, throughput and error rate per fleet size and the
+size where throughput stops growing. By default each fleet size gets a fresh
+local app (run as a child process) on a copy of a throwaway SQLite database of
+synthetic users, so it needs no camera or MySQL. The kiosks are threads of
+this process and share the machine's CPUs with the app.
+
+Usage: python -m benchmarks.bench_load [--concurrency 1 2 4 8 16 32] [--duration 15]
+                                       [--rate 0] [--register-share 0.05] [--json out.json]
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+import cv2
+import numpy as np
+from benchmarks.bench_pipeline import data_url, environment
+from benchmarks.synthetic import clustered_encodings, face_scene
+from utils.encoding_codec import encode_face_encoding
+from utils.face_crop import FACE_CROP_MIMETYPE, HEADER, MAGIC
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHECKIN_PATH = '/mark_attendance_with_photo'
+REGISTER_PATH = '/register_user_with_photo'
+# Side the camera pages shrink the frame to for a binary upload (face_crop.js)
+CROP_FRAME_SIDE = 320
+# Photos of unenrolled faces that registrations cycle through
+NEW_FACES = 50
+# Gray levels the lighting of a synthetic photo varies by across the frame
+LIGHTING_RANGE = 30
+# A fleet "reaches" the saturation throughput within this share of the best
+SATURATION_SHARE = 0.9
+# Runs the app as `python app.py` does, on a given port
+SERVER_SCRIPT = ("import sys, app; app.warmup.start(); "
+                 "app.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)")
+
+
+def student_photo(seed):
+    """640x480 photo of one synthetic face under uneven lighting.
+
+    The lighting differs per seed, like the room and background of real
+    photos; without it every synthetic photo has the same thumbnail and
+    check-ins by different students hit each other's cached results.
+    """
+    rng = np.random.default_rng(seed)
+    image, _ = face_scene(640, 480, 1, 0.5, seed=seed)
+    light = cv2.resize(rng.uniform(-LIGHTING_RANGE, LIGHTING_RANGE, (3, 4)).astype(np.float32), (640, 480),
+                       interpolation=cv2.INTER_CUBIC)
+    return np.clip(image + light, 0, 255).astype(np.uint8)
+
+
+def face_crop_body(image):
+    """Binary upload as the camera pages send it without FaceDetector: the
+    whole frame, grayscale, shrunk to 320 px behind a face crop header"""
+    height, width = image.shape[:2]
+    scale = CROP_FRAME_SIDE / max(width, height)
+    small = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    ok, jpeg = cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return HEADER.pack(MAGIC, width, height, 0, 0, width, height) + jpeg.tobytes()
+
+
+def multipart_body(fields, files):
+    """Return (body, content type) of a multipart form; files maps a field to (bytes, content type)"""
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    for name, (content, content_type) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Photos:
+    """Ready-to-send request bodies for check-ins and registrations.
+
+    Check-ins cycle through the enrolled students' photos in a shuffled
+    order; registrations use photos of faces nobody enrolled, each with a
+    new name, email and roll number.
+    """
+
+    def __init__(self, student_images, new_face_images, upload, seed=0):
+        self.upload = upload
+        encode = face_crop_body if upload == 'face-crop' else data_url
+        self.checkins = [encode(image) for image in student_images]
+        self.new_faces = [encode(image) for image in new_face_images]
+        np.random.default_rng(seed).shuffle(self.checkins)
+        self._checkin = itertools.cycle(range(len(self.checkins)))
+        self._registration = itertools.count()
+        self._run = os.getpid()
+
+    def checkin(self):
+        photo = self.checkins[next(self._checkin)]
+        if self.upload == 'face-crop':
+            return CHECKIN_PATH, photo, FACE_CROP_MIMETYPE
+        return CHECKIN_PATH, json.dumps({'photo': photo}).encode(), 'application/json'
+
+    def registration(self):
+        number = next(self._registration)
+        photo = self.new_faces[number % len(self.new_faces)]
+        fields = {'name': f'Load Test {number}', 'email': f'load{self._run}.{number}@bench.local',
+                  'roll_number': f'L{self._run}-{number}'}
+        if self.upload == 'face-crop':
+            body, content_type = multipart_body(fields, {'crop': (photo, FACE_CROP_MIMETYPE)})
+            return REGISTER_PATH, body, content_type
+        return REGISTER_PATH, json.dumps({**fields, 'photo': photo}).encode(), 'application/json'
+
+
+def outcome(status, body):
+    """Classify a response: ok, refused (e.g. already marked, duplicate face),
+    rejected_<reason> by the quality gate, or an error"""
+    if status != 200:
+        return f'http_{status}'
+    try:
+        response = json.loads(body)
+    except ValueError:
+        return 'bad_response'
+    if response.get('reason'):
+        return f"rejected_{response['reason']}"
+    if response.get('success'):
+        return 'ok'
+    # Routes catch their exceptions and answer 200 with an "Error ..." message
+    if response.get('message', '').startswith('Error'):
+        return 'server_error'
+    return 'refused'
+
+
+def is_error(name):
+    return name not in ('ok', 'refused') and not name.startswith('rejected_')
+
+
+def send(base_url, request, timeout):
+    """POST one request; returns its outcome()"""
+    path, body, content_type = request
+    http_request = urllib.request.Request(base_url + path, data=body, headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            return outcome(response.status, response.read())
+    except urllib.error.HTTPError as e:
+        return f'http_{e.code}'
+    except urllib.error.URLError as e:
+        return 'timeout' if isinstance(e.reason, socket.timeout) else f'error_{type(e.reason).__name__}'
+    except socket.timeout:
+        return 'timeout'
+    except (OSError, http.client.HTTPException) as e:
+        return f'error_{type(e).__name__}'
+
+
+def summarize(samples, window):
+    """Latency, throughput and error stats of (latency, outcome) samples.
+
+    Throughput counts answered requests only, so a server failing fast
+    doesn't look like a fast server.
+    """
+    if not samples:
+        return {'requests': 0, 'throughput': 0.0, 'errors': 0, 'error_rate': 0.0, 'ms_mean': 0.0,
+                'ms_p50': 0.0, 'ms_p95': 0.0, 'ms_p99': 0.0, 'outcomes': {}}
+    latencies = np.asarray([latency for latency, _ in samples]) * 1000
+    outcomes = Counter(name for _, name in samples)
+    errors = sum(count for name, count in outcomes.items() if is_error(name))
+    return {'requests': len(samples), 'throughput': (len(samples) - errors) / window, 'errors': errors,
+            'error_rate': errors / len(samples), 'ms_mean': float(latencies.mean()),
+            'ms_p50': float(np.percentile(latencies, 50)), 'ms_p95': float(np.percentile(latencies, 95)),
+            'ms_p99': float(np.percentile(latencies, 99)), 'outcomes': dict(outcomes)}
+
+
+def run_fleet(base_url, photos, kiosks, duration, warmup, rate=0, register_share=0.05, timeout=30, seed=0):
+    """Drive the app from `kiosks` threads for warmup + duration seconds.
+
+    With rate 0 every kiosk sends its next photo as soon as the last one is
+    answered. Otherwise photos arrive at `rate` per second across the fleet
+    (Poisson arrivals) and wait for a free kiosk; latency is counted from
+    the arrival, so time spent queued behind a slow server is included.
+    Only requests arriving after the warm-up are measured. Returns
+    summarize() results for 'all', 'checkin' and 'register'.
+    """
+    rng = np.random.default_rng(seed)
+    lock = threading.Lock()
+    samples = {'checkin': [], 'register': []}
+    finished = []
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+    next_arrival = [started]
+
+    def next_request():
+        """(arrival time or None, endpoint, request), or None when time is up"""
+        with lock:
+            if rate:
+                next_arrival[0] += rng.exponential(1 / rate)
+                arrival = next_arrival[0]
+            else:
+                arrival = None
+            if (arrival or time.perf_counter()) >= deadline:
+                return None
+            if rng.random() < register_share:
+                return arrival, 'register', photos.registration()
+            return arrival, 'checkin', photos.checkin()
+
+    def kiosk():
+        while True:
+            job = next_request()
+            if job is None:
+                return
+            arrival, endpoint, request = job
+            if arrival is None:
+                arrival = time.perf_counter()
+            else:
+                time.sleep(max(0.0, arrival - time.perf_counter()))
+            result = send(base_url, request, timeout)
+            done = time.perf_counter()
+            if arrival >= measure_from:
+                with lock:
+                    samples[endpoint].append((done - arrival, result))
+                    finished.append(done)
+
+    threads = [threading.Thread(target=kiosk, daemon=True) for _ in range(kiosks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Requests still in flight at the deadline are counted too
+    window = max([deadline, *finished]) - measure_from
+    results = {'all': summarize(samples['checkin'] + samples['register'], window),
+               'checkin': summarize(samples['checkin'], window)}
+    if register_share > 0:
+        results['register'] = summarize(samples['register'], window)
+    return results
+
+
+def seed_database(path, students, roster):
+    """Create a SQLite database of enrolled students and synthetic users.
+
+    Returns (student photos, photos of faces nobody enrolled). Students are
+    enrolled from their photos so check-ins find them; the rest of the
+    roster only needs encodings in the table.
+    """
+    for stale in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_SQLITE_PATH'] = path
+    from config.database import DatabaseConfig
+    from utils.face_utils import FaceRecognitionUtils
+    db_config = DatabaseConfig()
+    db_config.create_tables()
+    face_utils = FaceRecognitionUtils()
+
+    student_images, users = [], []
+    for seed in range(students):
+        image = student_photo(1000 + seed)
+        encoding = face_utils.process_image_for_encoding(image)
+        if encoding is None:
+            continue
+        student_images.append(image)
+        users.append((f'Student {seed}', f'student{seed}@bench.local', f'T{seed:06d}',
+                      encode_face_encoding(encoding)))
+    users.extend((f'Synthetic {n}', f'synthetic{n}@bench.local', f'S{n:07d}', encode_face_encoding(encoding))
+                 for n, encoding in enumerate(clustered_encodings(roster, seed=roster)))
+
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        cursor.executemany("""
+            INSERT INTO users (name, email, roll_number, face_encoding)
+            VALUES (%s, %s, %s, %s)
+        """, users)
+        connection.commit()
+        cursor.close()
+
+    new_face_images = [student_photo(900000 + seed) for seed in range(NEW_FACES)]
+    return student_images, new_face_images
+
+
+class LocalServer:
+    """The app in a child process on its own copy of the seeded database"""
+
+    def __init__(self, database_path, directory, startup_timeout=120):
+        self.database_path = database_path
+        self.directory = directory
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.base_url = None
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        copy_path = os.path.join(self.directory, 'app.sqlite3')
+        # The backup API also copies rows still in the write-ahead log
+        with sqlite3.connect(self.database_path) as source, sqlite3.connect(copy_path) as target:
+            source.backup(target)
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{port}'
+        env = dict(os.environ, DB_BACKEND='sqlite', DB_SQLITE_PATH=copy_path,
+                   GALLERY_SNAPSHOT_DIR=os.path.join(self.directory, 'gallery_snapshot'),
+                   ATTENDANCE_JOURNAL_DIR=os.path.join(self.directory, 'attendance_journal'))
+        self.log_path = os.path.join(self.directory, 'server.log')
+        with open(self.log_path, 'wb') as log:
+            self.process = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, str(port)], cwd=APP_DIR,
+                                            env=env, stdout=log, stderr=subprocess.STDOUT)
+
+        give_up = time.monotonic() + self.startup_timeout
+        while time.monotonic() < give_up and self.process.poll() is None:
+            try:
+                with urllib.request.urlopen(self.base_url + '/ready', timeout=5):
+                    return self
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        with open(self.log_path, errors='replace') as log:
+            raise RuntimeError(f'App did not become ready; its last output:\n{log.read()[-2000:]}')
+
+    def __exit__(self, *exc_info):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def saturation(levels):
+    """Return (level, still climbing): the smallest fleet that reaches
+    SATURATION_SHARE of the best throughput, and whether throughput was
+    still growing at the largest fleet tried"""
+    best = max(levels, key=lambda level: level['all']['throughput'])
+    knee = next(level for level in levels
+                if level['all']['throughput'] >= SATURATION_SHARE * best['all']['throughput'])
+    climbing = (len(levels) > 1 and best is levels[-1]
+                and levels[-1]['all']['throughput'] * SATURATION_SHARE > levels[-2]['all']['throughput'])
+    return knee, climbing
+
+
+def run(args):
+    directory = args.db_dir or tempfile.mkdtemp(prefix='attendance-load-')
+    os.makedirs(directory, exist_ok=True)
+    try:
+        if args.url:
+            # Check-ins are by whoever is enrolled there; only the photos are generated
+            student_images = [student_photo(1000 + seed) for seed in range(args.students)]
+            new_face_images = [student_photo(900000 + seed) for seed in range(NEW_FACES)]
+        else:
+            database_path = os.path.join(directory, 'seed.sqlite3')
+            student_images, new_face_images = seed_database(database_path, args.students, args.users)
+
+        levels = []
+        for kiosks in sorted(args.concurrency):
+            photos = Photos(student_images, new_face_images, args.upload, seed=kiosks)
+            if args.url:
+                results = run_fleet(args.url.rstrip('/'), photos, kiosks, args.duration, args.warmup,
+                                    args.rate, args.register_share, args.timeout, seed=kiosks)
+            else:
+                # A fresh app per fleet size, so each starts with nobody checked in
+                with LocalServer(database_path, os.path.join(directory, f'kiosks-{kiosks}')) as server:
+                    results = run_fleet(server.base_url, photos, kiosks, args.duration, args.warmup,
+                                        args.rate, args.register_share, args.timeout, seed=kiosks)
+            levels.append({'kiosks': kiosks, **results})
+            summary = results['all']
+            print(f"{kiosks:>6} kiosks {summary['throughput']:>8.1f} req/s {summary['ms_p50']:>9.1f} "
+                  f"{summary['ms_p95']:>9.1f} {summary['ms_p99']:>9.1f} ms {summary['error_rate']:>7.1%} errors",
+                  file=sys.stderr)
+        return levels
+    finally:
+        if args.db_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='fleet sizes (kiosks sending at once) to try')
+    parser.add_argument('--duration', type=float, default=15, help='measured seconds per fleet size')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each measurement')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='photos per second arriving across the fleet (default 0: each kiosk sends '
+                             'again as soon as it is answered)')
+    parser.add_argument('--register-share', type=float, default=0.05,
+                        help='fraction of requests that are registrations')
+    parser.add_argument('--upload', choices=['data-url', 'face-crop'], default='data-url',
+                        help='base64 JSON photos, or binary face crop uploads as the camera pages send')
+    parser.add_argument('--students', type=int, default=1000, help='enrolled students whose photos are replayed')
+    parser.add_argument('--users', type=int, default=1000, help='further synthetic users in the gallery')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds before a request counts as failed')
+    parser.add_argument('--url', help='load an already running app instead of starting local ones')
+    parser.add_argument('--db-dir', help='keep the databases and server logs in this directory')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    levels = run(args)
+
+    print(f"{'kiosks':>6} {'endpoint':>9} {'requests':>9} {'req/s':>8} {'errors':>7} "
+          f"{'ms p50':>9} {'ms p95':>9} {'ms p99':>9}")
+    for level in levels:
+        for endpoint in ('all', 'checkin', 'register'):
+            if endpoint not in level:
+                continue
+            row = level[endpoint]
+            print(f"{level['kiosks']:>6} {endpoint:>9} {row['requests']:>9} {row['throughput']:>8.1f} "
+                  f"{row['error_rate']:>7.1%} {row['ms_p50']:>9.1f} {row['ms_p95']:>9.1f} {row['ms_p99']:>9.1f}")
+
+    knee, climbing = saturation(levels)
+    if climbing:
+        print(f"\nThroughput was still growing at {levels[-1]['kiosks']} kiosks "
+              f"({levels[-1]['all']['throughput']:.1f} req/s); try larger --concurrency")
+    else:
+        print(f"\nSaturates at about {knee['kiosks']} kiosks: {knee['all']['throughput']:.1f} req/s, "
+              f"p95 {knee['all']['ms_p95']:.1f} ms; larger fleets mostly add latency")
+
+    if args.json:
+        settings = {name: getattr(args, name) for name in ('duration', 'warmup', 'rate', 'register_share',
+                                                           'upload', 'students', 'users', 'url')}
+        with open(args.json, 'w') as output:
+            json.dump({'environment': {**environment(), **settings}, 'levels': levels,
+                       'saturation': {'kiosks': knee['kiosks'], 'still_climbing': climbing}}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
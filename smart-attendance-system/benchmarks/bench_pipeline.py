@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+End-to-end Pipeline Benchmark
+Times the check-in, group photo, registration and report paths through the
+Flask app against a throwaway SQLite database filled with synthetic users,
+for each roster size. Needs no camera or MySQL.
+
+Usage: python -m benchmarks.bench_pipeline [--sizes 100 1000 10000 100000]
+                                           [--json out.json] [--compare baseline.json]
+"""
+
+import argparse
+import base64
+import importlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import cv2
+import numpy as np
+from benchmarks.synthetic import clustered_encodings, face_scene
+from utils.encoding_codec import encode_face_encoding
+
+# Enrolled from real synthetic photos so check-ins have a face to find;
+# the rest of the roster only needs encodings in the table
+PROBE_USERS = 20
+# Faces in the group photo
+CLASS_SIZE = 30
+
+
+def data_url(image):
+    """JPEG data URL, as the camera pages post it"""
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.tobytes()).decode()
+
+
+def summarize(timings):
+    timings = np.asarray(timings) * 1000
+    return {'runs': len(timings), 'ms_mean': float(timings.mean()),
+            'ms_p50': float(np.percentile(timings, 50)), 'ms_p95': float(np.percentile(timings, 95))}
+
+
+def measure(call, repeat):
+    """Run call() repeat times; return latency stats and the last result"""
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings), result
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'recognition_workers': int(os.getenv('RECOGNITION_WORKERS', '0')),
+            'face_index': os.getenv('FACE_INDEX', 'exact'),
+            'started_at': datetime.now().isoformat(timespec='seconds')}
+
+
+class Workload:
+    """The app, bound to a fresh SQLite database that grows roster by roster"""
+
+    def __init__(self, database_path, history_days, attendance_rate):
+        os.environ['DB_BACKEND'] = 'sqlite'
+        os.environ['DB_SQLITE_PATH'] = database_path
+        # Imported here so the app picks up the SQLite settings
+        self.app = importlib.import_module('app')
+        self.app.db_config.create_tables()
+        self.client = self.app.app.test_client()
+        with self.client.session_transaction() as browser_session:
+            browser_session['admin_logged_in'] = True
+
+        self.history_days = history_days
+        self.attendance_rate = attendance_rate
+        self.rng = np.random.default_rng(0)
+        self.user_count = 0
+
+        face_utils = self.app.face_utils
+        self.probe_photos = []
+        probes = []
+        for seed in range(PROBE_USERS):
+            image, _ = face_scene(640, 480, 1, 0.5, seed=1000 + seed)
+            encoding = face_utils.process_image_for_encoding(image)
+            if encoding is None:
+                continue
+            self.probe_photos.append(data_url(image))
+            probes.append((f'Probe {seed}', f'probe{seed}@bench.local', f'P{seed:05d}',
+                           encode_face_encoding(encoding)))
+        self.probe_ids = self._insert_users(probes)
+        self.class_photo = data_url(face_scene(1920, 1080, CLASS_SIZE, 0.6, seed=7)[0])
+        self.new_face_photo = data_url(face_scene(640, 480, 1, 0.5, seed=9999)[0])
+
+    def _insert_users(self, users):
+        with self.app.db_config.connection() as connection:
+            cursor = connection.cursor()
+            cursor.executemany("""
+                INSERT INTO users (name, email, roll_number, face_encoding)
+                VALUES (%s, %s, %s, %s)
+            """, users)
+            connection.commit()
+            cursor.execute("SELECT id FROM users ORDER BY id DESC LIMIT %s", (len(users),))
+            user_ids = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        self.user_count += len(users)
+        return user_ids
+
+    def grow(self, size):
+        """Add synthetic users (and their attendance history) up to size"""
+        count = size - self.user_count
+        if count <= 0:
+            return
+        encodings = clustered_encodings(count, seed=size)
+        first = self.user_count
+        user_ids = self._insert_users([
+            (f'Synthetic {n}', f'synthetic{n}@bench.local', f'S{n:07d}', encode_face_encoding(encoding))
+            for n, encoding in zip(range(first, first + count), encodings)])
+
+        today = date.today()
+        with self.app.db_config.connection() as connection:
+            cursor = connection.cursor()
+            for days_ago in range(self.history_days):
+                day = today - timedelta(days=days_ago)
+                present = [user_id for user_id in user_ids if self.rng.random() < self.attendance_rate]
+                cursor.executemany("INSERT INTO attendance (user_id, date, time) VALUES (%s, %s, %s)",
+                                   [(user_id, day, '09:00:00') for user_id in present])
+            self.app.attendance_rollups.rebuild(cursor)
+            connection.commit()
+            cursor.close()
+        self.app.face_gallery.invalidate()
+
+    def reset_probes(self):
+        """Clear today's check-ins by the probe users so they can check in afresh"""
+        today = date.today()
+        placeholders = ', '.join(['%s'] * len(self.probe_ids))
+        with self.app.db_config.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"DELETE FROM attendance WHERE date = %s AND user_id IN ({placeholders})",
+                           (today, *self.probe_ids))
+            self.app.attendance_rollups.rebuild(cursor, since=today)
+            connection.commit()
+            cursor.close()
+        self.app.presence.invalidate()
+
+    def post(self, path, payload):
+        response = self.client.post(path, json=payload)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}')
+        return response.get_json()
+
+    def get(self, path):
+        response = self.client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}')
+        return response.get_data()
+
+    def run(self, size, repeat):
+        """Yield one result row per scenario at the current roster size"""
+        gallery = self.app.face_gallery
+
+        load, _ = measure(gallery.refresh, 1)
+        yield {'scenario': 'gallery_load', **load}
+
+        queries = clustered_encodings(repeat, seed=size + 1)
+        position = iter(range(repeat))
+        stats, _ = measure(lambda: gallery.match(queries[next(position)]), repeat)
+        yield {'scenario': 'gallery_match', **stats}
+        stats, _ = measure(lambda: gallery.match_batch(queries[:CLASS_SIZE]), max(1, repeat // 5))
+        yield {'scenario': f'gallery_match_batch_{CLASS_SIZE}', **stats}
+
+        # A first check-in writes a row; a repeat is answered from memory
+        self.reset_probes()
+        photos = iter(self.probe_photos)
+        responses = []
+        stats, _ = measure(lambda: responses.append(self.post('/mark_attendance_with_photo',
+                                                              {'photo': next(photos)})),
+                           len(self.probe_photos))
+        yield {'scenario': 'checkin_new', 'marked': sum(1 for response in responses if response['success']),
+               **stats}
+        stats, result = measure(lambda: self.post('/mark_attendance_with_photo',
+                                                  {'photo': self.probe_photos[0]}), repeat)
+        yield {'scenario': 'checkin_repeat', 'last_message': result['message'], **stats}
+
+        stats, result = measure(lambda: self.post('/mark_attendance_batch', {'photo': self.class_photo}),
+                                max(1, repeat // 5))
+        faces = len(result['faces'])
+        yield {'scenario': 'group_photo', 'faces': faces,
+               'faces_per_second': faces * 1000 / stats['ms_mean'], **stats}
+
+        # Every synthetic face resembles an enrolled one, so this measures
+        # the duplicate-face check that runs before an insert
+        registration = {'name': 'Bench New', 'email': 'new@bench.local', 'roll_number': 'NEW00001',
+                        'photo': self.new_face_photo}
+        stats, result = measure(lambda: self.post('/register_user_with_photo', registration), repeat)
+        yield {'scenario': 'register_dedupe', 'last_message': result['message'], **stats}
+
+        for name, path in (('report_dashboard', '/admin/dashboard'),
+                           ('report_users_page', '/admin/users'),
+                           ('report_today_page', '/admin/today_report'),
+                           ('report_monthly_page', '/admin/monthly_report')):
+            stats, _ = measure(lambda: self.get(path), max(1, repeat // 5))
+            yield {'scenario': name, **stats}
+
+        month_start = date.today().replace(day=1).isoformat()
+        export_path = f'/admin/export_attendance?start={month_start}&end={date.today().isoformat()}'
+        stats, body = measure(lambda: self.get(export_path), 1)
+        yield {'scenario': 'report_export_month', 'rows': body.count(b'\n') - 1, **stats}
+
+
+def run(sizes, repeat, history_days, attendance_rate, database_dir=None):
+    directory = database_dir or tempfile.mkdtemp(prefix='attendance-bench-')
+    try:
+        workload = Workload(os.path.join(directory, 'bench.sqlite3'), history_days, attendance_rate)
+        results = []
+        for size in sorted(sizes):
+            workload.grow(size)
+            for row in workload.run(size, repeat):
+                results.append({'size': size, **row})
+                print(f"{size:>8} {row['scenario']:>26} {row['ms_mean']:>9.2f} {row['ms_p95']:>9.2f}",
+                      file=sys.stderr)
+        return results
+    finally:
+        if database_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def compare(results, baseline, threshold):
+    """Print the change in mean latency against a previous run's JSON.
+
+    Returns the number of scenarios more than threshold (a fraction) slower.
+    """
+    previous = {(row['size'], row['scenario']): row for row in baseline['results']}
+    regressions = 0
+    print(f"\n{'users':>8} {'scenario':>26} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for row in results:
+        before = previous.get((row['size'], row['scenario']))
+        if before is None or before['ms_mean'] <= 0:
+            continue
+        change = row['ms_mean'] / before['ms_mean'] - 1
+        flag = ''
+        if change > threshold:
+            regressions += 1
+            flag = '  SLOWER'
+        print(f"{row['size']:>8} {row['scenario']:>26} {before['ms_mean']:>10.2f} {row['ms_mean']:>10.2f} "
+              f"{change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50, help='runs per scenario')
+    parser.add_argument('--history-days', type=int, default=10, help='days of attendance to generate')
+    parser.add_argument('--attendance-rate', type=float, default=0.8)
+    parser.add_argument('--db-dir', help='keep the generated database in this directory')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--compare', help='previous --json output to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='with --compare, exit non-zero if any scenario is this much slower')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat, args.history_days, args.attendance_rate, args.db_dir)
+
+    print(f"{'users':>8} {'scenario':>26} {'ms mean':>9} {'ms p50':>9} {'ms p95':>9}")
+    for row in results:
+        print(f"{row['size']:>8} {row['scenario']:>26} {row['ms_mean']:>9.2f} {row['ms_p50']:>9.2f} "
+              f"{row['ms_p95']:>9.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'environment': environment(), 'results': results}, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
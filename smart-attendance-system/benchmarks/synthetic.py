@@ -0,0 +1,63 @@
+"""Synthetic data for benchmarks, so they need no camera, photos or MySQL"""
+import cv2
+import numpy as np
+from utils.face_encoder import ENCODING_DIMENSION
+
+
+def clustered_encodings(count, dimension=ENCODING_DIMENSION, clusters=None, spread=1.0, seed=0):
+    """Encodings drawn around random centres, like look-alike groups in a roster"""
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(1, count // 50)
+    centres = rng.normal(size=(clusters, dimension))
+    encodings = centres[rng.integers(0, clusters, count)] + spread * rng.normal(size=(count, dimension))
+    return encodings.astype(np.float32)
+
+
+def noisy_queries(encodings, count, noise=0.05, seed=1):
+    """Perturbed copies of enrolled encodings, as a new photo of the same person would give.
+
+    Returns (queries, positions) where positions index the source encodings.
+    """
+    rng = np.random.default_rng(seed)
+    positions = rng.choice(len(encodings), size=min(count, len(encodings)), replace=False)
+    queries = encodings[positions] + noise * rng.normal(size=(len(positions), encodings.shape[1]))
+    return queries.astype(np.float32), positions
+
+
+def draw_face(image, centre, radius, rng):
+    """Draw a crude frontal face the Haar cascade detects. Returns its x, y, w, h box"""
+    cx, cy = centre
+    skin = int(rng.integers(150, 210))
+    cv2.ellipse(image, (cx, cy), (radius, int(radius * 1.3)), 0, 0, 360, skin, -1)
+    eye_y, eye_x = cy - int(radius * 0.3), int(radius * 0.4)
+    thickness = max(1, int(radius * 0.08))
+    for side in (-1, 1):
+        x = cx + side * eye_x
+        cv2.ellipse(image, (x, eye_y), (int(radius * 0.22), int(radius * 0.1)), 0, 0, 360, 40, -1)
+        brow_y = eye_y - int(radius * 0.25)
+        cv2.line(image, (x - int(radius * 0.25), brow_y), (x + int(radius * 0.25), brow_y), 30, thickness)
+    cv2.line(image, (cx, eye_y + int(radius * 0.1)), (cx, cy + int(radius * 0.3)), skin - 50, thickness)
+    cv2.ellipse(image, (cx, cy + int(radius * 0.6)), (int(radius * 0.35), int(radius * 0.1)), 0, 0, 360, 60, -1)
+    return cx - radius, cy - int(radius * 1.3), 2 * radius, int(radius * 2.6)
+
+
+def face_scene(width, height, face_count=1, face_size=0.45, seed=0):
+    """Grayscale frame with face_count faces laid out on a grid.
+
+    face_size is the face height as a fraction of its grid cell. Returns
+    (image, boxes) where boxes are the drawn faces' x, y, w, h.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width), int(rng.integers(150, 220)), dtype=np.uint8)
+    columns = int(np.ceil(np.sqrt(face_count * width / height)))
+    rows = int(np.ceil(face_count / columns))
+    cell_width, cell_height = width // columns, height // rows
+    radius = max(4, int(min(cell_width, cell_height / 1.3) * face_size / 2))
+
+    boxes = []
+    for position in range(face_count):
+        row, column = divmod(position, columns)
+        centre = (column * cell_width + cell_width // 2, row * cell_height + cell_height // 2)
+        boxes.append(draw_face(image, centre, radius, rng))
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+    return image, boxes
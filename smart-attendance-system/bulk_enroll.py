@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Bulk Enrollment Script for Smart Attendance System
+Registers every student in a CSV roster (name, email, roll_number, photo)
+using photos from a folder or ZIP archive, and reports the result per row.
+
+Usage: python bulk_enroll.py roster.csv photos.zip [--workers N] [--dry-run] [--report report.csv]
+"""
+
+import argparse
+import csv
+import time
+from config.database import DatabaseConfig
+from utils.bulk_enrollment import BulkEnrollment, PhotoSource, read_roster
+from utils.gallery import FaceGallery
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('roster', help='CSV file with name, email, roll_number and photo columns')
+    parser.add_argument('photos', help='folder or ZIP archive containing the photos')
+    parser.add_argument('--workers', type=int, default=None, help='encoding processes (default: one per core)')
+    parser.add_argument('--dry-run', action='store_true', help='check everything but write nothing')
+    parser.add_argument('--report', help='write the per-row results to this CSV file')
+    args = parser.parse_args()
+
+    with open(args.roster, newline='', encoding='utf-8-sig') as roster_file:
+        try:
+            rows = read_roster(roster_file)
+        except ValueError as e:
+            print(f"Invalid roster: {e}")
+            return
+
+    db_config = DatabaseConfig()
+    enrollment = BulkEnrollment(db_config, FaceGallery(db_config), workers=args.workers)
+    photos = PhotoSource(args.photos)
+
+    print(f"Enrolling {len(rows)} student(s){' (dry run)' if args.dry_run else ''}...")
+    started = time.perf_counter()
+    try:
+        report = enrollment.run(rows, photos, dry_run=args.dry_run)
+    finally:
+        photos.close()
+    elapsed = time.perf_counter() - started
+
+    for row in report['rows']:
+        if row['status'] == 'failed':
+            print(f"  row {row['row']} ({row['roll_number'] or row['name']}): {row['reason']}")
+
+    if args.report:
+        with open(args.report, 'w', newline='') as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=['row', 'name', 'roll_number', 'status', 'reason', 'user_id'])
+            writer.writeheader()
+            writer.writerows(report['rows'])
+
+    succeeded = report['total'] - report['failed']
+    print(f"{'Would enroll' if args.dry_run else 'Enrolled'} {succeeded} of {report['total']} "
+          f"in {elapsed:.1f}s, {report['failed']} failed")
+
+if __name__ == "__main__":
+    main()
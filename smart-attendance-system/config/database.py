@@ -1,30 +1,103 @@
 import mysql.connector
 from mysql.connector import Error
 import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import sqlite_backend
+from config.pool import ConnectionPool, PooledConnection, PoolExhaustedError
 
 class DatabaseConfig:
     def __init__(self):
+        # 'mysql' for deployments, 'sqlite' for a local stand-in without a server
+        self.backend = os.getenv('DB_BACKEND', 'mysql').lower()
         self.host = os.getenv('DB_HOST', 'localhost')
         self.database = os.getenv('DB_NAME', 'attendance_system')
         self.user = os.getenv('DB_USER', 'root')
         self.password = os.getenv('DB_PASSWORD', '')  # Default XAMPP password
         self.port = int(os.getenv('DB_PORT', '3306'))
+        self.sqlite_path = os.getenv('DB_SQLITE_PATH', 'attendance_system.sqlite3')
+
+        # Connection pool settings; DB_POOL_SIZE=0 opens a new connection per request
+        self.pool_size = int(os.getenv('DB_POOL_SIZE', '5'))
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+        self.pool_health_check_interval = float(os.getenv('DB_POOL_HEALTH_CHECK', '30'))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _connect(self):
+        """Open a new, unpooled connection to the configured backend"""
+        if self.backend == 'sqlite':
+            return sqlite_backend.connect(self.sqlite_path)
+        return mysql.connector.connect(
+            host=self.host,
+            database=self.database,
+            user=self.user,
+            password=self.password,
+            port=self.port
+        )
+
+    @property
+    def pool(self):
+        if self._pool is None and self.pool_size > 0:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(
+                        self._connect,
+                        size=self.pool_size,
+                        timeout=self.pool_timeout,
+                        health_check_interval=self.pool_health_check_interval
+                    )
+        return self._pool
 
     def get_connection(self):
+        """Borrow a connection; calling close() on it returns it to the pool"""
         try:
-            connection = mysql.connector.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password,
-                port=self.port
-            )
-            return connection
-        except Error as e:
-            print(f"Error connecting to MySQL: {e}")
+            if self.pool is not None:
+                return self.pool.get_connection()
+            return self._connect()
+        except (Error, sqlite3.Error, ConnectionError, PoolExhaustedError) as e:
+            print(f"Error connecting to database: {e}")
             return None
 
+    @contextmanager
+    def connection(self):
+        """Context manager that borrows a connection and always gives it back.
+
+        Uncommitted work is rolled back if the block raises.
+        """
+        if self.pool is not None:
+            connection = self.pool.get_connection()
+        else:
+            connection = self._connect()
+        try:
+            yield connection
+        except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            connection.close()
+
+    def discard_connection(self, connection):
+        """Close a borrowed connection for good rather than pooling it again"""
+        if isinstance(connection, PooledConnection):
+            connection.discard()
+        else:
+            connection.close()
+
+    def pool_stats(self):
+        """Checkout counts and wait times, or None when pooling is disabled"""
+        if self.pool is None:
+            return None
+        return self.pool.stats()
+
     def create_database(self):
+        if self.backend == 'sqlite':
+            # The database file is created on first connect
+            return
         try:
             connection = mysql.connector.connect(
                 host=self.host,
@@ -42,7 +115,17 @@ class DatabaseConfig:
 
     def create_tables(self):
         connection = self.get_connection()
-        if connection:
+        if connection and self.backend == 'sqlite':
+            sqlite_backend.create_tables(connection)
+            cursor = connection.cursor()
+            cursor.execute("SELECT COUNT(*) FROM admin")
+            if cursor.fetchone()[0] == 0:
+                cursor.execute("INSERT INTO admin (username, password) VALUES ('admin', 'admin123')")
+            connection.commit()
+            cursor.close()
+            connection.close()
+            print("Tables created successfully")
+        elif connection:
             cursor = connection.cursor()
             
             # Users table
@@ -52,8 +135,9 @@ class DatabaseConfig:
                 name VARCHAR(100) NOT NULL,
                 email VARCHAR(100) UNIQUE NOT NULL,
                 roll_number VARCHAR(50) UNIQUE NOT NULL,
-                face_encoding TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                face_encoding BLOB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                KEY idx_users_name (name)
             )
             """
             
@@ -66,10 +150,43 @@ class DatabaseConfig:
                 time TIME NOT NULL,
                 status ENUM('Present', 'Absent') DEFAULT 'Present',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id),
+                UNIQUE KEY uq_attendance_user_date (user_id, date),
+                KEY idx_attendance_date (date)
+            )
+            """
+            
+            # Report summaries, maintained alongside attendance inserts
+            daily_totals_table = """
+            CREATE TABLE IF NOT EXISTS attendance_daily_totals (
+                date DATE PRIMARY KEY,
+                present_count INT NOT NULL DEFAULT 0
+            )
+            """
+            
+            monthly_user_table = """
+            CREATE TABLE IF NOT EXISTS attendance_monthly_user (
+                user_id INT NOT NULL,
+                year SMALLINT NOT NULL,
+                month TINYINT NOT NULL,
+                days_present INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, year, month),
+                KEY idx_attendance_monthly_period (year, month),
                 FOREIGN KEY (user_id) REFERENCES users(id)
             )
             """
             
+            # Users added/removed, so each instance can update its gallery
+            # incrementally; the latest id is the gallery version
+            gallery_changes_table = """
+            CREATE TABLE IF NOT EXISTS gallery_changes (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT,
+                action ENUM('add', 'remove', 'clear') NOT NULL,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+            
             # Admin table
             admin_table = """
             CREATE TABLE IF NOT EXISTS admin (
@@ -82,6 +199,9 @@ class DatabaseConfig:
             
             cursor.execute(users_table)
             cursor.execute(attendance_table)
+            cursor.execute(daily_totals_table)
+            cursor.execute(monthly_user_table)
+            cursor.execute(gallery_changes_table)
             cursor.execute(admin_table)
             
             # Insert default admin
@@ -0,0 +1,186 @@
+import queue
+import threading
+import time
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no pooled connection becomes free within the timeout"""
+
+
+class PooledConnection:
+    """Proxy handed out by ConnectionPool.
+
+    Behaves like the underlying connection, except that close() returns it
+    to the pool instead of closing the socket. Calling close() more than
+    once is harmless.
+    """
+
+    def __init__(self, pool, raw_connection):
+        self._pool = pool
+        self._raw = raw_connection
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if not self._returned:
+            self._returned = True
+            self._pool.release(self._raw)
+
+    def discard(self):
+        """Close the underlying connection instead of returning it, e.g.
+        when it was abandoned halfway through reading a result set"""
+        if not self._returned:
+            self._returned = True
+            self._pool.discard(self._raw)
+
+
+class ConnectionPool:
+    """Thread-safe pool of database connections.
+
+    Connections are created lazily up to ``size`` by calling ``connect``.
+    A connection that has been idle longer than ``health_check_interval``
+    seconds is checked with ``is_connected()`` before it is handed out and
+    replaced if the server has dropped it.
+    """
+
+    def __init__(self, connect, size=5, timeout=10.0, health_check_interval=30.0):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        # LIFO so the most recently used (warmest) connection is reused first
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._health_check_failures = 0
+
+    def _new_connection(self):
+        try:
+            raw_connection = self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        if raw_connection is None:
+            with self._lock:
+                self._created -= 1
+            raise ConnectionError("Could not open a database connection")
+        return raw_connection
+
+    def _is_healthy(self, raw_connection):
+        try:
+            return raw_connection.is_connected()
+        except Exception:
+            return False
+
+    def _discard(self, raw_connection):
+        try:
+            raw_connection.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def get_connection(self):
+        """Borrow a connection; close() on the returned proxy gives it back"""
+        while True:
+            raw_connection = None
+            last_used = None
+            create = False
+            waited = 0.0
+
+            try:
+                raw_connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._created < self.size:
+                        self._created += 1
+                        create = True
+
+                if not create:
+                    started = time.perf_counter()
+                    try:
+                        raw_connection, last_used = self._idle.get(timeout=self.timeout)
+                    except queue.Empty:
+                        with self._lock:
+                            self._timeouts += 1
+                        raise PoolExhaustedError(
+                            f"No database connection available after {self.timeout}s "
+                            f"(pool size {self.size})")
+                    finally:
+                        waited = time.perf_counter() - started
+
+            if create:
+                raw_connection = self._new_connection()
+            elif time.monotonic() - last_used > self.health_check_interval \
+                    and not self._is_healthy(raw_connection):
+                with self._lock:
+                    self._health_check_failures += 1
+                self._discard(raw_connection)
+                continue
+
+            with self._lock:
+                self._in_use += 1
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                    self._wait_time_total += waited
+                    self._wait_time_max = max(self._wait_time_max, waited)
+            return PooledConnection(self, raw_connection)
+
+    def release(self, raw_connection):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            # Never hand the next borrower someone else's open transaction
+            if raw_connection.in_transaction:
+                raw_connection.rollback()
+        except Exception:
+            self._discard(raw_connection)
+            return
+        self._idle.put((raw_connection, time.monotonic()))
+
+    def discard(self, raw_connection):
+        """Give up a borrowed connection that must not be reused"""
+        with self._lock:
+            self._in_use -= 1
+        self._discard(raw_connection)
+
+    def close_all(self):
+        while True:
+            try:
+                raw_connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(raw_connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+                'timeouts': self._timeouts,
+                'health_check_failures': self._health_check_failures,
+            }
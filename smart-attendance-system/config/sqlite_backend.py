@@ -0,0 +1,170 @@
+"""SQLite stand-in for the MySQL database.
+
+Used for local development, benchmarks and load tests where no MySQL
+server is available (``DB_BACKEND=sqlite``). Connections accept the same
+``%s``-style SQL the application sends to MySQL; the few MySQL-only
+constructs the application relies on are translated here.
+"""
+import re
+import sqlite3
+from datetime import date, datetime, time
+
+# Python 3.12 deprecates the implicit adapters, and TIME has none at all
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(time, lambda value: value.isoformat())
+
+# ...and read them back as the same types mysql.connector returns, so the
+# templates can format them (TIME comes back as a time, not a timedelta)
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('TIME', lambda value: time.fromisoformat(value.decode()))
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(100) NOT NULL,
+        email VARCHAR(100) UNIQUE NOT NULL,
+        roll_number VARCHAR(50) UNIQUE NOT NULL,
+        face_encoding BLOB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS attendance (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INT REFERENCES users(id),
+        date DATE NOT NULL,
+        time TIME NOT NULL,
+        status TEXT CHECK (status IN ('Present', 'Absent')) DEFAULT 'Present',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # One attendance row per user per day; also serves the daily lookups
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_user_date ON attendance (user_id, date)
+    """,
+    # Date-range reports and exports, and keyset pages of the user list
+    """
+    CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_users_name ON users (name)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS attendance_daily_totals (
+        date DATE PRIMARY KEY,
+        present_count INT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS attendance_monthly_user (
+        user_id INT NOT NULL REFERENCES users(id),
+        year INT NOT NULL,
+        month INT NOT NULL,
+        days_present INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, year, month)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_attendance_monthly_period ON attendance_monthly_user (year, month)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS gallery_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INT,
+        action TEXT NOT NULL CHECK (action IN ('add', 'remove', 'clear')),
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS admin (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(50) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+_TRANSLATIONS = [
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bINSERT\s+IGNORE\b', re.IGNORECASE), 'INSERT OR IGNORE'),
+    (re.compile(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', re.IGNORECASE), 'ON CONFLICT DO UPDATE SET'),
+]
+
+
+def translate(sql):
+    """Rewrite MySQL-flavoured SQL for SQLite"""
+    for pattern, replacement in _TRANSLATIONS:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def _year(value):
+    return int(str(value)[:4]) if value is not None else None
+
+
+def _month(value):
+    return int(str(value)[5:7]) if value is not None else None
+
+
+class SQLiteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(translate(sql), params)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(translate(sql), seq_of_params)
+        return self
+
+
+class SQLiteConnection:
+    """sqlite3 connection with the subset of the mysql.connector API we use"""
+
+    def __init__(self, path):
+        uri = path.startswith('file:')
+        self._connection = sqlite3.connect(path, uri=uri, timeout=30, check_same_thread=False,
+                                           detect_types=sqlite3.PARSE_DECLTYPES)
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        if not uri and path != ':memory:':
+            self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.create_function('YEAR', 1, _year, deterministic=True)
+        self._connection.create_function('MONTH', 1, _month, deterministic=True)
+        self._connection.create_function('CURDATE', 0, lambda: date.today().isoformat())
+        self._connection.create_function('NOW', 0, lambda: datetime.now().isoformat(' '))
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        # mysql.connector options such as buffered= have no SQLite meaning
+        return SQLiteCursor(self._connection.cursor())
+
+    def is_connected(self):
+        try:
+            self._connection.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+
+def connect(path):
+    return SQLiteConnection(path)
+
+
+def create_tables(connection):
+    cursor = connection.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cursor.close()
@@ -8,8 +8,9 @@ CREATE TABLE IF NOT EXISTS users (
     name VARCHAR(100) NOT NULL,
     email VARCHAR(100) UNIQUE NOT NULL,
     roll_number VARCHAR(50) UNIQUE NOT NULL,
-    face_encoding TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    face_encoding BLOB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_users_name (name)
 );
 
 -- Attendance table
@@ -20,9 +21,36 @@ CREATE TABLE IF NOT EXISTS attendance (
     time TIME NOT NULL,
     status ENUM('Present', 'Absent') DEFAULT 'Present',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    UNIQUE KEY uq_attendance_user_date (user_id, date),
+    KEY idx_attendance_date (date)
+);
+
+-- Report summaries, maintained alongside attendance inserts
+CREATE TABLE IF NOT EXISTS attendance_daily_totals (
+    date DATE PRIMARY KEY,
+    present_count INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS attendance_monthly_user (
+    user_id INT NOT NULL,
+    year SMALLINT NOT NULL,
+    month TINYINT NOT NULL,
+    days_present INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, year, month),
+    KEY idx_attendance_monthly_period (year, month),
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+-- Users added/removed, so each instance can update its gallery incrementally;
+-- the latest id is the gallery version
+CREATE TABLE IF NOT EXISTS gallery_changes (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT,
+    action ENUM('add', 'remove', 'clear') NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Admin table
 CREATE TABLE IF NOT EXISTS admin (
     id INT AUTO_INCREMENT PRIMARY KEY,
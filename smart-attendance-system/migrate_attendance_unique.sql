@@ -0,0 +1,14 @@
+-- Migration script to add a unique (user_id, date) index to the attendance table
+-- Run this if you have an existing database created before the index was added
+
+USE attendance_system;
+
+-- Keep the earliest check-in where a user was marked more than once on a day
+DELETE later FROM attendance later
+JOIN attendance earlier
+    ON later.user_id = earlier.user_id
+    AND later.date = earlier.date
+    AND later.id > earlier.id;
+
+-- Duplicate check-ins are now rejected by the database (INSERT IGNORE)
+ALTER TABLE attendance ADD UNIQUE INDEX uq_attendance_user_date (user_id, date);
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Face Encoding Migration Script for Smart Attendance System
+Converts users.face_encoding from pickled hex TEXT to the compact float32
+BLOB format (see utils/encoding_codec.py). Safe to run more than once.
+"""
+
+from config.database import DatabaseConfig
+from utils.encoding_codec import decode_face_encoding, encode_face_encoding, is_legacy_encoding
+
+BATCH_SIZE = 500
+
+def main():
+    print("Migrating face encodings to binary float32 format...")
+
+    db_config = DatabaseConfig()
+    connection = db_config.get_connection()
+    if not connection:
+        print("Could not connect to the database")
+        return
+
+    cursor = connection.cursor()
+
+    # TEXT -> BLOB keeps the existing hex text as ASCII bytes
+    print("Changing users.face_encoding column to BLOB...")
+    cursor.execute("ALTER TABLE users MODIFY face_encoding BLOB")
+    connection.commit()
+
+    cursor.execute("SELECT id, face_encoding FROM users WHERE face_encoding IS NOT NULL")
+    rows = cursor.fetchall()
+
+    updates = []
+    converted = 0
+    failed = 0
+    legacy_bytes = 0
+    binary_bytes = 0
+
+    for user_id, stored_encoding in rows:
+        if not is_legacy_encoding(stored_encoding):
+            continue
+        try:
+            encoding_blob = encode_face_encoding(decode_face_encoding(stored_encoding))
+        except Exception as e:
+            print(f"Could not convert encoding for user {user_id}: {e}")
+            failed += 1
+            continue
+
+        legacy_bytes += len(stored_encoding)
+        binary_bytes += len(encoding_blob)
+        updates.append((encoding_blob, user_id))
+
+        if len(updates) >= BATCH_SIZE:
+            cursor.executemany("UPDATE users SET face_encoding = %s WHERE id = %s", updates)
+            connection.commit()
+            converted += len(updates)
+            updates = []
+
+    if updates:
+        cursor.executemany("UPDATE users SET face_encoding = %s WHERE id = %s", updates)
+        connection.commit()
+        converted += len(updates)
+
+    cursor.close()
+    connection.close()
+
+    print(f"Converted {converted} encoding(s), {failed} failed, "
+          f"{len(rows) - converted - failed} already binary")
+    if converted:
+        print(f"Encoding storage: {legacy_bytes} bytes -> {binary_bytes} bytes "
+              f"({legacy_bytes / binary_bytes:.1f}x smaller)")
+
+if __name__ == "__main__":
+    main()
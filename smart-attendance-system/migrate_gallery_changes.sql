@@ -0,0 +1,12 @@
+-- Migration script to add the gallery change log used to keep several app
+-- instances' face galleries in step
+-- Run this if you have an existing database created before the table was added
+
+USE attendance_system;
+
+CREATE TABLE IF NOT EXISTS gallery_changes (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT,
+    action ENUM('add', 'remove', 'clear') NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
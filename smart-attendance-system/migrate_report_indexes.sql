@@ -0,0 +1,10 @@
+-- Migration script to add the indexes used by paginated reports and CSV export
+-- Run this if you have an existing database created before the indexes were added
+
+USE attendance_system;
+
+-- Today's report and date-range exports
+ALTER TABLE attendance ADD INDEX idx_attendance_date (date);
+
+-- Monthly report pages, ordered by name
+ALTER TABLE users ADD INDEX idx_users_name (name);
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Report Summary Rebuild Script for Smart Attendance System
+Recomputes the attendance_daily_totals and attendance_monthly_user summary
+tables from the attendance table, e.g. after a backfill or bulk import.
+
+Usage: python rebuild_attendance_rollups.py [--since YYYY-MM-DD]
+"""
+
+import argparse
+from datetime import date
+from config.database import DatabaseConfig
+from utils import attendance_rollups
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--since', type=date.fromisoformat,
+                        help='only rebuild from the month containing this date onwards')
+    args = parser.parse_args()
+
+    db_config = DatabaseConfig()
+    # Creates the summary tables on databases that predate them
+    db_config.create_tables()
+
+    connection = db_config.get_connection()
+    if not connection:
+        print("Could not connect to the database")
+        return
+
+    cursor = connection.cursor()
+    scope = f"from {args.since.replace(day=1)}" if args.since else "for all dates"
+    print(f"Rebuilding attendance summaries {scope}...")
+    attendance_rollups.rebuild(cursor, since=args.since)
+    connection.commit()
+
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(present_count), 0) FROM attendance_daily_totals")
+    days, check_ins = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*) FROM attendance_monthly_user")
+    user_months = cursor.fetchone()[0]
+    cursor.close()
+    connection.close()
+
+    print(f"Summaries cover {check_ins} check-in(s) over {days} day(s), {user_months} user-month row(s)")
+
+if __name__ == "__main__":
+    main()
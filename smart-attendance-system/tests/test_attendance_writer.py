@@ -0,0 +1,47 @@
+import time
+from datetime import date, time as time_of_day
+import pytest
+from config.database import DatabaseConfig
+from utils.attendance_writer import AttendanceWriter
+
+
+@pytest.fixture
+def db_config(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_BACKEND', 'sqlite')
+    monkeypatch.setenv('DB_SQLITE_PATH', str(tmp_path / 'attendance.sqlite3'))
+    db_config = DatabaseConfig()
+    db_config.create_tables()
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO users (name, email, roll_number, face_encoding) VALUES (%s, %s, %s, %s)",
+                       ('Student', 'student@example.com', 'R1', b''))
+        connection.commit()
+        cursor.close()
+    return db_config
+
+
+def attendance_rows(db_config):
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT user_id FROM attendance")
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+
+def test_single_row_is_written_within_flush_interval(db_config, tmp_path):
+    writer = AttendanceWriter(db_config, journal_dir=str(tmp_path / 'journal'), flush_interval=0.05)
+    writer.start()
+    try:
+        # Let the writer thread go idle on an empty queue first
+        time.sleep(0.1)
+        writer.submit([1], date.today(), time_of_day(9, 0))
+
+        # One flush interval plus time for the insert itself
+        deadline = time.monotonic() + writer.flush_interval + 0.5
+        while len(writer) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(writer) == 0
+        assert attendance_rows(db_config) == [(1,)]
+    finally:
+        writer.shutdown()
@@ -0,0 +1,24 @@
+from config.database import DatabaseConfig
+from utils import gallery_changes
+from utils.gallery import FaceGallery
+
+
+def test_sync_refresh_with_a_single_connection(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_BACKEND', 'sqlite')
+    monkeypatch.setenv('DB_SQLITE_PATH', str(tmp_path / 'gallery.sqlite3'))
+    monkeypatch.setenv('DB_POOL_SIZE', '1')
+    monkeypatch.setenv('DB_POOL_TIMEOUT', '1')
+    db_config = DatabaseConfig()
+    db_config.create_tables()
+    gallery = FaceGallery(db_config, sync_interval=0)
+    gallery.ensure_loaded()
+
+    # Another instance cleared the gallery: sync falls back to a full reload
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        gallery_changes.record(cursor, 'clear')
+        connection.commit()
+        cursor.close()
+
+    assert gallery.sync()
+    assert gallery.synced_version == 1
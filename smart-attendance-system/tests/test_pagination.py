@@ -0,0 +1,26 @@
+import base64
+import json
+import pytest
+from utils.pagination import decode_cursor, encode_cursor
+
+
+def token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def test_round_trip():
+    assert decode_cursor(encode_cursor(('Ann', 7), 100), key_length=2) == (['Ann', 7], 100)
+
+
+@pytest.mark.parametrize('key', [5, 'abc', [], [1, 2], [[1]], [None], {'id': 1}])
+def test_malformed_key_starts_over(key):
+    assert decode_cursor(token({'key': key, 'shown': 10})) == (None, 0)
+
+
+def test_short_key_starts_over():
+    assert decode_cursor(token({'key': ['Ann'], 'shown': 10}), key_length=2) == (None, 0)
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', token([1, 2]), token('key'), token({'shown': 1})])
+def test_mangled_cursor_starts_over(cursor):
+    assert decode_cursor(cursor) == (None, 0)
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+from benchmarks.synthetic import draw_face
+from utils.result_cache import RecognitionCache, fingerprint
+
+# A fixed kiosk: the same textured background in every photo
+BACKGROUND = cv2.GaussianBlur(np.random.default_rng(0).integers(60, 200, (480, 640)).astype(np.uint8), (0, 0), 8)
+
+
+def kiosk_photo(face_seed, noise_seed=None):
+    """JPEG of one face in the middle of the kiosk background, and its box"""
+    image = BACKGROUND.copy()
+    box = draw_face(image, (320, 240), 40, np.random.default_rng(face_seed))
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+    if noise_seed is not None:
+        # Sensor noise of a second shot of the same scene
+        noise = np.random.default_rng(noise_seed).normal(0, 3, image.shape)
+        image = np.clip(image + noise, 0, 255).astype(np.uint8)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes(), box
+
+
+def test_retake_of_the_same_photo_hits():
+    cache = RecognitionCache()
+    photo, box = kiosk_photo(1, noise_seed=1)
+    result = [{'box': box, 'user_id': 1, 'rejected': None}]
+    cache.put(fingerprint(photo), 0, result)
+
+    retake, _ = kiosk_photo(1, noise_seed=2)
+    assert cache.get(fingerprint(retake), 0) is result
+
+
+def test_different_face_on_the_same_background_misses():
+    cache = RecognitionCache()
+    first, box = kiosk_photo(1)
+    second, _ = kiosk_photo(2)
+    # The background makes the whole frames look alike...
+    frame_difference = np.abs(fingerprint(first).frame - fingerprint(second).frame).mean()
+    assert frame_difference <= cache.max_difference
+
+    # ...but the face at the cached box does not match
+    cache.put(fingerprint(first), 0, [{'box': box, 'user_id': 1, 'rejected': None}])
+    assert cache.get(fingerprint(second), 0) is None
+
+
+def test_result_without_a_face_is_not_stored():
+    cache = RecognitionCache()
+    photo, _ = kiosk_photo(1)
+    cache.put(fingerprint(photo), 0, [])
+    assert len(cache) == 0
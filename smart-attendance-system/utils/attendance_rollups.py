@@ -0,0 +1,72 @@
+"""Summary tables behind the dashboard and reports.
+
+``attendance_daily_totals`` holds the number of check-ins per day and
+``attendance_monthly_user`` the days present per user per month. Both are
+updated in the same transaction as the attendance rows they count, so the
+reports read a handful of rows instead of scanning the attendance history.
+rebuild() recomputes them from the attendance table for backfills.
+"""
+
+
+def record(cursor, day, user_ids):
+    """Count newly inserted attendance rows for user_ids on day"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    cursor.execute("""
+        INSERT INTO attendance_daily_totals (date, present_count)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE present_count = present_count + %s
+    """, (day, len(user_ids), len(user_ids)))
+    cursor.executemany("""
+        INSERT INTO attendance_monthly_user (user_id, year, month, days_present)
+        VALUES (%s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE days_present = days_present + 1
+    """, [(user_id, day.year, day.month) for user_id in user_ids])
+
+
+def forget_user(cursor, user_id):
+    """Uncount a user's attendance; call before deleting their rows"""
+    cursor.execute("""
+        UPDATE attendance_daily_totals SET present_count = present_count - 1
+        WHERE date IN (SELECT date FROM attendance WHERE user_id = %s)
+    """, (user_id,))
+    cursor.execute("DELETE FROM attendance_monthly_user WHERE user_id = %s", (user_id,))
+
+
+def daily_total(cursor, day):
+    cursor.execute("SELECT present_count FROM attendance_daily_totals WHERE date = %s", (day,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def rebuild(cursor, since=None):
+    """Recompute the summaries from the attendance table.
+
+    With since (a date), only months from the one containing it onwards
+    are recomputed; otherwise everything is.
+    """
+    if since is None:
+        cursor.execute("DELETE FROM attendance_daily_totals")
+        cursor.execute("DELETE FROM attendance_monthly_user")
+        date_filter, month_filter, params = "", "", ()
+    else:
+        start = since.replace(day=1)
+        cursor.execute("DELETE FROM attendance_daily_totals WHERE date >= %s", (start,))
+        cursor.execute("""
+            DELETE FROM attendance_monthly_user
+            WHERE year > %s OR (year = %s AND month >= %s)
+        """, (start.year, start.year, start.month))
+        date_filter, month_filter, params = "WHERE date >= %s", "AND date >= %s", (start,)
+
+    cursor.execute(f"""
+        INSERT INTO attendance_daily_totals (date, present_count)
+        SELECT date, COUNT(*) FROM attendance {date_filter}
+        GROUP BY date
+    """, params)
+    cursor.execute(f"""
+        INSERT INTO attendance_monthly_user (user_id, year, month, days_present)
+        SELECT user_id, YEAR(date), MONTH(date), COUNT(*) FROM attendance
+        WHERE user_id IS NOT NULL {month_filter}
+        GROUP BY user_id, YEAR(date), MONTH(date)
+    """, params)
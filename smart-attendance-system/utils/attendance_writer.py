@@ -0,0 +1,258 @@
+"""Write-behind queue for attendance rows.
+
+With write-behind enabled, a check-in returns as soon as the presence set
+(utils/presence.py) accepts it. The row is appended to a local journal
+file and queued, and a background thread inserts queued rows with one
+multi-row INSERT IGNORE and one commit per batch. A batch is flushed
+every ``flush_interval`` seconds, or sooner once ``batch_size`` rows are
+waiting.
+
+Each process keeps its own journal in ``journal_dir``. The journal is
+emptied whenever the queue has been fully written. On start, rows in
+journals left behind by processes that are no longer running (including
+this one's previous run) are queued again. Re-inserting a row that did
+reach the database is harmless, as the unique (user_id, date) index
+ignores it and only inserted rows are counted in the report summaries.
+"""
+import atexit
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, time as time_of_day
+from mysql.connector import IntegrityError
+from utils import attendance_rollups
+from utils.metrics import STAGE_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows: journals are not shared between processes
+    fcntl = None
+
+
+def write_rows(db_config, rows):
+    """Insert (user_id, date, time) attendance rows in one transaction.
+
+    Uses one multi-row INSERT IGNORE, falling back to a row at a time when
+    some rows are already there or can't be written (e.g. the user was
+    deleted). The report summaries count the inserted rows. Returns the
+    rows that were inserted.
+    """
+    with db_config.connection() as connection:
+        cursor = connection.cursor()
+        placeholders = ', '.join(['(%s, %s, %s)'] * len(rows))
+        try:
+            cursor.execute(f"INSERT IGNORE INTO attendance (user_id, date, time) VALUES {placeholders}",
+                           [value for row in rows for value in row])
+            complete = cursor.rowcount == len(rows)
+        except (IntegrityError, sqlite3.IntegrityError):
+            complete = False
+        if complete:
+            inserted = list(rows)
+        else:
+            # Some rows were already there (written by another process, or
+            # replayed) or can't be written; insert one at a time to learn
+            # which ones are new
+            connection.rollback()
+            inserted = []
+            for row in rows:
+                try:
+                    cursor.execute("INSERT IGNORE INTO attendance (user_id, date, time) VALUES (%s, %s, %s)",
+                                   row)
+                except (IntegrityError, sqlite3.IntegrityError) as e:
+                    # e.g. the user was deleted while the row was queued
+                    print(f"Dropping attendance for user {row[0]}: {e}")
+                    continue
+                if cursor.rowcount == 1:
+                    inserted.append(row)
+
+        days = {}
+        for user_id, day, _ in inserted:
+            days.setdefault(day, []).append(user_id)
+        for day, user_ids in days.items():
+            attendance_rollups.record(cursor, day, user_ids)
+        connection.commit()
+        cursor.close()
+    return inserted
+
+
+class AttendanceWriter:
+    def __init__(self, db_config, journal_dir='attendance_journal', flush_interval=0.05, batch_size=200,
+                 retry_interval=1.0, fsync=False):
+        self.db_config = db_config
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.fsync = fsync
+        # (user_id, date, time) rows not yet written, oldest first
+        self._pending = []
+        self._pending_since = None
+        self._in_flight = 0
+        self._urgent = False
+        self._stopping = False
+        self._journal = None
+        self._thread = None
+        self._condition = threading.Condition()
+        self._start_lock = threading.Lock()
+
+    def _journal_line(self, row):
+        user_id, day, at = row
+        return json.dumps([user_id, day.isoformat(), at.isoformat()]) + '\n'
+
+    def _read_journal(self, path):
+        rows = []
+        with open(path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    user_id, day, at = json.loads(line)
+                    rows.append((int(user_id), date.fromisoformat(day), time_of_day.fromisoformat(at)))
+                except (ValueError, TypeError):
+                    # A line cut short by a crash mid-write
+                    continue
+        return rows
+
+    def _recover(self):
+        """Take over the rows of journals whose process is gone"""
+        own_path = self._journal.name
+        # Left by an earlier run that had the same process id (e.g. pid 1 in a container)
+        recovered = self._read_journal(own_path)
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, '*.journal'))):
+            if path == own_path:
+                continue
+            with open(path, 'a+', encoding='utf-8') as journal:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # Still owned by a running process
+                rows = self._read_journal(path)
+                # Journal the rows as our own before dropping the old file
+                self._journal.write(''.join(self._journal_line(row) for row in rows))
+                self._sync_journal()
+                os.remove(path)
+            recovered.extend(rows)
+        return recovered
+
+    def _sync_journal(self):
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def start(self):
+        """Open this process's journal, queue recovered rows and start writing"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.journal_dir, exist_ok=True)
+            self._journal = open(os.path.join(self.journal_dir, f'attendance-{os.getpid()}.journal'),
+                                 'a', encoding='utf-8')
+            if fcntl is not None:
+                fcntl.flock(self._journal, fcntl.LOCK_EX)
+            recovered = self._recover()
+            if recovered:
+                print(f"Replaying {len(recovered)} journaled attendance row(s)")
+                with self._condition:
+                    self._pending[:0] = recovered
+                    self._pending_since = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def submit(self, user_ids, day, at):
+        """Queue attendance rows for user_ids; durable once this returns"""
+        self.start()
+        rows = [(user_id, day, at) for user_id in user_ids]
+        if not rows:
+            return
+        with self._condition:
+            self._journal.write(''.join(self._journal_line(row) for row in rows))
+            self._sync_journal()
+            was_empty = not self._pending
+            if was_empty:
+                self._pending_since = time.monotonic()
+            self._pending.extend(rows)
+            # The writer waits without a timeout while the queue is empty, so
+            # the first row must wake it to start the flush_interval timer
+            if was_empty or len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+
+    def __len__(self):
+        """Rows queued or being written"""
+        with self._condition:
+            return len(self._pending) + self._in_flight
+
+    def _next_batch(self):
+        """Wait until a batch is due; return it, or None once stopped and drained"""
+        with self._condition:
+            while True:
+                if self._pending:
+                    waited = time.monotonic() - self._pending_since
+                    if (self._urgent or self._stopping or len(self._pending) >= self.batch_size
+                            or waited >= self.flush_interval):
+                        batch = self._pending[:self.batch_size]
+                        del self._pending[:self.batch_size]
+                        self._in_flight = len(batch)
+                        return batch
+                    self._condition.wait(self.flush_interval - waited)
+                elif self._stopping:
+                    return None
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                with STAGE_SECONDS.time(stage='attendance_flush'):
+                    self._write(batch)
+            except Exception as e:
+                print(f"Error writing {len(batch)} attendance row(s), will retry: {e}")
+                with self._condition:
+                    self._pending[:0] = batch
+                    self._in_flight = 0
+                    self._condition.notify_all()
+                    if self._stopping:
+                        # The journal keeps the rows for the next start
+                        return
+                    self._condition.wait(self.retry_interval)
+                continue
+
+            with self._condition:
+                self._in_flight = 0
+                if not self._pending:
+                    # Everything journaled is in the database now
+                    self._urgent = False
+                    self._journal.seek(0)
+                    self._journal.truncate()
+                    self._sync_journal()
+                self._condition.notify_all()
+
+    def _write(self, batch):
+        write_rows(self.db_config, batch)
+
+    def flush(self, timeout=10):
+        """Write everything queued so far now; returns False on timeout"""
+        if self._thread is None:
+            return True
+        with self._condition:
+            self._urgent = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def shutdown(self, timeout=10):
+        """Drain the queue and stop the writer thread"""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        with self._start_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
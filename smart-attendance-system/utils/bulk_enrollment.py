@@ -0,0 +1,316 @@
+"""Enroll a whole intake from a CSV roster plus a folder or ZIP of photos.
+
+The roster needs ``name``, ``email``, ``roll_number`` and ``photo``
+columns, where ``photo`` is the file name of the student's photo inside the
+folder or archive. Photos are encoded in parallel worker processes. Faces
+are then checked against each other and against the gallery with one
+matrix similarity pass, roll numbers and emails with one query per batch,
+and the accepted users are inserted with executemany(). Every roster row
+gets a result, so a failed row never stops the rest of the import.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from utils import gallery_changes
+from utils.encoding_codec import encode_face_encoding
+from utils.face_index import normalize_rows
+from utils.face_utils import FaceRecognitionUtils
+from utils.validation import registration_error
+
+ROSTER_COLUMNS = ('name', 'email', 'roll_number', 'photo')
+
+_worker_face_utils = None
+
+
+def _init_worker():
+    global _worker_face_utils
+    cv2.setNumThreads(1)
+    _worker_face_utils = FaceRecognitionUtils()
+
+
+def encode_photo(face_utils, image_bytes):
+    """Return (encoding, error) for one enrollment photo"""
+    image = face_utils.decode_frame(image_bytes)
+    if image is None:
+        return None, 'Photo could not be read'
+    best = face_utils.process_image_for_best_face(image)
+    if best is None:
+        return None, 'No face detected in the photo'
+    _, encoding, reason = best
+    if reason is not None:
+        return None, f"Photo quality too low ({reason.replace('_', ' ')})"
+    return encoding, None
+
+
+def _encode_in_worker(image_bytes):
+    return encode_photo(_worker_face_utils, image_bytes)
+
+
+def read_roster(roster_file):
+    """Read roster rows from a CSV file object (text or bytes).
+
+    Returns a list of dicts with the roster columns plus ``row``, the line
+    number in the file. Raises ValueError if a column is missing.
+    """
+    content = roster_file.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    reader = csv.DictReader(io.StringIO(content))
+    fields = [field.strip().lower() for field in reader.fieldnames or []]
+    missing = [column for column in ROSTER_COLUMNS if column not in fields]
+    if missing:
+        raise ValueError(f"Roster is missing column(s): {', '.join(missing)}")
+    reader.fieldnames = fields
+
+    rows = []
+    for line_number, record in enumerate(reader, start=2):
+        row = {column: (record.get(column) or '').strip() for column in ROSTER_COLUMNS}
+        row['row'] = line_number
+        rows.append(row)
+    return rows
+
+
+class PhotoSource:
+    """Photos looked up by file name in a directory or ZIP archive"""
+
+    def __init__(self, path_or_file):
+        self._zip = None
+        self._directory = None
+        if isinstance(path_or_file, str) and os.path.isdir(path_or_file):
+            self._directory = path_or_file
+        else:
+            self._zip = zipfile.ZipFile(path_or_file)
+            # Rosters usually name the bare file, whatever folder it was zipped in
+            self._names = {}
+            for name in self._zip.namelist():
+                if not name.endswith('/'):
+                    self._names.setdefault(name, name)
+                    self._names.setdefault(os.path.basename(name), name)
+
+    def read(self, name):
+        """Return the photo's bytes, or None if there is no such photo"""
+        if not name:
+            return None
+        if self._directory is not None:
+            path = os.path.join(self._directory, name)
+            # Keep roster entries from reaching outside the photo directory
+            if os.path.commonpath([os.path.realpath(path), os.path.realpath(self._directory)]) \
+                    != os.path.realpath(self._directory) or not os.path.isfile(path):
+                return None
+            with open(path, 'rb') as photo_file:
+                return photo_file.read()
+        member = self._names.get(name)
+        return self._zip.read(member) if member else None
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+class BulkEnrollment:
+    """Validates, encodes, dedupes and inserts a roster of new users.
+
+    ``workers`` is the number of encoding processes (0 encodes in the
+    calling process; None uses every core).
+    """
+
+    def __init__(self, db_config, face_gallery, workers=None, tolerance=0.3, batch_size=500):
+        self.db_config = db_config
+        self.face_gallery = face_gallery
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.tolerance = tolerance
+        self.batch_size = batch_size
+
+    def _fail(self, row, reason):
+        row['status'] = 'failed'
+        row['reason'] = reason
+
+    def _check_fields(self, rows):
+        """Validate details and reject roll numbers/emails that are taken"""
+        seen = {'roll_number': {}, 'email': {}}
+        for row in rows:
+            error = registration_error(row['name'], row['email'])
+            if not row['roll_number']:
+                error = error or 'Missing roll number'
+            if error:
+                self._fail(row, error)
+                continue
+            for field in ('roll_number', 'email'):
+                first = seen[field].get(row[field].lower())
+                if first is not None:
+                    self._fail(row, f"Same {field.replace('_', ' ')} as row {first['row']}")
+                    break
+                seen[field][row[field].lower()] = row
+
+        pending = [row for row in rows if 'status' not in row]
+        with self.db_config.connection() as connection:
+            cursor = connection.cursor()
+            for field in ('roll_number', 'email'):
+                for start in range(0, len(pending), self.batch_size):
+                    values = [row[field] for row in pending[start:start + self.batch_size]]
+                    placeholders = ', '.join(['%s'] * len(values))
+                    cursor.execute(f"SELECT {field}, name FROM users WHERE {field} IN ({placeholders})", values)
+                    for value, existing_name in cursor.fetchall():
+                        row = seen[field].get(str(value).lower())
+                        if row is not None and 'status' not in row:
+                            self._fail(row, f"{field.replace('_', ' ').capitalize()} already registered "
+                                            f"with user: {existing_name}")
+            cursor.close()
+
+    def _encode_batch(self, encode, rows, photos):
+        """Read and encode one batch of rows' photos"""
+        pending, images = [], []
+        for row in rows:
+            image_bytes = photos.read(row['photo'])
+            if image_bytes is None:
+                self._fail(row, f"Photo not found: {row['photo'] or '(none)'}")
+                continue
+            pending.append(row)
+            images.append(image_bytes)
+
+        for row, (encoding, error) in zip(pending, encode(images)):
+            if error:
+                self._fail(row, error)
+            else:
+                row['encoding'] = encoding
+
+    def _encode(self, rows, photos):
+        """Encode every pending row's photo, in parallel when workers > 0.
+
+        Photos are read a batch at a time so a large archive is never held
+        in memory all at once.
+        """
+        pending = [row for row in rows if 'status' not in row]
+        if not pending:
+            return
+
+        if self.workers > 0 and len(pending) > 1:
+            workers = min(self.workers, len(pending))
+            chunksize = max(1, min(self.batch_size, len(pending)) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker) as executor:
+                encode = lambda images: executor.map(_encode_in_worker, images, chunksize=chunksize)
+                for start in range(0, len(pending), self.batch_size):
+                    self._encode_batch(encode, pending[start:start + self.batch_size], photos)
+        else:
+            face_utils = FaceRecognitionUtils()
+            encode = lambda images: [encode_photo(face_utils, image_bytes) for image_bytes in images]
+            for start in range(0, len(pending), self.batch_size):
+                self._encode_batch(encode, pending[start:start + self.batch_size], photos)
+
+    def _dedupe_faces(self, rows):
+        """Reject faces already enrolled, or repeated earlier in the roster"""
+        pending = [row for row in rows if 'status' not in row]
+        if not pending:
+            return
+        encodings = [row['encoding'] for row in pending]
+
+        # Against the gallery: one batched search
+        for row, (user_id, name, _) in zip(pending, self.face_gallery.match_batch(encodings, self.tolerance)):
+            if user_id is not None:
+                self._fail(row, f'This face is already registered with user: {name}')
+
+        # Within the roster: one similarity matrix, computed a block of rows
+        # at a time to bound memory. A face is a duplicate if it matches an
+        # earlier row that was itself accepted
+        matrix = normalize_rows(encodings)
+        accepted = np.array(['status' not in row for row in pending])
+        for start in range(0, len(pending), self.batch_size):
+            end = min(start + self.batch_size, len(pending))
+            similar = (matrix[start:end] @ matrix[:end].T) > 1.0 - self.tolerance
+            for position in range(start, end):
+                if not accepted[position]:
+                    continue
+                earlier = np.flatnonzero(similar[position - start, :position] & accepted[:position])
+                if len(earlier):
+                    self._fail(pending[position], f"Same face as row {pending[earlier[0]]['row']}")
+                    accepted[position] = False
+
+    def _insert_batch(self, cursor, batch):
+        """Insert a batch of users and log them for the other app instances"""
+        cursor.executemany("""
+            INSERT INTO users (name, email, roll_number, face_encoding)
+            VALUES (%s, %s, %s, %s)
+        """, [(row['name'], row['email'], row['roll_number'], encode_face_encoding(row['encoding']))
+              for row in batch])
+
+        # executemany() doesn't report each row's id
+        placeholders = ', '.join(['%s'] * len(batch))
+        cursor.execute(f"SELECT id, roll_number FROM users WHERE roll_number IN ({placeholders})",
+                       [row['roll_number'] for row in batch])
+        ids = {roll_number: user_id for user_id, roll_number in cursor.fetchall()}
+        for row in batch:
+            row['user_id'] = ids.get(row['roll_number'])
+        gallery_changes.record(cursor, 'add', [row['user_id'] for row in batch])
+
+    def _insert(self, rows):
+        """Insert accepted rows in executemany() batches; return the rows inserted"""
+        accepted = [row for row in rows if 'status' not in row]
+        inserted = []
+        with self.db_config.connection() as connection:
+            cursor = connection.cursor()
+            for start in range(0, len(accepted), self.batch_size):
+                batch = accepted[start:start + self.batch_size]
+                try:
+                    self._insert_batch(cursor, batch)
+                    connection.commit()
+                    inserted.extend(batch)
+                except Exception:
+                    # Someone registered a clashing user meanwhile; find out
+                    # which row it was by inserting this batch one at a time
+                    connection.rollback()
+                    for row in batch:
+                        try:
+                            self._insert_batch(cursor, [row])
+                            connection.commit()
+                            inserted.append(row)
+                        except Exception as e:
+                            connection.rollback()
+                            row.pop('user_id', None)
+                            self._fail(row, f'Could not save user: {e}')
+            cursor.close()
+
+        for row in inserted:
+            row['status'] = 'enrolled'
+        return inserted
+
+    def run(self, roster_rows, photos, dry_run=False):
+        """Enroll the roster; return a report with a result for every row.
+
+        With dry_run, rows that would be enrolled are reported as ``ok``
+        and nothing is written.
+        """
+        rows = [dict(row) for row in roster_rows]
+        if rows:
+            self._check_fields(rows)
+            self._encode(rows, photos)
+            self._dedupe_faces(rows)
+
+        if dry_run:
+            for row in rows:
+                row.setdefault('status', 'ok')
+        else:
+            inserted = self._insert(rows)
+            self.face_gallery.add_many([(row['user_id'], row['name'], row['encoding'])
+                                        for row in inserted if row['user_id'] is not None])
+
+        results = [{
+            'row': row['row'],
+            'name': row['name'],
+            'roll_number': row['roll_number'],
+            'status': row['status'],
+            'reason': row.get('reason'),
+            'user_id': row.get('user_id')
+        } for row in rows]
+        return {
+            'total': len(results),
+            'enrolled': sum(1 for row in results if row['status'] == 'enrolled'),
+            'failed': sum(1 for row in results if row['status'] == 'failed'),
+            'rows': results
+        }
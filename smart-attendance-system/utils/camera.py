@@ -0,0 +1,206 @@
+"""A camera attached to the server, kept open between check-ins.
+
+Opening a capture device (and probing for one) takes hundreds of
+milliseconds, far longer than recognizing a face. CameraGrabber opens its
+source once and reads frames on a background thread into a
+LatestFrameBuffer, so a check-in takes the newest frame as soon as it
+asks for one. The device is released after ``idle_timeout`` seconds
+without a reader and reopened on the next request.
+
+The source can be a device index, a video file (played at its own frame
+rate, looping), ``synthetic`` for generated face frames, or any object
+with cv2.VideoCapture's ``read()``/``release()``, so tests and demos need
+no camera.
+"""
+import threading
+import time
+import cv2
+from utils.frame_buffer import LatestFrameBuffer
+
+# Device indices tried when no source is given
+PROBE_DEVICES = 3
+
+
+class _PacedSource:
+    """Delivers frames no faster than a camera running at ``fps`` would"""
+
+    def __init__(self, fps):
+        self.interval = 1.0 / fps
+        self._due = None
+
+    def _pace(self):
+        now = time.monotonic()
+        if self._due is not None and now < self._due:
+            time.sleep(self._due - now)
+        self._due = max(now, self._due or now) + self.interval
+
+
+class FrameSource(_PacedSource):
+    """Frames played back at a fixed rate, like a camera would deliver them.
+
+    ``frames`` is a list of images (or a callable returning the next one),
+    cycled for as long as the source is read.
+    """
+
+    def __init__(self, frames, fps=30):
+        super().__init__(fps)
+        self._next = frames if callable(frames) else self._cycle(frames)
+
+    @staticmethod
+    def _cycle(frames):
+        frames = list(frames)
+        position = [0]
+
+        def next_frame():
+            frame = frames[position[0] % len(frames)]
+            position[0] += 1
+            return frame
+        return next_frame
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        self._pace()
+        return True, self._next()
+
+    def release(self):
+        pass
+
+
+class VideoFileSource(_PacedSource):
+    """A video file played at its recorded frame rate, starting over at the end"""
+
+    def __init__(self, path):
+        self.capture = cv2.VideoCapture(path)
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        super().__init__(fps if fps and fps > 0 else 30)
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def read(self):
+        self._pace()
+        ok, frame = self.capture.read()
+        if not ok:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read()
+        return ok, frame
+
+    def release(self):
+        self.capture.release()
+
+
+def synthetic_source(fps=30):
+    """Generated frames of one face, for running without a camera"""
+    # Only needed in demos and tests, so not imported with the module
+    from benchmarks.synthetic import face_scene
+    return FrameSource([cv2.cvtColor(face_scene(640, 480, 1, 0.5, seed=seed)[0], cv2.COLOR_GRAY2BGR)
+                        for seed in range(5)], fps)
+
+
+def open_source(source):
+    """Open a capture source (see the module docstring); None if nothing opens"""
+    if source is None or source == '':
+        for index in range(PROBE_DEVICES):
+            capture = cv2.VideoCapture(index)
+            if capture.isOpened():
+                return capture
+            capture.release()
+        return None
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        capture = cv2.VideoCapture(int(source))
+    elif source == 'synthetic':
+        capture = synthetic_source()
+    elif isinstance(source, str):
+        capture = VideoFileSource(source)
+    else:
+        capture = source
+    if not capture.isOpened():
+        capture.release()
+        return None
+    return capture
+
+
+class CameraGrabber:
+    def __init__(self, source=None, idle_timeout=300.0, retry_interval=5.0):
+        self.source = source
+        self.idle_timeout = idle_timeout
+        self.retry_interval = retry_interval
+        self.frames = LatestFrameBuffer()
+        self._capture = None
+        self._thread = None
+        self._last_read = time.monotonic()
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Open the source and start grabbing; False if it can't be opened.
+
+        After a failure, opening is not retried for ``retry_interval`` seconds.
+        """
+        self._last_read = time.monotonic()
+        if self._thread is not None:
+            return True
+        with self._lock:
+            if self._thread is not None:
+                return True
+            if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval:
+                return False
+            capture = open_source(self.source)
+            if capture is None:
+                print("Camera not available")
+                self._failed_at = time.monotonic()
+                return False
+            self._failed_at = None
+            self._capture = capture
+            self.frames = LatestFrameBuffer()
+            self._thread = threading.Thread(target=self._run, args=(capture, self.frames),
+                                            name='camera-grabber', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, capture, frames):
+        try:
+            while not frames.closed:
+                if self.idle_timeout and time.monotonic() - self._last_read > self.idle_timeout:
+                    break
+                ok, frame = capture.read()
+                if not ok:
+                    print("Camera stopped delivering frames")
+                    break
+                frames.put(frame)
+        finally:
+            capture.release()
+            frames.close()
+            with self._lock:
+                if self._capture is capture:
+                    self._capture = None
+                    self._thread = None
+
+    def read(self, timeout=1.0):
+        """The newest frame not yet read, waiting up to timeout for one.
+
+        Returns None if the camera is unavailable or delivers no frame in time.
+        """
+        # A second try covers the grabber stopping for idleness just as we ask
+        for _ in range(2):
+            if not self.start():
+                return None
+            frames = self.frames
+            frame = frames.get(timeout)
+            if frame is not None or not frames.closed:
+                return frame
+        return None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def stop(self):
+        """Release the device; the next read() opens it again"""
+        with self._lock:
+            thread = self._thread
+            self.frames.close()
+        if thread is not None:
+            thread.join(timeout=5)
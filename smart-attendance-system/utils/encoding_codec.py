@@ -0,0 +1,57 @@
+"""Binary storage format for face encodings.
+
+An encoding is stored in ``users.face_encoding`` (BLOB) as a 4 byte header
+followed by the raw vector:
+
+    byte 0     format version (currently 1)
+    byte 1     reserved, always 0
+    bytes 2-3  dimension as little-endian uint16
+    bytes 4-   ``dimension`` little-endian float32 values
+
+Older rows hold ``pickle.dumps(encoding).hex()`` text. Those are still
+decoded so the application keeps working until
+``migrate_face_encoding_binary.py`` has converted them.
+"""
+import pickle
+import struct
+import numpy as np
+
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BBH')
+ENCODING_DTYPE = np.dtype('<f4')
+
+
+def encode_face_encoding(encoding):
+    """Serialize an encoding to the versioned float32 binary format"""
+    vector = np.ascontiguousarray(encoding, dtype=ENCODING_DTYPE).ravel()
+    if vector.shape[0] > 0xFFFF:
+        raise ValueError(f"Encoding too long to store: {vector.shape[0]} values")
+    return HEADER.pack(FORMAT_VERSION, 0, vector.shape[0]) + vector.tobytes()
+
+
+def is_legacy_encoding(value):
+    """True if value is a pickled-hex encoding from before the binary format"""
+    if isinstance(value, str):
+        return True
+    # After the TEXT -> BLOB column change the hex text arrives as ASCII bytes
+    return len(value) > 0 and value[0] != FORMAT_VERSION
+
+
+def decode_face_encoding(value):
+    """Deserialize a stored encoding to a float32 vector.
+
+    Binary values are wrapped with np.frombuffer without copying the data.
+    """
+    if is_legacy_encoding(value):
+        if not isinstance(value, str):
+            value = bytes(value).decode('ascii')
+        return np.asarray(pickle.loads(bytes.fromhex(value)), dtype=np.float32).ravel()
+
+    if len(value) < HEADER.size:
+        raise ValueError("Stored encoding is truncated")
+    version, _, dimension = HEADER.unpack_from(value)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported encoding format version: {version}")
+    if len(value) != HEADER.size + dimension * ENCODING_DTYPE.itemsize:
+        raise ValueError(f"Stored encoding length does not match dimension {dimension}")
+    return np.frombuffer(value, dtype=ENCODING_DTYPE, count=dimension, offset=HEADER.size)
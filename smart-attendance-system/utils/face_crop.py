@@ -0,0 +1,56 @@
+"""Compact binary photo uploads from the camera pages.
+
+Instead of the whole frame as a base64 JPEG data URL, a page can send
+(``Content-Type: application/x-face-crop``) a 16-byte header followed by
+a small grayscale JPEG or PNG of the region around the face. The header
+is little-endian: the magic ``FCR1``, then six uint16 values, the camera
+frame's width and height and the x, y, w, h of the region the image
+shows, in frame pixels.
+
+Browsers that can find the face themselves (the Shape Detection API's
+FaceDetector) send a crop of about 160 pixels; the server then only
+checks for the face inside that crop. Others send the whole frame,
+downscaled, with the region set to the full frame, and it goes through
+detection as usual.
+"""
+import struct
+from collections import namedtuple
+import cv2
+import numpy as np
+
+FACE_CROP_MIMETYPE = 'application/x-face-crop'
+MAGIC = b'FCR1'
+HEADER = struct.Struct('<4s6H')
+MAX_CROP_SIDE = 640
+MAX_CROP_BYTES = 512 * 1024
+
+# pixels: the grayscale image; box: the x, y, w, h of the camera frame it
+# covers; frame_size: the frame's (width, height)
+FaceCrop = namedtuple('FaceCrop', ['pixels', 'box', 'frame_size'])
+
+
+def full_frame(crop):
+    """Whether the upload is the whole (downscaled) frame rather than a face crop"""
+    return tuple(crop.box) == (0, 0, *crop.frame_size)
+
+
+def parse_face_crop(body):
+    """Return (crop, error) for an upload body; error is a message or None"""
+    if len(body) <= HEADER.size or len(body) > MAX_CROP_BYTES:
+        return None, 'Invalid face crop upload'
+    magic, frame_width, frame_height, x, y, w, h = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        return None, 'Invalid face crop upload'
+    if w == 0 or h == 0 or x + w > frame_width or y + h > frame_height:
+        return None, 'Face crop region is outside the frame'
+
+    pixels = cv2.imdecode(np.frombuffer(body, dtype=np.uint8, offset=HEADER.size), cv2.IMREAD_GRAYSCALE)
+    if pixels is None:
+        return None, 'Face crop image could not be read'
+    height, width = pixels.shape
+    if max(height, width) > MAX_CROP_SIDE:
+        return None, 'Face crop image is too large'
+    # The image must be the region, scaled evenly (allowing for rounding)
+    if abs(width * h - height * w) > 0.05 * width * h + w + h:
+        return None, 'Face crop image does not match its region'
+    return FaceCrop(pixels, (x, y, w, h), (frame_width, frame_height)), None
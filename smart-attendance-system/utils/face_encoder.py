@@ -0,0 +1,82 @@
+"""Histogram and intensity-statistics encoding of face crops.
+
+Each face is resized to a fixed-size crop, and its encoding is a 32-bin
+intensity histogram (as fractions of the pixels) followed by the crop's
+mean, standard deviation, median, minimum and maximum. Every one of those
+is derived from the crop's 256-level histogram, so a crop is read once
+(by calcHist) instead of once per statistic, and the median needs no
+sort. Crops and histograms go into per-thread buffers that are reused
+from call to call.
+
+Encodings are returned as L2-normalized float32 rows. Matching is by
+cosine similarity, so they compare equal to the unnormalized encodings
+stored by earlier versions.
+"""
+import threading
+import cv2
+import numpy as np
+
+CROP_SIZE = 100
+HISTOGRAM_BINS = 32
+ENCODING_DIMENSION = HISTOGRAM_BINS + 5
+
+_LEVELS = np.arange(256, dtype=np.float64)
+
+
+class FaceEncoder:
+    def __init__(self, crop_size=CROP_SIZE):
+        self.crop_size = crop_size
+        self.pixels = crop_size * crop_size
+        # The median of an even number of pixels averages the two middle ones
+        self._lower_rank = (self.pixels - 1) // 2 + 1
+        self._upper_rank = self.pixels // 2 + 1
+        self._local = threading.local()
+
+    def _buffers(self, count):
+        """This thread's crop and histogram buffers, with room for count faces"""
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None or len(buffers[0]) < count:
+            capacity = max(count, 2 * len(buffers[0]) if buffers else 8)
+            buffers = (np.empty((capacity, self.crop_size, self.crop_size), dtype=np.uint8),
+                       np.empty((capacity, 256), dtype=np.float32))
+            self._local.buffers = buffers
+        return buffers
+
+    def encode(self, gray, face_box):
+        """Encoding of one face box in a grayscale image"""
+        return self.encode_many(gray, [face_box])[0]
+
+    def encode_many(self, gray, face_boxes):
+        """Encodings of several face boxes in one image, as an (N, 37) float32 array"""
+        count = len(face_boxes)
+        encodings = np.empty((count, ENCODING_DIMENSION), dtype=np.float32)
+        if count == 0:
+            return encodings
+
+        crops, counts = self._buffers(count)
+        for position, (x, y, w, h) in enumerate(face_boxes):
+            crop = crops[position]
+            cv2.resize(gray[y:y + h, x:x + w], (self.crop_size, self.crop_size), dst=crop)
+            cv2.calcHist([crop], [0], None, [256], [0, 256], hist=counts[position].reshape(256, 1))
+        counts = counts[:count].astype(np.float64)
+
+        # Sums of whole pixel counts are exact in float64, so these match
+        # np.mean/np.std over the pixels
+        mean = counts @ _LEVELS / self.pixels
+        variance = counts @ (_LEVELS * _LEVELS) / self.pixels - mean * mean
+        cumulative = np.cumsum(counts, axis=1)
+        median = (np.argmax(cumulative >= self._lower_rank, axis=1)
+                  + np.argmax(cumulative >= self._upper_rank, axis=1)) / 2
+        occupied = counts > 0
+        minimum = np.argmax(occupied, axis=1)
+        maximum = 255 - np.argmax(occupied[:, ::-1], axis=1)
+
+        encodings[:, :HISTOGRAM_BINS] = counts.reshape(count, HISTOGRAM_BINS, -1).sum(axis=2) / self.pixels
+        stats = encodings[:, HISTOGRAM_BINS:]
+        stats[:, 0] = mean
+        stats[:, 1] = np.sqrt(np.maximum(variance, 0.0))
+        stats[:, 2] = median
+        stats[:, 3] = minimum
+        stats[:, 4] = maximum
+        encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+        return encodings
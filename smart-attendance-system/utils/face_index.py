@@ -0,0 +1,284 @@
+"""Nearest-neighbour indexes over L2-normalized face encodings.
+
+Both indexes answer "which enrolled user is closest to this encoding" by
+cosine similarity and support incremental add/remove, so registrations and
+deletions don't require a rebuild.
+
+``ExactIndex`` scores every enrolled vector with one matrix product.
+``IVFIndex`` is an inverted-file index for large rosters: enrolled vectors
+are grouped into ``nlist`` clusters by spherical k-means, and a query only
+scores the vectors in its ``nprobe`` closest clusters. Rows are kept sorted
+by cluster so every cluster is a contiguous slice of the matrix.
+
+An index's contents live in one dict of arrays that is replaced, never
+modified, on every change, so searches need no lock. The same dict is what
+to_arrays() returns and from_arrays() accepts, which is how recognition
+workers memory-map an index.
+"""
+import numpy as np
+
+
+def normalize_rows(vectors):
+    """Return vectors as a contiguous float32 matrix of unit-length rows"""
+    matrix = np.array(vectors, dtype=np.float32, ndmin=2, copy=True)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return np.ascontiguousarray(matrix)
+
+
+class ExactIndex:
+    """Brute-force cosine search over every enrolled vector"""
+
+    kind = 'exact'
+
+    def __init__(self):
+        self._state = self._empty_state()
+
+    def _empty_state(self):
+        return {'ids': np.empty(0, dtype=np.int64), 'matrix': np.empty((0, 0), dtype=np.float32)}
+
+    def __len__(self):
+        return len(self._state['ids'])
+
+    @property
+    def dimension(self):
+        return self._state['matrix'].shape[1]
+
+    @property
+    def ids(self):
+        return self._state['ids']
+
+    def params(self):
+        return {}
+
+    def _check_dimension(self, vectors):
+        if len(self) > 0 and vectors.shape[1] != self.dimension:
+            raise ValueError(f"Encoding has {vectors.shape[1]} values, index expects {self.dimension}")
+
+    def _appended(self, ids, vectors):
+        """Return (ids, matrix) with new rows appended to the current ones"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize_rows(vectors)
+        if len(self) == 0:
+            return ids.copy(), vectors
+        self._check_dimension(vectors)
+        state = self._state
+        return np.concatenate([state['ids'], ids]), np.vstack([state['matrix'], vectors])
+
+    def build(self, ids, vectors):
+        """Replace the index contents"""
+        if len(ids) == 0:
+            self._state = self._empty_state()
+            return
+        self._state = {'ids': np.array(ids, dtype=np.int64), 'matrix': normalize_rows(vectors)}
+
+    def add(self, ids, vectors):
+        ids, matrix = self._appended(ids, vectors)
+        self._state = {'ids': ids, 'matrix': matrix}
+
+    def remove(self, ids):
+        state = self._state
+        keep = ~np.isin(state['ids'], np.asarray(ids, dtype=np.int64))
+        if not keep.all():
+            self._state = {'ids': state['ids'][keep], 'matrix': np.ascontiguousarray(state['matrix'][keep])}
+
+    def search(self, queries):
+        """Return (ids, similarities) of the best match for each query row.
+
+        ids is -1 where the index is empty.
+        """
+        return self._search_all(self._state, queries)
+
+    @staticmethod
+    def _search_all(state, queries):
+        ids, matrix = state['ids'], state['matrix']
+        if len(ids) == 0:
+            return np.full(len(queries), -1, dtype=np.int64), np.full(len(queries), -1.0, dtype=np.float32)
+        similarities = queries @ matrix.T
+        best = np.argmax(similarities, axis=1)
+        return ids[best], similarities[np.arange(len(best)), best]
+
+    def match(self, face_encodings, tolerance=0.3):
+        """Return (user_id, distance) per encoding, (None, None) if not within tolerance"""
+        no_match = (None, None)
+        if len(face_encodings) == 0:
+            return []
+        queries = normalize_rows(face_encodings)
+        if len(self) == 0 or queries.shape[1] != self.dimension:
+            return [no_match] * len(face_encodings)
+
+        best_ids, similarities = self.search(queries)
+        results = []
+        for user_id, similarity in zip(best_ids, similarities):
+            # Clamp float32 rounding just below zero for identical vectors
+            distance = max(0.0, float(1.0 - similarity))
+            results.append((int(user_id), distance) if user_id >= 0 and distance < tolerance else no_match)
+        return results
+
+    def to_arrays(self):
+        return self._state
+
+    @classmethod
+    def from_arrays(cls, arrays, **params):
+        index = cls(**params)
+        index._state = dict(arrays)
+        return index
+
+
+class IVFIndex(ExactIndex):
+    """Inverted-file approximate index (spherical k-means coarse quantizer).
+
+    ``nlist`` is the number of clusters (0 picks about sqrt(N) at build
+    time) and ``nprobe`` the number of closest clusters scanned per query.
+    Rosters smaller than ``min_train_size`` are searched exactly. The
+    clusters are retrained once the index has doubled since the last
+    training, so incremental adds don't leave them badly unbalanced.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, nlist=0, nprobe=8, min_train_size=1000, kmeans_iterations=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        super().__init__()
+
+    def _empty_state(self):
+        # Rows of cluster c are matrix[offsets[c]:offsets[c + 1]]
+        return {'ids': np.empty(0, dtype=np.int64), 'matrix': np.empty((0, 0), dtype=np.float32),
+                'centroids': np.empty((0, 0), dtype=np.float32), 'offsets': np.zeros(1, dtype=np.int64),
+                'trained_size': np.zeros(1, dtype=np.int64)}
+
+    def params(self):
+        return {'nlist': self.nlist, 'nprobe': self.nprobe, 'min_train_size': self.min_train_size}
+
+    @property
+    def trained(self):
+        return len(self._state['centroids']) > 0
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=8192):
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return assignments
+
+    def _train(self, matrix):
+        nlist = self.nlist or int(np.sqrt(len(matrix)))
+        nlist = max(1, min(nlist, len(matrix)))
+        rng = np.random.default_rng(self.seed)
+        centroids = matrix[rng.choice(len(matrix), nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iterations):
+            assignments = self._assign(matrix, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, matrix)
+            counts = np.bincount(assignments, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Reseed empty clusters with random vectors
+                sums[empty] = matrix[rng.choice(len(matrix), int(empty.sum()), replace=False)]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    @staticmethod
+    def _offsets(assignments, nlist):
+        counts = np.bincount(assignments, minlength=nlist)
+        return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def _make_state(self, ids, matrix, centroids=None, assignments=None, trained_size=None):
+        """Lay rows out sorted by cluster; untrained indexes are one flat list"""
+        if centroids is None:
+            return {'ids': ids, 'matrix': matrix, 'centroids': np.empty((0, 0), dtype=np.float32),
+                    'offsets': np.array([0, len(ids)], dtype=np.int64),
+                    'trained_size': np.zeros(1, dtype=np.int64)}
+        order = np.argsort(assignments, kind='stable')
+        return {'ids': ids[order], 'matrix': np.ascontiguousarray(matrix[order]), 'centroids': centroids,
+                'offsets': self._offsets(assignments, len(centroids)),
+                'trained_size': np.array([trained_size], dtype=np.int64)}
+
+    def _trained_state(self, ids, matrix):
+        """Train (if the roster is large enough) and lay out a new state"""
+        if len(ids) < self.min_train_size:
+            return self._make_state(ids, matrix)
+        centroids = self._train(matrix)
+        return self._make_state(ids, matrix, centroids, self._assign(matrix, centroids), len(ids))
+
+    @staticmethod
+    def _row_assignments(state):
+        offsets = state['offsets']
+        return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    def build(self, ids, vectors):
+        if len(ids) == 0:
+            self._state = self._empty_state()
+            return
+        self._state = self._trained_state(np.array(ids, dtype=np.int64), normalize_rows(vectors))
+
+    def add(self, ids, vectors):
+        state = self._state
+        new_vectors = normalize_rows(vectors)
+        all_ids, all_matrix = self._appended(ids, new_vectors)
+
+        trained_size = int(state['trained_size'][0])
+        if not self.trained or len(all_ids) >= 2 * trained_size:
+            self._state = self._trained_state(all_ids, all_matrix)
+            return
+
+        centroids = state['centroids']
+        assignments = np.concatenate([self._row_assignments(state), self._assign(new_vectors, centroids)])
+        self._state = self._make_state(all_ids, all_matrix, centroids, assignments, trained_size)
+
+    def remove(self, ids):
+        state = self._state
+        keep = ~np.isin(state['ids'], np.asarray(ids, dtype=np.int64))
+        if keep.all():
+            return
+        kept_ids, kept_matrix = state['ids'][keep], np.ascontiguousarray(state['matrix'][keep])
+        if not self.trained:
+            self._state = self._make_state(kept_ids, kept_matrix)
+            return
+        # Removing rows keeps the cluster order, so only the offsets change
+        self._state = dict(state, ids=kept_ids, matrix=kept_matrix,
+                           offsets=self._offsets(self._row_assignments(state)[keep], len(state['centroids'])))
+
+    def search(self, queries):
+        state = self._state
+        ids, matrix, centroids, offsets = state['ids'], state['matrix'], state['centroids'], state['offsets']
+        if len(ids) == 0 or len(centroids) == 0:
+            return self._search_all(state, queries)
+
+        nprobe = min(self.nprobe, len(centroids))
+        coarse = queries @ centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        best_ids = np.full(len(queries), -1, dtype=np.int64)
+        best_similarities = np.full(len(queries), -1.0, dtype=np.float32)
+        for query_index, query in enumerate(queries):
+            for cluster in probes[query_index]:
+                start, end = offsets[cluster], offsets[cluster + 1]
+                if start == end:
+                    continue
+                similarities = matrix[start:end] @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] > best_similarities[query_index]:
+                    best_similarities[query_index] = similarities[best]
+                    best_ids[query_index] = ids[start + best]
+        return best_ids, best_similarities
+
+
+INDEX_TYPES = {
+    ExactIndex.kind: ExactIndex,
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def create_index(kind='exact', **params):
+    try:
+        index_class = INDEX_TYPES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown face index type: {kind} (expected one of {', '.join(INDEX_TYPES)})")
+    return index_class(**params)
@@ -0,0 +1,184 @@
+"""Face tracks across the frames of a camera stream.
+
+A person in front of a kiosk shows up in many consecutive frames. Instead of
+detecting, encoding and matching every face on every frame, FaceTracker
+keeps a track per face, associated from frame to frame by box overlap
+(IoU). The whole frame is only searched for new faces every
+``detect_every`` frames; in between, each track is re-detected inside a
+small window around its last box. A track is encoded and matched once when
+it appears, and again only when it is due for re-verification or its box
+overlap with the previous frame drops (the person moved or turned away).
+"""
+
+# Detection inside the window around a track: the face fills a good part of
+# the window, so a small image and a few large scales are enough
+TRACK_PROFILE = {'max_side': 160, 'scale_factor': 1.1, 'min_neighbors': 3, 'min_face': 0.3, 'max_face': 1.0}
+
+
+def box_iou(first, second):
+    """Intersection over union of two x, y, w, h boxes"""
+    ax, ay, aw, ah = first
+    bx, by, bw, bh = second
+    overlap_w = min(ax + aw, bx + bw) - max(ax, bx)
+    overlap_h = min(ay + ah, by + bh) - max(ay, by)
+    if overlap_w <= 0 or overlap_h <= 0:
+        return 0.0
+    intersection = overlap_w * overlap_h
+    return intersection / float(aw * ah + bw * bh - intersection)
+
+
+class FaceTrack:
+    """One face followed across frames"""
+
+    def __init__(self, track_id, box, frame_index):
+        self.track_id = track_id
+        self.box = box
+        self.first_frame = frame_index
+        self.last_seen = frame_index
+        self.missed = 0
+        self.overlap = 1.0
+        self.user_id = None
+        self.name = None
+        self.distance = None
+        self.identified_at = None
+        # Quality check reason code if the face was too poor to identify
+        self.rejected = None
+        # Set by the caller once attendance has been handled for this track
+        self.attendance = None
+
+    @property
+    def area(self):
+        return self.box[2] * self.box[3]
+
+    def set_identity(self, user_id, name, distance, frame_index, rejected=None):
+        if user_id != self.user_id:
+            # A different person (or nobody): attendance has to be redone
+            self.attendance = None
+        self.user_id, self.name, self.distance = user_id, name, distance
+        self.rejected = rejected
+        self.identified_at = frame_index
+
+
+class FaceTracker:
+    """Keeps face tracks for one stream and identifies each track sparingly.
+
+    ``identify(gray, boxes)`` is called with the boxes of the tracks that
+    need (re)identification and must return one (user_id, name, distance)
+    per box, with a None user_id for unrecognized faces. It may add a
+    fourth item, the quality check reason code for a face that was too
+    poor to identify; such a track is retried like an unrecognized one.
+    """
+
+    def __init__(self, face_utils, identify, profile=None, detect_every=5, iou_threshold=0.3,
+                 max_missed=3, verify_every=30, retry_every=3, reencode_iou=0.5, roi_margin=0.5):
+        self.face_utils = face_utils
+        self.identify = identify
+        self.profile = profile
+        self.detect_every = detect_every
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.verify_every = verify_every
+        self.retry_every = retry_every
+        self.reencode_iou = reencode_iou
+        self.roi_margin = roi_margin
+        self.tracks = []
+        self.frame_index = -1
+        self._next_track_id = 1
+        self._last_full_detection = None
+        # Counters for tuning: full-frame vs window detections, identify() faces
+        self.full_detections = 0
+        self.window_detections = 0
+        self.identifications = 0
+
+    def reset(self):
+        self.tracks = []
+        self._last_full_detection = None
+
+    def _detect_full(self, gray):
+        self.full_detections += 1
+        self._last_full_detection = self.frame_index
+        return [tuple(int(v) for v in box) for box in self.face_utils.detect_faces(gray, self.profile)]
+
+    def _detect_near_tracks(self, gray):
+        """Re-detect each track inside a window around its last box"""
+        height, width = gray.shape[:2]
+        boxes = []
+        for track in self.tracks:
+            x, y, w, h = track.box
+            margin_x, margin_y = int(w * self.roi_margin), int(h * self.roi_margin)
+            left, top = max(0, x - margin_x), max(0, y - margin_y)
+            right, bottom = min(width, x + w + margin_x), min(height, y + h + margin_y)
+            if right - left < 2 or bottom - top < 2:
+                continue
+            self.window_detections += 1
+            for fx, fy, fw, fh in self.face_utils.detect_faces(gray[top:bottom, left:right], TRACK_PROFILE):
+                box = (int(fx) + left, int(fy) + top, int(fw), int(fh))
+                # Neighbouring windows can find the same face twice
+                if all(box_iou(box, other) < self.iou_threshold for other in boxes):
+                    boxes.append(box)
+        return boxes
+
+    def _associate(self, boxes):
+        """Greedily pair tracks and detections by descending IoU.
+
+        Returns (pairs of (track, box, iou), unmatched boxes).
+        """
+        candidates = []
+        for track_position, track in enumerate(self.tracks):
+            for box_position, box in enumerate(boxes):
+                overlap = box_iou(track.box, box)
+                if overlap >= self.iou_threshold:
+                    candidates.append((overlap, track_position, box_position))
+        candidates.sort(reverse=True)
+
+        used_tracks, used_boxes, pairs = set(), set(), []
+        for overlap, track_position, box_position in candidates:
+            if track_position in used_tracks or box_position in used_boxes:
+                continue
+            used_tracks.add(track_position)
+            used_boxes.add(box_position)
+            pairs.append((self.tracks[track_position], boxes[box_position], overlap))
+        unmatched = [box for position, box in enumerate(boxes) if position not in used_boxes]
+        return pairs, unmatched
+
+    def _needs_identify(self, track):
+        if track.identified_at is None:
+            return True
+        since = self.frame_index - track.identified_at
+        if track.user_id is None:
+            return since >= self.retry_every
+        return since >= self.verify_every or track.overlap < self.reencode_iou
+
+    def update(self, gray):
+        """Process one grayscale frame and return the tracks visible in it"""
+        self.frame_index += 1
+        full = (not self.tracks or self._last_full_detection is None
+                or self.frame_index - self._last_full_detection >= self.detect_every)
+        boxes = self._detect_full(gray) if full else self._detect_near_tracks(gray)
+
+        pairs, unmatched = self._associate(boxes)
+        seen = set()
+        for track, box, overlap in pairs:
+            track.box, track.overlap = box, overlap
+            track.last_seen, track.missed = self.frame_index, 0
+            seen.add(track.track_id)
+        for track in self.tracks:
+            if track.track_id not in seen:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        for box in unmatched:
+            track = FaceTrack(self._next_track_id, box, self.frame_index)
+            self._next_track_id += 1
+            self.tracks.append(track)
+
+        visible = [track for track in self.tracks if track.missed == 0]
+        pending = [track for track in visible if self._needs_identify(track)]
+        if pending:
+            self.identifications += len(pending)
+            results = self.identify(gray, [track.box for track in pending])
+            for track, identity in zip(pending, results):
+                track.set_identity(*identity[:3], self.frame_index, *identity[3:])
+
+        # Largest (closest) face first
+        return sorted(visible, key=lambda track: track.area, reverse=True)
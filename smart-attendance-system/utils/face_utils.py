@@ -1,141 +1,271 @@
 import cv2
 import numpy as np
 import os
+import threading
+import time
+from utils.face_encoder import FaceEncoder
+from utils.face_index import ExactIndex
+from utils.face_crop import full_frame
+from utils.face_quality import FaceQualityGate, MIN_FACE_SIZE, MIN_SHARPNESS
+
+# Face detection settings. Detection runs on a copy of the frame shrunk so
+# its longest side is at most max_side pixels (None keeps full resolution)
+# and the boxes are scaled back up, so faces are still encoded from the
+# full-resolution pixels. min_face/max_face bound the face size as a
+# fraction of the frame's shorter side, which keeps the cascade from
+# scanning scales no face will be found at.
+DETECTION_PROFILES = {
+    # One person standing close to the camera: a large face, found cheaply
+    # on a small image
+    'kiosk': {'max_side': 320, 'scale_factor': 1.1, 'min_neighbors': 4, 'min_face': 0.15, 'max_face': 1.0},
+    # Group photos: many small faces, so keep more of the resolution
+    'classroom': {'max_side': 1280, 'scale_factor': 1.1, 'min_neighbors': 4, 'min_face': 0.03, 'max_face': 1.0},
+    # The original settings: full resolution, every scale
+    'full': {'max_side': None, 'scale_factor': 1.1, 'min_neighbors': 4, 'min_face': 0.0, 'max_face': 1.0},
+    # A face crop cut out by the camera page (utils/face_crop.py): the face
+    # fills most of a small image
+    'crop': {'max_side': None, 'scale_factor': 1.1, 'min_neighbors': 3, 'min_face': 0.3, 'max_face': 1.0},
+}
+
+# Smallest face the Haar cascade can find, in pixels of the image it scans
+CASCADE_WINDOW = 24
+
 
 class FaceRecognitionUtils:
-    def __init__(self):
+    def __init__(self, detection_profile=None):
         self.camera = None
-        # Load OpenCV's pre-trained face detector
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self._face_cascade = None
+        self._cascade_lock = threading.Lock()
+        self.detection_profile = detection_profile or os.getenv('DETECTION_PROFILE', 'kiosk')
+        self._profile(self.detection_profile)
+        self.encoder = FaceEncoder()
+        # Checks faces in single-person frames before they are encoded;
+        # FACE_QUALITY_GATE=0 turns them off
+        self.quality_gate = None
+        if os.getenv('FACE_QUALITY_GATE', '1') != '0':
+            self.quality_gate = FaceQualityGate(min_face_size=int(os.getenv('FACE_MIN_SIZE', MIN_FACE_SIZE)),
+                                                min_sharpness=float(os.getenv('FACE_MIN_SHARPNESS', MIN_SHARPNESS)))
     
-    def capture_face_encoding(self):
-        """Simplified face capture for demo - returns a dummy encoding"""
+    @property
+    def face_cascade(self):
+        """OpenCV's pre-trained face detector, loaded on first use"""
+        if self._face_cascade is None:
+            with self._cascade_lock:
+                if self._face_cascade is None:
+                    self._face_cascade = cv2.CascadeClassifier(
+                        cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        return self._face_cascade
+    
+    def capture_face_encoding(self, camera, attempts=30, timeout=1.0):
+        """Encode the best face in the next frames from a CameraGrabber.
+        
+        Tries up to attempts fresh frames. Returns None if the camera is
+        unavailable or no face passing the quality checks is seen.
+        """
         try:
-            # Try different camera indices for Docker compatibility
-            cap = None
-            for i in range(3):
-                cap = cv2.VideoCapture(i)
-                if cap.isOpened():
-                    break
-                cap.release()
-            
-            if cap is None or not cap.isOpened():
-                print("Camera not available - using demo mode")
-                # Return a random encoding for demo purposes
-                return np.random.rand(128)
-            
-            print("Capturing face for demo...")
-            
-            frame_count = 0
-            while frame_count < 30:  # Try for 30 frames
-                ret, frame = cap.read()
-                if not ret:
-                    frame_count += 1
-                    continue
-                
-                # Convert to grayscale for face detection
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
-                
-                if len(faces) > 0:
-                    # Face detected - return a unique encoding based on face position
-                    x, y, w, h = faces[0]
-                    # Create a simple "encoding" based on face characteristics
-                    encoding = np.array([x, y, w, h] + [np.random.rand() for _ in range(124)])
-                    cap.release()
+            for _ in range(attempts):
+                frame = camera.read(timeout)
+                if frame is None:
+                    return None
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+                encoding = self.process_image_for_encoding(gray)
+                if encoding is not None:
                     return encoding
-                
-                frame_count += 1
-            
-            cap.release()
-            # If no face detected, return random encoding for demo
-            return np.random.rand(128)
-            
+            return None
+        
         except Exception as e:
             print(f"Camera error: {e}")
-            # Return dummy encoding for demo
-            return np.random.rand(128)
+            return None
     
     def detect_faces_in_frame(self, frame):
         """Detect faces using OpenCV"""
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+        faces = self.detect_faces(gray)
         return faces, []
     
-    def compare_faces(self, known_encodings, face_encoding, tolerance=0.3):
-        """Compare face encodings using cosine similarity"""
-        if len(known_encodings) == 0:
-            return None, None
+    def _profile(self, profile):
+        if isinstance(profile, dict):
+            return profile
+        profile = profile or self.detection_profile
+        try:
+            return DETECTION_PROFILES[profile]
+        except KeyError:
+            raise ValueError(f"Unknown detection profile: {profile} (expected one of {', '.join(DETECTION_PROFILES)})")
+    
+    def detect_faces(self, gray, profile=None):
+        """Detect faces in a grayscale image using a detection profile.
         
-        # Calculate distances using cosine similarity
-        distances = []
-        for known_encoding in known_encodings:
-            known = np.array(known_encoding)
-            current = np.array(face_encoding)
-            
-            # Cosine similarity (converted to distance)
-            dot_product = np.dot(known, current)
-            norm_product = np.linalg.norm(known) * np.linalg.norm(current)
-            
-            if norm_product == 0:
-                distance = 1.0
-            else:
-                similarity = dot_product / norm_product
-                distance = 1 - similarity  # Convert similarity to distance
-            
-            distances.append(distance)
+        profile is a DETECTION_PROFILES name or a dict of the same keys and
+        defaults to the instance's profile. Returns an (N, 4) int array of
+        x, y, w, h boxes in full-resolution coordinates.
+        """
+        settings = self._profile(profile)
+        height, width = gray.shape[:2]
+        
+        scale = 1.0
+        max_side = settings['max_side']
+        if max_side and max(height, width) > max_side:
+            scale = max_side / max(height, width)
+            small = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        else:
+            small = gray
+        
+        short_side = min(small.shape[:2])
+        min_size = max(CASCADE_WINDOW, int(short_side * settings['min_face']))
+        max_size = max(min_size, int(short_side * settings['max_face']))
+        faces = self.face_cascade.detectMultiScale(
+            small, settings['scale_factor'], settings['min_neighbors'],
+            minSize=(min_size, min_size), maxSize=(max_size, max_size)
+        )
+        if len(faces) == 0:
+            return np.empty((0, 4), dtype=np.int32)
+        if scale == 1.0:
+            return np.asarray(faces, dtype=np.int32)
+        
+        # Map the boxes back onto the full-resolution frame
+        boxes = np.rint(np.asarray(faces, dtype=np.float64) / scale).astype(np.int32)
+        boxes[:, 0] = np.clip(boxes[:, 0], 0, width - 1)
+        boxes[:, 1] = np.clip(boxes[:, 1], 0, height - 1)
+        boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+        boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+        return boxes
+    
+    def compare_faces(self, known_encodings, face_encoding, tolerance=0.3, index=None):
+        """Compare face encodings using cosine similarity
         
-        min_distance_index = np.argmin(distances)
-        min_distance = distances[min_distance_index]
+        known_encodings are searched by brute force and the position of the
+        best match is returned. Pass a prebuilt index from utils/face_index.py
+        instead to search a large gallery; the user id it stores is returned.
+        """
+        if index is None:
+            if len(known_encodings) == 0:
+                return None, None
+            index = ExactIndex()
+            index.build(np.arange(len(known_encodings)), known_encodings)
         
         # Match if distance is below tolerance
-        if min_distance < tolerance:
-            return min_distance_index, min_distance
+        return index.match([face_encoding], tolerance)[0]
+    
+    def decode_frame(self, image_bytes):
+        """Decode raw JPEG/PNG bytes straight to a grayscale array.
         
-        return None, None
+        Returns None if the bytes are not a decodable image.
+        """
+        if not image_bytes:
+            return None
+        buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+        return cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+    
+    def _to_gray(self, image_array):
+        """Return a grayscale view of an RGB or already-gray image"""
+        if len(image_array.shape) == 3:
+            return cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+        return image_array
     
-    def process_image_for_encoding(self, image_array):
-        """Process captured image and generate face encoding"""
+    def encode_face_region(self, gray, face_box):
+        """Generate an encoding for one detected face box in a grayscale image"""
+        return self.encoder.encode(gray, face_box)
+    
+    def encode_face_regions(self, gray, face_boxes):
+        """Encode several face boxes in one grayscale image as an (N, 37) array"""
+        return self.encoder.encode_many(gray, face_boxes)
+    
+    def process_image_for_encoding(self, image_array, profile=None):
+        """Process captured image and generate face encoding.
+        
+        Returns None if no face is found or the best one fails the quality checks.
+        """
+        best = self.process_image_for_best_face(image_array, profile)
+        return best[1] if best is not None else None
+    
+    def select_face(self, gray, faces, scale=1.0):
+        """Pick the face to use from a frame meant to show one person.
+        
+        Returns (position, reason): the position in faces of the best
+        quality face, and why it was rejected, or None if it passes. With
+        the quality gate off, the first face is used as before. scale is
+        the size of a gray pixel in camera frame pixels.
+        """
+        if self.quality_gate is None:
+            return 0, None
+        return self.quality_gate.best_face(gray, faces, scale)
+    
+    def process_image_for_best_face(self, image_array, profile=None, timings=None, scale=1.0):
+        """Encode the best face in an image meant to show one person.
+        
+        Returns (face_box, encoding, reason), or None if no face is found.
+        If even the best face fails the quality checks (utils/face_quality.py),
+        it is not encoded: encoding is None and reason is its reason code.
+        If a timings dict is given, the seconds spent detecting, checking
+        and encoding are stored in it under 'detect', 'quality' and 'encode'.
+        scale is the size of an image pixel in camera frame pixels, for
+        images the camera page has already shrunk.
+        """
         try:
-            # Convert to grayscale for face detection
-            if len(image_array.shape) == 3:
-                gray = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
-            else:
-                gray = image_array
+            started = time.perf_counter()
+            gray = self._to_gray(image_array)
+            faces = self.detect_faces(gray, profile)
+            detected = time.perf_counter()
+            if timings is not None:
+                timings['detect'] = detected - started
+            if len(faces) == 0:
+                return None
             
-            # Detect faces
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+            position, reason = self.select_face(gray, faces, scale)
+            face_box = tuple(int(v) for v in faces[position])
+            checked = time.perf_counter()
+            if timings is not None:
+                timings['quality'] = checked - detected
+            if reason is not None:
+                return face_box, None, reason
             
-            if len(faces) > 0:
-                # Get the first detected face
-                x, y, w, h = faces[0]
-                # Extract face region
-                face_region = gray[y:y+h, x:x+w]
-                
-                # Resize face to standard size for consistent comparison
-                face_resized = cv2.resize(face_region, (100, 100))
-                
-                # Generate encoding based on face region characteristics
-                # Use histogram and statistical features for better uniqueness
-                hist = cv2.calcHist([face_resized], [0], None, [32], [0, 256])
-                hist = hist.flatten() / hist.sum()  # Normalize histogram
-                
-                # Statistical features
-                stats = np.array([
-                    np.mean(face_resized),
-                    np.std(face_resized),
-                    np.median(face_resized),
-                    np.min(face_resized),
-                    np.max(face_resized)
-                ])
-                
-                # Combine features into encoding
-                encoding = np.concatenate([hist, stats])
-                
-                return encoding
-            else:
-                return None
-                
+            encoding = self.encode_face_region(gray, face_box)
+            if timings is not None:
+                timings['encode'] = time.perf_counter() - checked
+            return face_box, encoding, None
+        
         except Exception as e:
             print(f"Error processing image: {e}")
             return None
+    
+    def process_face_crop(self, crop, timings=None):
+        """Encode the face in a FaceCrop uploaded by a camera page.
+        
+        Like process_image_for_best_face(), but a crop around a face is
+        only searched at the scales a face filling it can have. The
+        returned box is in camera frame coordinates.
+        """
+        x, y, w, _ = crop.box
+        scale = w / crop.pixels.shape[1]
+        best = self.process_image_for_best_face(crop.pixels, None if full_frame(crop) else 'crop',
+                                                timings, scale)
+        if best is None:
+            return None
+        (fx, fy, fw, fh), encoding, reason = best
+        face_box = (x + round(fx * scale), y + round(fy * scale), round(fw * scale), round(fh * scale))
+        return face_box, encoding, reason
+    
+    def process_image_for_encodings(self, image_array, max_faces=None, profile=None, timings=None):
+        """Encode every face found in an image (e.g. a group photo).
+        
+        Returns a list of (face_box, encoding) pairs in detection order,
+        at most max_faces long, empty if no face is found. If a timings
+        dict is given, the seconds spent detecting and encoding are stored
+        in it under 'detect' and 'encode'.
+        """
+        try:
+            started = time.perf_counter()
+            gray = self._to_gray(image_array)
+            faces = self.detect_faces(gray, profile)
+            detected = time.perf_counter()
+            faces = faces[:max_faces]
+            encoded = list(zip((tuple(int(v) for v in face_box) for face_box in faces),
+                               self.encode_face_regions(gray, faces)))
+            if timings is not None:
+                timings['detect'] = detected - started
+                timings['encode'] = time.perf_counter() - detected
+            return encoded
+        except Exception as e:
+            print(f"Error processing image: {e}")
+            return []
@@ -0,0 +1,48 @@
+import threading
+
+
+class LatestFrameBuffer:
+    """Single-slot frame buffer that only keeps the newest frame.
+
+    A producer (a socket reader or camera thread) calls put() as fast as
+    frames arrive; the consumer calls get() whenever it is ready for more
+    work. If the consumer falls behind, older frames are overwritten and
+    counted in ``dropped`` instead of queueing up, so the consumer always
+    works on the most recent picture.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self.received += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """Take the newest frame, waiting for one if the slot is empty.
+
+        Returns None once the buffer is closed or the timeout expires.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frame is not None or self._closed, timeout):
+                return None
+            frame = self._frame
+            self._frame = None
+            return frame
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
@@ -0,0 +1,403 @@
+import glob
+import json
+import os
+import threading
+import time
+import numpy as np
+from utils import gallery_changes
+from utils.encoding_codec import decode_face_encoding
+from utils.face_index import INDEX_TYPES, create_index
+from utils.metrics import STAGE_SECONDS
+
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_MANIFEST = 'manifest.json'
+
+# More pending changes than this and sync() reloads everything instead
+SYNC_MAX_CHANGES = 1000
+# Change ids are handed out before their transaction commits, so one can
+# appear after a higher one. Missing ids are re-checked for this long
+# (seconds) before being taken for rolled back
+SYNC_GAP_TIMEOUT = 60
+# Change ids below the latest that were possibly still uncommitted when
+# the gallery was loaded
+SYNC_LOOKBACK = 100
+
+
+def index_settings_from_env():
+    """Index type and parameters from FACE_INDEX / FACE_INDEX_NLIST / FACE_INDEX_NPROBE"""
+    kind = os.getenv('FACE_INDEX', 'exact').lower()
+    params = {}
+    if kind == 'ivf':
+        params = {
+            'nlist': int(os.getenv('FACE_INDEX_NLIST', '0')),
+            'nprobe': int(os.getenv('FACE_INDEX_NPROBE', '8')),
+        }
+    return kind, params
+
+
+class FaceGallery:
+    """Process-resident index of enrolled face encodings.
+
+    Encodings are held as L2-normalized float32 vectors in a nearest-
+    neighbour index (exact brute force by default, or an approximate IVF
+    index for large rosters; see utils/face_index.py). The index is loaded
+    from the users table on first use and then kept in step with
+    registrations and deletions instead of being re-read on every check-in.
+
+    Registrations and deletions made by other app instances are picked up
+    from the ``gallery_changes`` log (utils/gallery_changes.py) at most
+    every ``sync_interval`` seconds, by applying just the changes since the
+    last one seen.
+    """
+
+    def __init__(self, db_config, index_kind=None, sync_interval=None, **index_params):
+        self.db_config = db_config
+        if index_kind is None:
+            index_kind, index_params = index_settings_from_env()
+        self.index = create_index(index_kind, **index_params)
+        self._names = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Bumped on every change so copies of the gallery can tell they are stale
+        self.version = 0
+        # (count, sum, sum of squares) of the ids of users with an encoding,
+        # which tells whether a saved snapshot still matches the users table
+        self._fingerprint = (0, 0, 0)
+        self._saved_version = None
+        # Highest gallery_changes id applied, and ids below it not yet seen
+        self.synced_version = 0
+        self._gaps = {}
+        if sync_interval is None:
+            sync_interval = float(os.getenv('GALLERY_SYNC_INTERVAL', '1'))
+        self.sync_interval = sync_interval
+        self._last_sync = 0.0
+        self._sync_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def dimension(self):
+        return self.index.dimension
+
+    def _changed(self):
+        # Caller holds self._lock
+        self.version += 1
+
+    def snapshot(self):
+        """Return (version, index arrays) as one consistent view"""
+        self.ensure_loaded()
+        with self._lock:
+            return self.version, self.index.to_arrays()
+
+    def name_for(self, user_id):
+        return self._names.get(user_id)
+
+    def refresh(self):
+        """Reload every enrolled encoding from the database"""
+        with STAGE_SECONDS.time(stage='gallery_load'):
+            self._load()
+
+    def _decode_rows(self, rows, dimension=None):
+        """Decode (id, name, encoding) user rows.
+
+        Returns (ids, names, vectors, fingerprint); rows whose encoding
+        can't be decoded are skipped but still counted in the fingerprint.
+        """
+        ids, names, vectors = [], {}, []
+        fingerprint = (0, 0, 0)
+        for user_id, name, stored_encoding in rows:
+            if not stored_encoding:
+                continue
+            fingerprint = self._counted(fingerprint, user_id, 1)
+            try:
+                vector = decode_face_encoding(stored_encoding)
+            except ValueError as e:
+                print(f"Skipping encoding for user {user_id}: {e}")
+                continue
+            if dimension is None:
+                dimension = vector.shape[0]
+            elif vector.shape[0] != dimension:
+                print(f"Skipping encoding for user {user_id}: expected {dimension} values, got {vector.shape[0]}")
+                continue
+            ids.append(user_id)
+            names[user_id] = name
+            vectors.append(vector)
+        return ids, names, vectors, fingerprint
+
+    def _load(self):
+        with self.db_config.connection() as connection:
+            cursor = connection.cursor()
+            # Read in one transaction with the users, so the version matches them
+            synced_version = gallery_changes.latest(cursor)
+            cursor.execute("SELECT id FROM gallery_changes WHERE id > %s", (synced_version - SYNC_LOOKBACK,))
+            recent = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT id, name, face_encoding FROM users")
+            rows = cursor.fetchall()
+            cursor.close()
+
+        ids, names, vectors, fingerprint = self._decode_rows(rows)
+        now = time.monotonic()
+        with self._lock:
+            self.index.build(ids, vectors)
+            self._names = names
+            self._fingerprint = fingerprint
+            self.synced_version = synced_version
+            self._gaps = {change_id: now for change_id in range(max(1, synced_version - SYNC_LOOKBACK + 1),
+                                                               synced_version) if change_id not in recent}
+            self._last_sync = now
+            self._loaded = True
+            self._changed()
+
+    def sync(self):
+        """Apply users added or deleted elsewhere since the last sync.
+
+        Returns True if the gallery changed.
+        """
+        with self._sync_lock:
+            self._last_sync = time.monotonic()
+            gaps = sorted(self._gaps)
+            with self.db_config.connection() as connection:
+                cursor = connection.cursor()
+                changes = gallery_changes.since(cursor, self.synced_version, SYNC_MAX_CHANGES + 1)
+                if gaps:
+                    placeholders = ', '.join(['%s'] * len(gaps))
+                    cursor.execute(f"SELECT id, user_id, action FROM gallery_changes WHERE id IN ({placeholders})",
+                                   gaps)
+                    changes = sorted(cursor.fetchall() + changes)
+                if not changes:
+                    cursor.close()
+                    self._expire_gaps()
+                    return False
+                full_refresh = len(changes) > SYNC_MAX_CHANGES or any(action == 'clear' for _, _, action in changes)
+                if not full_refresh:
+                    # Only the last change per user matters
+                    actions = {}
+                    for _, user_id, action in changes:
+                        actions[int(user_id)] = action
+                    added = [user_id for user_id, action in actions.items()
+                             if action == 'add' and user_id not in self._names]
+                    rows = []
+                    if added:
+                        placeholders = ', '.join(['%s'] * len(added))
+                        cursor.execute(f"SELECT id, name, face_encoding FROM users WHERE id IN ({placeholders})",
+                                       added)
+                        rows = cursor.fetchall()
+                cursor.close()
+
+            if full_refresh:
+                # After the connection is back in the pool: refresh() borrows
+                # its own, and holding two at once can exhaust a small pool
+                self.refresh()
+                return True
+
+            ids, names, vectors, added_fingerprint = self._decode_rows(rows, self.dimension if len(self) else None)
+            removed = [user_id for user_id, action in actions.items()
+                       if action == 'remove' and user_id in self._names]
+            seen = {change[0] for change in changes}
+            newest = max(self.synced_version, changes[-1][0])
+            now = time.monotonic()
+            with self._lock:
+                if removed:
+                    self.index.remove(removed)
+                    for user_id in removed:
+                        self._fingerprint = self._counted(self._fingerprint, user_id, -1)
+                if ids:
+                    self.index.add(ids, vectors)
+                if rows:
+                    self._fingerprint = tuple(map(sum, zip(self._fingerprint, added_fingerprint)))
+                if removed or ids:
+                    self._names = {**{key: value for key, value in self._names.items() if key not in removed},
+                                   **names}
+                    self._changed()
+                for change_id in range(self.synced_version + 1, newest):
+                    if change_id not in seen:
+                        self._gaps[change_id] = now
+                for change_id in seen:
+                    self._gaps.pop(change_id, None)
+                self.synced_version = newest
+            self._expire_gaps()
+            return bool(removed or ids)
+
+    def _expire_gaps(self):
+        """Stop waiting for change ids that must have been rolled back"""
+        cutoff = time.monotonic() - SYNC_GAP_TIMEOUT
+        with self._lock:
+            self._gaps = {change_id: seen for change_id, seen in self._gaps.items() if seen > cutoff}
+
+    @staticmethod
+    def _counted(fingerprint, user_id, sign):
+        count, total, squares = fingerprint
+        user_id = int(user_id)
+        return count + sign, total + sign * user_id, squares + sign * user_id * user_id
+
+    def _database_fingerprint(self):
+        with self.db_config.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(id), 0), COALESCE(SUM(id * id), 0) FROM users
+                WHERE face_encoding IS NOT NULL AND LENGTH(face_encoding) > 0
+            """)
+            fingerprint = tuple(int(value) for value in cursor.fetchone())
+            cursor.close()
+        return fingerprint
+
+    def save_snapshot(self, directory):
+        """Write the gallery to directory for load_snapshot(), if it changed since last saved.
+
+        Array files get unique names and the manifest naming them is
+        replaced last, so a reader never sees a half-written snapshot.
+        """
+        with self._lock:
+            if not self._loaded or self.version == self._saved_version:
+                return False
+            version = self.version
+            arrays = self.index.to_arrays()
+            manifest = {'format': SNAPSHOT_FORMAT, 'index': self.index.kind,
+                        'synced_version': self.synced_version,
+                        'fingerprint': list(self._fingerprint),
+                        # In index order; a list parses much faster than an id-keyed object
+                        'names': [self._names[user_id] for user_id in arrays['ids'].tolist()],
+                        'arrays': {}}
+
+        os.makedirs(directory, exist_ok=True)
+        token = f'{os.getpid()}-{version}'
+        for name, array in arrays.items():
+            file_name = f'{name}-{token}.npy'
+            np.save(os.path.join(directory, file_name), np.asarray(array))
+            manifest['arrays'][name] = file_name
+        manifest_path = os.path.join(directory, SNAPSHOT_MANIFEST)
+        with open(manifest_path + f'.{token}.tmp', 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(manifest_path + f'.{token}.tmp', manifest_path)
+
+        # Processes that already mapped an older file keep a valid mapping
+        for path in glob.glob(os.path.join(directory, '*.npy')):
+            if os.path.basename(path) not in manifest['arrays'].values():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        with self._lock:
+            self._saved_version = version
+        return True
+
+    def load_snapshot(self, directory):
+        """Memory-map a snapshot written by save_snapshot() instead of reading every user row.
+
+        Users added or deleted since it was saved are applied from the
+        change log. Returns False, leaving the gallery unloaded, if there is
+        no usable snapshot or it can't be brought up to date.
+        """
+        with STAGE_SECONDS.time(stage='gallery_snapshot_load'):
+            try:
+                with open(os.path.join(directory, SNAPSHOT_MANIFEST), encoding='utf-8') as manifest_file:
+                    manifest = json.load(manifest_file)
+                if manifest.get('format') != SNAPSHOT_FORMAT or manifest.get('index') != self.index.kind:
+                    return False
+                fingerprint = tuple(manifest['fingerprint'])
+                arrays = {name: np.load(os.path.join(directory, file_name), mmap_mode='r')
+                          for name, file_name in manifest['arrays'].items()}
+                index = INDEX_TYPES[self.index.kind].from_arrays(arrays, **self.index.params())
+                if len(manifest['names']) != len(arrays['ids']):
+                    return False
+                names = dict(zip(arrays['ids'].tolist(), manifest['names']))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Not using gallery snapshot: {e}")
+                return False
+
+            with self._lock:
+                self.index = index
+                self._names = names
+                self._fingerprint = fingerprint
+                self.synced_version = manifest['synced_version']
+                self._gaps = {}
+                self._loaded = True
+                self._changed()
+                self._saved_version = self.version
+            # Catch up, then check nothing was missed (e.g. changes logged
+            # out of order around the time the snapshot was saved)
+            self.sync()
+            if self._fingerprint != self._database_fingerprint():
+                self.invalidate()
+                return False
+        return True
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+        elif (self.sync_interval >= 0 and time.monotonic() - self._last_sync >= self.sync_interval
+              and not self._sync_lock.locked()):
+            try:
+                self.sync()
+            except Exception as e:
+                # Keep answering from the gallery as it is
+                print(f"Error syncing gallery: {e}")
+
+    def invalidate(self):
+        """Force the next lookup to reload from the database"""
+        with self._lock:
+            self._loaded = False
+
+    def add(self, user_id, name, encoding):
+        """Add a newly registered user without reloading the gallery"""
+        self.add_many([(user_id, name, encoding)])
+
+    def add_many(self, users):
+        """Add (user_id, name, encoding) entries in one index update"""
+        if not self._loaded or not users:
+            # The next lookup will pick the new rows up from the database
+            return
+        with self._lock:
+            try:
+                self.index.add([user[0] for user in users], [user[2] for user in users])
+            except ValueError as e:
+                print(f"Not adding {len(users)} user(s) to gallery: {e}")
+                return
+            self._names = {**self._names, **{user[0]: user[1] for user in users}}
+            for user in users:
+                self._fingerprint = self._counted(self._fingerprint, user[0], 1)
+            self._changed()
+
+    def remove(self, user_id):
+        """Drop a deleted user from the gallery"""
+        user_id = int(user_id)
+        with self._lock:
+            if user_id not in self._names:
+                return
+            self.index.remove([user_id])
+            self._names = {key: value for key, value in self._names.items() if key != user_id}
+            self._fingerprint = self._counted(self._fingerprint, user_id, -1)
+            self._changed()
+
+    def clear(self):
+        with self._lock:
+            self.index.build([], [])
+            self._names = {}
+            self._fingerprint = (0, 0, 0)
+            self._loaded = True
+            self._changed()
+
+    def match(self, face_encoding, tolerance=0.3):
+        """Return (user_id, name, distance) of the closest enrolled face.
+
+        Returns (None, None, None) if the gallery is empty or the closest
+        face is not within tolerance (cosine distance).
+        """
+        return self.match_batch([face_encoding], tolerance)[0]
+
+    def match_batch(self, face_encodings, tolerance=0.3):
+        """Match several encodings (e.g. every face in a group photo) at once.
+
+        Returns a list of (user_id, name, distance) in input order, with
+        (None, None, None) for faces that are not within tolerance.
+        """
+        self.ensure_loaded()
+        results = []
+        for user_id, distance in self.index.match(face_encodings, tolerance):
+            name = self._names.get(user_id) if user_id is not None else None
+            if name is None:
+                results.append((None, None, None))
+            else:
+                results.append((user_id, name, distance))
+        return results
@@ -0,0 +1,31 @@
+"""Change log of the users in the face gallery.
+
+Every registration and deletion also appends a row to ``gallery_changes``
+in the same transaction, so the highest change id is a gallery version
+shared by every app instance. An instance whose gallery is at version v
+catches up by applying the changes after v (see FaceGallery.sync()),
+instead of reloading every user.
+"""
+
+
+def record(cursor, action, user_ids=(None,)):
+    """Log 'add' or 'remove' for user_ids, or 'clear' for every user"""
+    cursor.executemany("INSERT INTO gallery_changes (user_id, action) VALUES (%s, %s)",
+                       [(user_id, action) for user_id in user_ids])
+
+
+def latest(cursor):
+    """The current gallery version (0 before the first change)"""
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM gallery_changes")
+    return int(cursor.fetchone()[0])
+
+
+def since(cursor, version, limit):
+    """Up to limit (id, user_id, action) changes after version, oldest first"""
+    cursor.execute("""
+        SELECT id, user_id, action FROM gallery_changes
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s
+    """, (version, limit))
+    return cursor.fetchall()
@@ -0,0 +1,57 @@
+"""Keyset pagination for the admin report pages.
+
+Pages are fetched with ``WHERE <sort key> past <last row's key> LIMIT n``
+instead of OFFSET, so every page costs the same no matter how deep into
+the list it is. The position is carried between requests in an opaque
+``cursor`` query parameter holding the last row's key and the number of
+rows shown so far.
+"""
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(key, shown):
+    payload = json.dumps({'key': list(key), 'shown': shown}, default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(token, key_length=1):
+    """Return (key, shown) from a cursor token, or (None, 0) for the first page.
+
+    key is a list of key_length values, as the page's key_of() gave them.
+    """
+    if not token:
+        return None, 0
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        key, shown = payload['key'], int(payload['shown'])
+    except (ValueError, KeyError, TypeError):
+        # A mangled link just starts over
+        return None, 0
+    if (not isinstance(key, list) or len(key) != key_length
+            or not all(isinstance(value, (str, int, float)) for value in key)):
+        return None, 0
+    return key, shown
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+class Page:
+    """One page of rows plus what the template needs to link to the next"""
+
+    def __init__(self, rows, size, shown, key_of):
+        self.has_next = len(rows) > size
+        self.rows = rows[:size]
+        # Number of rows on earlier pages, for row numbering
+        self.start = shown
+        self.next_cursor = None
+        if self.has_next:
+            self.next_cursor = encode_cursor(key_of(self.rows[-1]), shown + len(self.rows))
@@ -0,0 +1,126 @@
+import threading
+from datetime import date, datetime
+from utils.attendance_writer import write_rows
+from utils.metrics import ATTENDANCE_MARKS, STAGE_SECONDS
+
+
+class PresenceSet:
+    """Ids of the users already marked present today.
+
+    Loaded from the attendance table on first use and again whenever the
+    date changes, then kept up to date as attendance is marked, so a repeat
+    check-in is answered from memory. New rows are written with INSERT
+    IGNORE against the unique (user_id, date) index; the database stays the
+    authority when several processes mark attendance at once.
+
+    With a ``writer`` (utils/attendance_writer.py) new rows are queued for a
+    background thread instead of being written before returning. The set is
+    then the only check, so a user marked by another process in the last few
+    milliseconds may be reported as newly marked; the index still keeps a
+    single row.
+    """
+
+    def __init__(self, db_config, writer=None):
+        self.db_config = db_config
+        self.writer = writer
+        self._day = None
+        self._present = frozenset()
+        self._lock = threading.Lock()
+
+    def warm(self, day=None):
+        """Load the users marked present on day (default today)"""
+        day = day or date.today()
+        self.flush()
+        with self.db_config.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT user_id FROM attendance WHERE date = %s", (day,))
+            present = frozenset(row[0] for row in cursor.fetchall())
+            cursor.close()
+
+        with self._lock:
+            self._day = day
+            self._present = present
+
+    def _current_day(self):
+        """Today's date, reloading the set first if the day has changed"""
+        today = date.today()
+        if self._day != today:
+            self.warm(today)
+        return today
+
+    def flush(self):
+        """Write any queued rows now, e.g. before attendance is edited directly"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def invalidate(self):
+        """Force a reload, e.g. after attendance rows were deleted"""
+        with self._lock:
+            self._day = None
+
+    def discard(self, user_id):
+        with self._lock:
+            self._present = self._present - {int(user_id)}
+
+    def _add(self, day, user_ids):
+        with self._lock:
+            if self._day == day:
+                self._present = self._present | set(user_ids)
+
+    def _claim(self, day, user_ids):
+        """Add the users not yet present and return them, as one step"""
+        with self._lock:
+            claimed = [user_id for user_id in user_ids if user_id not in self._present]
+            if self._day == day:
+                self._present = self._present | set(claimed)
+            return claimed
+
+    def is_present(self, user_id):
+        self._current_day()
+        return user_id in self._present
+
+    def __len__(self):
+        self._current_day()
+        return len(self._present)
+
+    def mark(self, user_id):
+        """Mark a user present today. Returns False if already marked."""
+        return user_id in self.mark_many([user_id])
+
+    def mark_many(self, user_ids):
+        """Mark several users present today.
+
+        Returns the set of user ids that were newly marked; users who are
+        already present are skipped without touching the database.
+        """
+        today = self._current_day()
+        user_ids = list(dict.fromkeys(user_ids))
+        new_user_ids = [user_id for user_id in user_ids if user_id not in self._present]
+        if not new_user_ids:
+            ATTENDANCE_MARKS.inc(len(user_ids), result='already_marked')
+            return set()
+
+        now = datetime.now().time()
+        if self.writer is not None:
+            marked = self._claim(today, new_user_ids)
+            try:
+                self.writer.submit(marked, today, now)
+            except Exception:
+                with self._lock:
+                    self._present = self._present - set(marked)
+                raise
+            ATTENDANCE_MARKS.inc(len(marked), result='marked')
+            ATTENDANCE_MARKS.inc(len(user_ids) - len(marked), result='already_marked')
+            return set(marked)
+
+        with STAGE_SECONDS.time(stage='db_write'):
+            # One multi-row INSERT IGNORE; write_rows() only falls back to a
+            # row at a time, to learn which rows are new, when the unique
+            # index ignored some of them
+            inserted = write_rows(self.db_config, [(user_id, today, now) for user_id in new_user_ids])
+        marked = {user_id for user_id, _, _ in inserted}
+
+        self._add(today, new_user_ids)
+        ATTENDANCE_MARKS.inc(len(marked), result='marked')
+        ATTENDANCE_MARKS.inc(len(user_ids) - len(marked), result='already_marked')
+        return marked
@@ -0,0 +1,245 @@
+"""Face recognition off the request thread.
+
+With ``workers > 0`` frames are decoded, detected, encoded and matched in a
+pool of worker processes, so concurrent kiosks use every core instead of
+serializing on the GIL. Each worker holds its own Haar cascade. The gallery
+index is shared through read-only ``.npy`` snapshots of its arrays on
+tmpfs that workers memory-map, so all processes read the same physical
+pages and a worker only re-maps when the gallery version changes.
+
+With ``workers == 0`` the same steps run inline in the calling thread.
+"""
+import atexit
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from utils.face_crop import FaceCrop
+from utils.face_utils import FaceRecognitionUtils
+from utils.face_index import INDEX_TYPES
+from utils.metrics import MATCH_DISTANCE, RECOGNITIONS, STAGE_SECONDS
+
+# Per-process worker state, set up by _init_worker
+_worker_face_utils = None
+_worker_gallery = {'snapshot': None, 'index': None}
+
+
+def _init_worker():
+    global _worker_face_utils
+    # One process per core already; don't let OpenCV oversubscribe them
+    cv2.setNumThreads(1)
+    _worker_face_utils = FaceRecognitionUtils()
+
+
+def _worker_index(snapshot):
+    """Memory-map the index published as ``snapshot`` (kind, params, paths)"""
+    if _worker_gallery['snapshot'] != snapshot:
+        kind, params, paths = snapshot
+        arrays = {name: np.load(path, mmap_mode='r') for name, path in paths}
+        _worker_gallery['index'] = INDEX_TYPES[kind].from_arrays(arrays, **dict(params))
+        _worker_gallery['snapshot'] = snapshot
+    return _worker_gallery['index']
+
+
+def recognize_frame(face_utils, index, image, all_faces=False, tolerance=0.3, profile=None, timings=None):
+    """Detect, encode and match faces in an encoded image, image array or FaceCrop.
+
+    Returns None if the image cannot be decoded, otherwise a list of dicts
+    with ``box``, ``encoding``, ``user_id``, ``distance`` and ``rejected``
+    (``user_id`` is None for unrecognized faces). Unless ``all_faces`` is
+    set, only the best-quality face is returned, and if it fails the
+    quality checks it is not encoded or matched: ``rejected`` holds the
+    reason code (see utils/face_quality.py) and the other fields are None.
+    ``profile`` picks the detection profile (see DETECTION_PROFILES in
+    utils/face_utils.py). If a timings dict is given, the seconds spent in
+    each step are stored in it by step name.
+    """
+    if timings is None:
+        timings = {}
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        started = time.perf_counter()
+        image = face_utils.decode_frame(image)
+        timings['decode_image'] = time.perf_counter() - started
+        if image is None:
+            return None
+
+    if all_faces and not isinstance(image, FaceCrop):
+        detected = face_utils.process_image_for_encodings(image, profile=profile, timings=timings)
+    else:
+        # A FaceCrop from a camera page (utils/face_crop.py) shows one person
+        best = (face_utils.process_face_crop(image, timings=timings) if isinstance(image, FaceCrop)
+                else face_utils.process_image_for_best_face(image, profile=profile, timings=timings))
+        if best is not None and best[2] is not None:
+            face_box, _, reason = best
+            return [{'box': face_box, 'encoding': None, 'user_id': None, 'distance': None, 'rejected': reason}]
+        detected = [best[:2]] if best is not None else []
+    if not detected:
+        return []
+
+    started = time.perf_counter()
+    matches = index.match([encoding for _, encoding in detected], tolerance)
+    timings['match'] = time.perf_counter() - started
+    return [{
+        'box': face_box,
+        'encoding': encoding,
+        'user_id': user_id,
+        'distance': distance,
+        'rejected': None
+    } for (face_box, encoding), (user_id, distance) in zip(detected, matches)]
+
+
+def _recognize_in_worker(image, snapshot, all_faces, tolerance, profile):
+    # Metrics live in the parent process, so step timings travel back with the result
+    timings = {}
+    faces = recognize_frame(_worker_face_utils, _worker_index(snapshot), image, all_faces, tolerance,
+                            profile, timings)
+    return faces, timings
+
+
+class RecognitionPool:
+    """Runs recognition inline or in a pool of worker processes"""
+
+    def __init__(self, face_gallery, face_utils=None, workers=0):
+        self.face_gallery = face_gallery
+        self.workers = workers
+        self._face_utils = face_utils
+        self._executor = None
+        self._snapshot_dir = None
+        self._snapshot = None
+        self._snapshot_version = None
+        self._published = []
+        self._snapshot_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started on first use: spawned workers re-import the main module,
+        # and must not each start a pool of their own
+        with self._start_lock:
+            if self._executor is None:
+                # spawn, not fork: forking a threaded Flask process is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker
+                )
+                base_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+                self._snapshot_dir = tempfile.mkdtemp(prefix='attendance-gallery-', dir=base_dir)
+                atexit.register(self.shutdown)
+        return self._executor
+
+    @property
+    def face_utils(self):
+        if self._face_utils is None:
+            self._face_utils = FaceRecognitionUtils()
+        return self._face_utils
+
+    def _publish_snapshot(self):
+        """Write the current gallery for the workers if it has changed"""
+        version, arrays = self.face_gallery.snapshot()
+        with self._snapshot_lock:
+            if version == self._snapshot_version:
+                return self._snapshot
+
+            paths = []
+            for name, array in arrays.items():
+                path = os.path.join(self._snapshot_dir, f'{name}-{version}.npy')
+                temp_path = path + '.tmp'
+                with open(temp_path, 'wb') as snapshot_file:
+                    np.save(snapshot_file, array)
+                os.replace(temp_path, path)
+                paths.append((name, path))
+
+            index = self.face_gallery.index
+            snapshot = (index.kind, tuple(index.params().items()), tuple(paths))
+            self._snapshot = snapshot
+            self._snapshot_version = version
+
+            # Keep a couple of older generations for tasks that were queued
+            # before this change; workers that already mapped a removed file
+            # keep a valid mapping
+            self._published.append(paths)
+            while len(self._published) > 3:
+                for _, path in self._published.pop(0):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            return snapshot
+
+    def submit(self, image, all_faces=False, tolerance=0.3, profile=None):
+        """Queue a frame for a worker process.
+
+        Returns a Future of (faces, step timings); see recognize_frame().
+        """
+        if isinstance(image, memoryview):
+            image = bytes(image)
+        executor = self._ensure_started()
+        return executor.submit(_recognize_in_worker, image, self._publish_snapshot(),
+                               all_faces, tolerance, profile)
+
+    def recognize(self, image, all_faces=False, tolerance=0.3, profile=None, timeout=30):
+        """Recognize faces in raw image bytes or an image array.
+
+        See recognize_frame() for the result format; each face also gets
+        the matched user's ``name``.
+        """
+        started = time.perf_counter()
+        if self.workers > 0:
+            faces, timings = self.submit(image, all_faces, tolerance, profile).result(timeout=timeout)
+            # Queueing, pickling and snapshot publishing on top of the work itself
+            timings['worker_overhead'] = max(0.0, time.perf_counter() - started - sum(timings.values()))
+        else:
+            self.face_gallery.ensure_loaded()
+            timings = {}
+            faces = recognize_frame(self.face_utils, self.face_gallery.index, image, all_faces, tolerance,
+                                    profile, timings)
+
+        for stage, seconds in timings.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        if faces is None:
+            RECOGNITIONS.inc(result='invalid_image')
+        elif not faces:
+            RECOGNITIONS.inc(result='no_face')
+
+        for face in faces or []:
+            face['name'] = None
+            if face['rejected'] is not None:
+                RECOGNITIONS.inc(result=f"rejected_{face['rejected']}")
+                continue
+            if face['user_id'] is not None:
+                face['name'] = self.face_gallery.name_for(face['user_id'])
+                if face['name'] is None:
+                    # Deleted since the worker's snapshot was published
+                    face['user_id'] = face['distance'] = None
+            if face['user_id'] is None:
+                RECOGNITIONS.inc(result='unrecognized')
+            else:
+                RECOGNITIONS.inc(result='recognized')
+                MATCH_DISTANCE.observe(face['distance'])
+        return faces
+
+    def warm(self, timeout=60):
+        """Start every worker and have it load its detector and the gallery"""
+        if self.workers == 0:
+            self.face_utils.face_cascade
+            return
+        blank = np.zeros((64, 64), dtype=np.uint8)
+        for future in [self.submit(blank) for _ in range(self.workers)]:
+            future.result(timeout=timeout)
+
+    def shutdown(self):
+        with self._start_lock:
+            self._shutdown()
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._snapshot_dir is not None:
+            shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+            self._snapshot_dir = None
@@ -0,0 +1,174 @@
+"""Recent recognition results, reused for near-identical photos.
+
+A double-click on the check-in button, or a browser retrying a request,
+sends practically the same picture again a second or two later. Instead
+of detecting, encoding and matching it again, RecognitionCache returns
+the result computed for the earlier photo.
+
+A photo is looked up in two steps. First by a 16x16 grayscale thumbnail
+of the whole frame: entries whose thumbnail differs by at most
+``max_difference`` gray levels on average are candidates. At a fixed kiosk
+the background fills most of that thumbnail, so two different people
+standing in the same spot can pass this step. A candidate is therefore
+only a hit if the face region of the new photo, cut at the boxes of the
+cached result, also matches the thumbnails of those faces stored with it
+(within ``max_face_difference``). A retry of the same photo matches both;
+someone else in front of the same background fails the face check.
+Results without a face are not stored, as there is nothing to check.
+
+Entries expire ``ttl`` seconds after they were stored, the least recently
+used are evicted beyond ``max_entries``, and all of them stop matching once
+the gallery version they were computed against changes.
+"""
+import threading
+import time
+from collections import OrderedDict
+import cv2
+import numpy as np
+from utils.face_crop import FaceCrop
+from utils.metrics import REGISTRY
+
+FINGERPRINT_SIDE = 16
+# Encoded images are fingerprinted from a decode at this fraction of their size
+REDUCED_SCALE = 0.25
+
+RESULT_CACHE = REGISTRY.counter(
+    'attendance_result_cache_total', 'Check-in photo result cache lookups, by outcome', ['result'])
+
+
+def _thumbnail(gray):
+    return cv2.resize(gray, (FINGERPRINT_SIDE, FINGERPRINT_SIDE), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class Fingerprint:
+    """Thumbnail of a photo, plus the grayscale pixels to cut face regions from.
+
+    ``scale`` and ``offset`` map camera frame coordinates (those of the
+    recognition result's boxes) onto the pixels.
+    """
+
+    def __init__(self, gray, scale=1.0, offset=(0, 0)):
+        self.gray = gray
+        self.scale = scale
+        self.offset = offset
+        self.frame = _thumbnail(gray).ravel()
+
+    def face(self, box):
+        """Thumbnail of the region at a frame x, y, w, h box, or None if it is outside the photo"""
+        x, y, w, h = box
+        left = max(0, int((x - self.offset[0]) * self.scale))
+        top = max(0, int((y - self.offset[1]) * self.scale))
+        right = min(self.gray.shape[1], int(np.ceil((x + w - self.offset[0]) * self.scale)))
+        bottom = min(self.gray.shape[0], int(np.ceil((y + h - self.offset[1]) * self.scale)))
+        if right - left < 2 or bottom - top < 2:
+            return None
+        return _thumbnail(self.gray[top:bottom, left:right])
+
+
+def fingerprint(image):
+    """Fingerprint of encoded image bytes, an image array or a FaceCrop.
+
+    Returns None if the bytes are not a decodable image. Encoded images are
+    decoded at a quarter of their size, which is all a thumbnail needs.
+    """
+    scale, offset = 1.0, (0, 0)
+    if isinstance(image, FaceCrop):
+        x, y, w, _ = image.box
+        image, scale, offset = image.pixels, image.pixels.shape[1] / w, (x, y)
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        image = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if image is None:
+            return None
+        scale = REDUCED_SCALE
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return Fingerprint(image, scale, offset)
+
+
+def _difference(first, second):
+    return float(np.abs(first - second).mean())
+
+
+class RecognitionCache:
+    def __init__(self, max_entries=256, ttl=3.0, max_difference=2.0, max_face_difference=1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_difference = max_difference
+        self.max_face_difference = max_face_difference
+        # key -> (stored at, gallery version, result, face thumbnails); oldest use first
+        self._entries = OrderedDict()
+        # Frame thumbnails of the entries, row per key, for one vectorized comparison
+        self._keys = []
+        self._fingerprints = np.empty((0, FINGERPRINT_SIDE * FINGERPRINT_SIDE), dtype=np.int16)
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, keys):
+        keys = set(keys)
+        for key in keys:
+            del self._entries[key]
+        keep = [position for position, key in enumerate(self._keys) if key not in keys]
+        self._keys = [self._keys[position] for position in keep]
+        self._fingerprints = self._fingerprints[keep]
+
+    def _same_faces(self, image_fingerprint, result, faces):
+        """Whether the photo shows the cached faces where the result found them"""
+        for face, stored in zip(result, faces):
+            current = image_fingerprint.face(face['box'])
+            if current is None or _difference(current, stored) > self.max_face_difference:
+                return False
+        return True
+
+    def get(self, image_fingerprint, version):
+        """Result stored for a near-identical photo under this gallery version, or None"""
+        with self._lock:
+            if not self._keys:
+                RESULT_CACHE.inc(result='miss')
+                return None
+            now = time.monotonic()
+            stale = [key for key, (stored_at, entry_version, _, _) in self._entries.items()
+                     if entry_version != version or now - stored_at > self.ttl]
+            if stale:
+                RESULT_CACHE.inc(len(stale), result='expired')
+                self._drop(stale)
+                if not self._keys:
+                    RESULT_CACHE.inc(result='miss')
+                    return None
+
+            differences = np.abs(self._fingerprints - image_fingerprint.frame).mean(axis=1)
+            candidates = [position for position in np.argsort(differences)
+                          if differences[position] <= self.max_difference]
+            for position in candidates:
+                key = self._keys[position]
+                _, _, result, faces = self._entries[key]
+                if self._same_faces(image_fingerprint, result, faces):
+                    self._entries.move_to_end(key)
+                    RESULT_CACHE.inc(result='hit')
+                    return result
+            # A similar frame with a different face in it counts separately
+            RESULT_CACHE.inc(result='face_mismatch' if candidates else 'miss')
+            return None
+
+    def put(self, image_fingerprint, version, result):
+        """Store a result with a thumbnail of each of its faces; results
+        without a face (or with one outside the photo) are not stored"""
+        faces = [image_fingerprint.face(face['box']) for face in result]
+        if not faces or any(face is None for face in faces):
+            return
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = (time.monotonic(), version, result, faces)
+            self._keys.append(key)
+            self._fingerprints = np.vstack([self._fingerprints, image_fingerprint.frame.reshape(1, -1)])
+            if len(self._entries) > self.max_entries:
+                evicted = list(self._entries)[:len(self._entries) - self.max_entries]
+                RESULT_CACHE.inc(len(evicted), result='evicted')
+                self._drop(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._drop(list(self._entries))
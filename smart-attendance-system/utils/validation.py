@@ -0,0 +1,15 @@
+import re
+
+EMAIL_REGEX = r'^[a-zA-Z0-9._-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
+
+def registration_error(name, email):
+    """Return a message describing what is wrong with a new user's details, or None"""
+    # Validate name (alphabets and spaces only, max 60 chars)
+    if not name or len(name) > 60 or not all(c.isalpha() or c.isspace() for c in name):
+        return 'Invalid name. Use alphabets only (maximum 60 characters).'
+    
+    # Validate email format
+    if not re.match(EMAIL_REGEX, email or ''):
+        return 'Invalid email format. Please use format like user@gmail.com'
+    return None
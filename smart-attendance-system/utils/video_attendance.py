@@ -0,0 +1,202 @@
+"""Attendance from a recorded lecture video.
+
+The video is sampled at ``sample_rate`` frames per second of video. It
+is split into segments that worker processes decode in parallel, each
+opening the file and seeking to its own segment. Every sampled frame goes
+through the group photo steps: detection with the ``classroom`` profile,
+then encoding every face with FaceRecognitionUtils. The encodings come
+back to the calling process and are matched against the gallery in one
+batch per segment.
+
+A user counts as present when matched in at least ``min_sightings``
+sampled frames, so a single false match doesn't mark anyone. Everyone
+present gets one attendance row, all written in one transaction.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+import cv2
+import numpy as np
+from utils.attendance_writer import write_rows
+from utils.face_encoder import ENCODING_DIMENSION
+from utils.face_utils import FaceRecognitionUtils
+
+_worker_face_utils = None
+
+
+def _init_worker():
+    global _worker_face_utils
+    cv2.setNumThreads(1)
+    _worker_face_utils = FaceRecognitionUtils()
+
+
+def video_info(path):
+    """Return (frame count, frames per second) of a video file; raises ValueError if it can't be read"""
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open video: {path}")
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = capture.get(cv2.CAP_PROP_FPS)
+    finally:
+        capture.release()
+    if frame_count <= 0 or not fps or fps <= 0:
+        raise ValueError(f"Cannot tell the length of video: {path}")
+    return frame_count, fps
+
+
+def encode_segment(face_utils, path, start, stop, step, profile='classroom'):
+    """Encode the faces in every step-th frame from start up to stop.
+
+    Returns (frame numbers, faces per frame, (N, 37) encodings of all the
+    faces in frame order, frames decoded).
+    """
+    capture = cv2.VideoCapture(path)
+    frames, counts, encodings = [], [], []
+    decoded = 0
+    try:
+        if start > 0:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        # Sampled frames are multiples of step, whichever segment they are in
+        frame_number = start
+        next_sample = -(-start // step) * step
+        while frame_number < stop:
+            # grab() skips a frame without converting it to an image
+            if not capture.grab():
+                break
+            decoded += 1
+            if frame_number == next_sample:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+                faces = face_utils.detect_faces(gray, profile)
+                frames.append(frame_number)
+                counts.append(len(faces))
+                if len(faces):
+                    encodings.append(face_utils.encode_face_regions(gray, faces))
+                next_sample += step
+            frame_number += 1
+    finally:
+        capture.release()
+    encodings = np.concatenate(encodings) if encodings else np.empty((0, ENCODING_DIMENSION), dtype=np.float32)
+    return frames, counts, encodings, decoded
+
+
+def _encode_segment_in_worker(path, start, stop, step):
+    return encode_segment(_worker_face_utils, path, start, stop, step)
+
+
+class VideoAttendance:
+    """Finds enrolled users in a video and marks them present.
+
+    ``workers`` is the number of decoding processes (0 decodes in the
+    calling process; None uses every core).
+    """
+
+    def __init__(self, db_config, face_gallery, workers=None, sample_rate=1.0, min_sightings=3, tolerance=0.3):
+        self.db_config = db_config
+        self.face_gallery = face_gallery
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.sample_rate = sample_rate
+        self.min_sightings = min_sightings
+        self.tolerance = tolerance
+
+    def _segments(self, frame_count, step):
+        """Split the frames into segments of whole samples, a few per worker"""
+        samples = -(-frame_count // step)
+        pieces = max(1, min(samples, self.workers * 4))
+        bounds = [round(samples * piece / pieces) * step for piece in range(pieces + 1)]
+        bounds[-1] = max(bounds[-1], frame_count)
+        return [(bounds[piece], bounds[piece + 1]) for piece in range(pieces) if bounds[piece] < bounds[piece + 1]]
+
+    def _encoded_segments(self, path, frame_count, step):
+        """Yield encode_segment() results, in parallel when workers > 0"""
+        segments = self._segments(frame_count, step)
+        if self.workers > 0 and len(segments) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(segments)),
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker) as executor:
+                futures = [executor.submit(_encode_segment_in_worker, path, start, stop, step)
+                           for start, stop in segments]
+                for future in futures:
+                    yield future.result()
+        else:
+            face_utils = FaceRecognitionUtils()
+            for start, stop in segments:
+                yield encode_segment(face_utils, path, start, stop, step)
+
+    def run(self, path, day=None, started_at=None, dry_run=False):
+        """Process a video and mark everyone seen often enough present.
+
+        day is the session's date (default today) and started_at the
+        time of day the recording began; each user's attendance time is
+        when they were first seen (the current time if started_at is not
+        given). Returns a report dict with the per-user sightings and
+        processing speed.
+        """
+        frame_count, fps = video_info(path)
+        step = max(1, round(fps / self.sample_rate))
+        day = day or date.today()
+        self.face_gallery.ensure_loaded()
+
+        started = time.perf_counter()
+        sightings = {}
+        sampled = decoded = faces_found = 0
+        for frames, counts, encodings, segment_decoded in self._encoded_segments(path, frame_count, step):
+            decoded += segment_decoded
+            sampled += len(frames)
+            faces_found += len(encodings)
+            matches = iter(self.face_gallery.match_batch(encodings, self.tolerance) if len(encodings) else [])
+            for frame_number, count in zip(frames, counts):
+                # A person counts once per frame, however many faces matched them
+                seen = {}
+                for _ in range(count):
+                    user_id, name, distance = next(matches)
+                    if user_id is not None and (user_id not in seen or distance < seen[user_id][1]):
+                        seen[user_id] = (name, distance)
+                for user_id, (name, distance) in seen.items():
+                    entry = sightings.setdefault(user_id, {'user_id': user_id, 'name': name, 'sightings': 0,
+                                                           'first_seen': frame_number / fps,
+                                                           'best_distance': distance})
+                    entry['sightings'] += 1
+                    entry['first_seen'] = min(entry['first_seen'], frame_number / fps)
+                    entry['best_distance'] = min(entry['best_distance'], distance)
+        elapsed = time.perf_counter() - started
+
+        users = sorted(sightings.values(), key=lambda entry: entry['first_seen'])
+        present = [entry for entry in users if entry['sightings'] >= self.min_sightings]
+        marked = []
+        if present and not dry_run:
+            rows = []
+            for entry in present:
+                if started_at is None:
+                    at = datetime.now().time().replace(microsecond=0)
+                else:
+                    at = (datetime.combine(day, started_at) + timedelta(seconds=int(entry['first_seen']))).time()
+                rows.append((entry['user_id'], day, at))
+            marked = [row[0] for row in write_rows(self.db_config, rows)]
+
+        marked_ids = set(marked)
+        for entry in users:
+            if entry['sightings'] < self.min_sightings:
+                entry['status'] = 'too_few_sightings'
+            elif dry_run:
+                entry['status'] = 'present'
+            else:
+                entry['status'] = 'marked' if entry['user_id'] in marked_ids else 'already_marked'
+
+        return {
+            'video_seconds': frame_count / fps,
+            'frames_decoded': decoded,
+            'frames_sampled': sampled,
+            'faces_found': faces_found,
+            'seconds': elapsed,
+            'frames_per_second': decoded / elapsed if elapsed else 0.0,
+            'speed': (frame_count / fps) / elapsed if elapsed else 0.0,
+            'users': users,
+            'present': len(present),
+            'marked': len(marked),
+        }
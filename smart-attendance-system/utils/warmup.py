@@ -0,0 +1,59 @@
+"""Background startup work, so the first requests don't pay for it.
+
+A Warmup runs named steps (schema check, loading the detector and the
+gallery, ...) in order in a daemon thread and reports their progress for
+the readiness endpoint. A step that fails (say, the database is not up
+yet) is retried every ``retry_interval`` seconds until it succeeds.
+Requests are served throughout; anything they need that is not warm yet
+is loaded on demand, as before.
+"""
+import threading
+import time
+
+
+class Warmup:
+    def __init__(self, steps, retry_interval=5.0):
+        # (name, callable) pairs, run in order
+        self.steps = list(steps)
+        self.retry_interval = retry_interval
+        self._status = {name: {'status': 'pending', 'seconds': None, 'error': None} for name, _ in self.steps}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        """Start the steps in the background; later calls do nothing"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        for name, step in self.steps:
+            while True:
+                self._status[name]['status'] = 'running'
+                started = time.perf_counter()
+                try:
+                    step()
+                except Exception as e:
+                    print(f"Startup step {name} failed, retrying in {self.retry_interval:g}s: {e}")
+                    self._status[name].update(status='failed', error=str(e))
+                    time.sleep(self.retry_interval)
+                    continue
+                self._status[name].update(status='done', seconds=time.perf_counter() - started, error=None)
+                break
+        self._done.set()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until every step has finished; returns False on timeout"""
+        return self._done.wait(timeout)
+
+    def status(self):
+        return {'ready': self.ready,
+                'steps': [{'name': name, **self._status[name]} for name, _ in self.steps]}
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Video Attendance Script for Smart Attendance System
+Marks attendance for every enrolled student seen in a recorded session,
+sampling the video at a fixed rate and decoding it in parallel.
+
+Usage: python video_attendance.py lecture.mp4 [--sample-rate 1] [--min-sightings 3]
+                                  [--date YYYY-MM-DD] [--start HH:MM] [--dry-run] [--report out.csv]
+"""
+
+import argparse
+import csv
+from datetime import date, time as time_of_day
+from config.database import DatabaseConfig
+from utils.gallery import FaceGallery
+from utils.video_attendance import VideoAttendance
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('video', help='recorded session (any format OpenCV can read)')
+    parser.add_argument('--sample-rate', type=float, default=1.0, help='frames per second of video to check')
+    parser.add_argument('--min-sightings', type=int, default=3,
+                        help='sampled frames a student must be recognized in to count as present')
+    parser.add_argument('--workers', type=int, default=None, help='decoding processes (default: one per core)')
+    parser.add_argument('--date', type=date.fromisoformat, default=None, help='date of the session (default: today)')
+    parser.add_argument('--start', type=time_of_day.fromisoformat, default=None,
+                        help='time the recording started; attendance times are when each student was first seen')
+    parser.add_argument('--dry-run', action='store_true', help='report who was seen but write nothing')
+    parser.add_argument('--report', help='write the per-student results to this CSV file')
+    args = parser.parse_args()
+
+    db_config = DatabaseConfig()
+    job = VideoAttendance(db_config, FaceGallery(db_config), workers=args.workers,
+                          sample_rate=args.sample_rate, min_sightings=args.min_sightings)
+
+    print(f"Processing {args.video}{' (dry run)' if args.dry_run else ''}...")
+    try:
+        report = job.run(args.video, day=args.date, started_at=args.start, dry_run=args.dry_run)
+    except ValueError as e:
+        print(e)
+        return
+
+    for user in report['users']:
+        print(f"  {user['name']}: seen in {user['sightings']} frame(s) from {user['first_seen']:.0f}s, "
+              f"{user['status'].replace('_', ' ')}")
+
+    if args.report:
+        with open(args.report, 'w', newline='') as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=['user_id', 'name', 'sightings', 'first_seen',
+                                                             'best_distance', 'status'])
+            writer.writeheader()
+            writer.writerows(report['users'])
+
+    print(f"{report['frames_sampled']} of {report['frames_decoded']} frames checked, "
+          f"{report['faces_found']} faces, in {report['seconds']:.1f}s: "
+          f"{report['frames_per_second']:.0f} frames/s, {report['speed']:.1f}x real time")
+    print(f"{'Present' if args.dry_run else 'Marked'} {report['present'] if args.dry_run else report['marked']} "
+          f"student(s); {report['present']} seen at least {args.min_sightings} time(s)")
+
+if __name__ == "__main__":
+    main()